@@ -1,60 +1,81 @@
-import decimal
 import json
 import logging
 import os
 import time
-import uuid
-from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Optional
 from urllib.parse import unquote_plus
 
-import boto3
 from botocore.exceptions import BotoCoreError, ClientError
+from modules.capacity_governor.capacity_governor import WriteCapacityGovernor
+from modules.dynamodb_writer.dynamodb_writer import create_item_writer
+from modules.json_codec.json_codec import RawItem, decode_items
+from modules.metrics.metrics import emit_metrics
+from modules.process_item.process_item import (
+    process_json_items,
+    stamp_ingestion,
+)
+from modules.profiling.profiling import profiled
+from modules.record_processor.record_processor import (
+    FAILED,
+    MAX_CONCURRENT_RECORDS,
+    process_records,
+)
+from modules.station_registry.station_registry import station_registry
+from modules.storage.storage import item_table, object_store
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel("INFO")
 
-if __name__ != "__main__":
-    DYNAMODB_TABLE_NAME = os.environ["DYNAMODB_TABLE_NAME"]
-    REGION_NAME = os.environ["REGION_NAME"]
-
-TTL_DURATION = 86400 * 2  # 48 hours
-DATE_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
-ACCEPTED_PARAMS = ["no", "no2", "so2", "pm1", "pm10", "pm25", "o3", "co"]
-ACCEPTED_UNITS = ["µg/m³", "mg/m³"]
+# Time left before the Lambda timeout to report the unwritten records
+DEADLINE_MARGIN_SECONDS = 3.0
 
 
+@profiled
 def lambda_handler(event: dict, context: dict) -> dict:
     """
     AWS Lambda function handler.
     Processes incoming events, extracts records, and stores them in DynamoDB.
+    Events are either S3 event notifications or batches of SQS messages
+    holding S3 event notifications.
 
     Parameters:
     event (dict): Incoming event data
     context (dict): AWS Lambda context
 
     Returns:
-    dict: Response with status code and body message
+    dict: Response with status code, body message and the result
+    of each record, or the batch item failures for SQS events
     """
-    try:
-        # Initialize S3 client
-        s3_client = boto3.client("s3")
+    # SQS batches report their failed messages instead of a status code
+    if is_sqs_event(event):
+        return process_sqs_event(event, context)
 
-        # Initialize DynamoDB client
-        dynamodb = boto3.resource("dynamodb", region_name=REGION_NAME)
-        table = dynamodb.Table(
-            DYNAMODB_TABLE_NAME
-        )  # get table name from environment variable
+    try:
+        writer = create_writer(context)
+        registry = create_registry()
 
-        # Process each record
-        for record in event["Records"]:
-            process_record(record, s3_client, table)
+        # Process the records concurrently, sharing the writer
+        results = process_records(
+            event["Records"],
+            lambda record: process_record(record, writer, registry),
+            load_config()["record_concurrency"],
+        )
+        emit_metrics(writer.metrics(), {"TableName": writer.table_name})
 
+        if any(result["status"] == FAILED for result in results):
+            return {
+                "statusCode": 500,
+                "body": json.dumps("Error processing items: failed records"),
+                "records": results,
+            }
         return {
             "statusCode": 200,
             "body": json.dumps(
                 "Successfully processed items: ingested into DynamoDB!"
             ),
+            "records": results,
         }
     except (BotoCoreError, ClientError) as e:
         logging.error(f"Error interacting with Boto3 Client: {e}")
@@ -75,105 +96,222 @@ def lambda_handler(event: dict, context: dict) -> dict:
         }
 
 
-def process_record(record: dict, s3_client, table) -> None:
+def is_sqs_event(event: dict) -> bool:
     """
-    Process a single record, download the json from S3,
-    process each item, and store it in DynamoDB.
+    Check if the event is a batch of SQS messages.
 
     Parameters:
-    record (dict): The record to process
-    table: The DynamoDB table to store the item in
+    event (dict): Incoming event data
+
+    Returns:
+    bool: True if the records come from an SQS queue
     """
-    # Download and open the file from S3 that has triggered the Lambda function
-    bucket = record["s3"]["bucket"]["name"]
-    key = unquote_plus(record["s3"]["object"]["key"])
-    tmpkey = key.replace("/", "")
-    download_path = "/tmp/{}_{}".format(uuid.uuid4(), tmpkey)
-    s3_client.download_file(bucket, key, download_path)
-    log = f"JSON DOWNLOADED FROM S3 TO: {download_path}"
-    logging.info(log)
+    records = event.get("Records", [])
+    return len(records) > 0 and records[0].get("eventSource") == "aws:sqs"
 
-    with open(download_path, "r") as file:
-        s3_json = json.load(file, parse_float=decimal.Decimal)
 
-    # Process each item in the S3 JSON
-    skipped_items = 0
-    ingested_items = 0
-    for item in s3_json:
-        # Process the JSON item
-        processed_item = process_json_item(item)
-        if processed_item is None:
-            log = f"ITEM SKIPPED: {item}"
-            logging.info(log)
-            skipped_items += 1
+@lru_cache(maxsize=1)
+def load_config() -> dict:
+    """
+    Read the configuration from the environment variables,
+    once per execution environment, at the first invocation.
+
+    Returns:
+    dict: The configuration
+    """
+    # Provisioned, or auto-scaled maximum, write capacity of the table.
+    # Not set for on-demand tables.
+    write_capacity_units = os.environ.get("WRITE_CAPACITY_UNITS")
+    # Records processed at once, each holds its raw object in memory
+    record_concurrency = os.environ.get("RECORD_CONCURRENCY")
+    return {
+        "dynamodb_table_name": os.environ["DYNAMODB_TABLE_NAME"],
+        "station_table_name": os.environ["STATION_TABLE_NAME"],
+        "region_name": os.environ["REGION_NAME"],
+        "write_capacity_units": (
+            float(write_capacity_units) if write_capacity_units else None
+        ),
+        "record_concurrency": (
+            int(record_concurrency)
+            if record_concurrency
+            else MAX_CONCURRENT_RECORDS
+        ),
+    }
+
+
+def invocation_deadline(context) -> Optional[float]:
+    """
+    Get the time the writes of an invocation must stop,
+    a margin before the Lambda timeout.
+
+    Parameters:
+    context (LambdaContext | dict): AWS Lambda context, a dict locally
+
+    Returns:
+    float: The time.monotonic() deadline, None outside of Lambda
+    """
+    get_remaining_time = getattr(context, "get_remaining_time_in_millis", None)
+    if get_remaining_time is None:
+        return None
+    return (
+        time.monotonic()
+        + get_remaining_time() / 1000
+        - DEADLINE_MARGIN_SECONDS
+    )
+
+
+def create_writer(context):
+    """
+    Initialize the writer of the clean table,
+    shared by all records of an invocation.
+    The writer stops before the Lambda timeout, the records left
+    unwritten fail, so only their messages are retried.
+    The items are stamped with their ingestion time right before they
+    are written, after any wait for write capacity.
+
+    Parameters:
+    context (LambdaContext | dict): AWS Lambda context
+
+    Returns:
+    DynamoDBBatchWriter | ItemTable: The writer of the items
+    """
+    config = load_config()
+    table = item_table(config["dynamodb_table_name"], config["region_name"])
+    governor = WriteCapacityGovernor(config["write_capacity_units"])
+    return create_item_writer(
+        table, governor, invocation_deadline(context), stamp_ingestion
+    )
+
+
+def create_registry():
+    """
+    Get the registry of the station table,
+    shared by the invocations of the execution environment.
+
+    Returns:
+    StationRegistry: The station registry
+    """
+    config = load_config()
+    return station_registry(
+        config["station_table_name"], config["region_name"]
+    )
+
+
+def process_sqs_event(event: dict, context) -> dict:
+    """
+    Process a batch of SQS messages, each holding an S3 event notification.
+    The records of all messages are processed concurrently.
+    Messages with a failed record are reported, so only those are retried
+    by SQS. Errors outside of a single message are raised to retry
+    the whole batch.
+
+    Parameters:
+    event (dict): Incoming SQS event data
+    context (LambdaContext | dict): AWS Lambda context
+
+    Returns:
+    dict: Response with the batch item failures
+    """
+    writer = create_writer(context)
+    registry = create_registry()
+
+    failed_messages = set()
+    records = []
+    message_ids = []
+    for message in event["Records"]:
+        try:
+            s3_event = json.loads(message["body"])
+        except Exception as e:
+            logging.error(
+                f"Error processing message {message['messageId']}: {e}"
+            )
+            failed_messages.add(message["messageId"])
             continue
+        # S3 test events, sent on notification setup, have no records
+        for record in s3_event.get("Records", []):
+            records.append(record)
+            message_ids.append(message["messageId"])
+
+    results = process_records(
+        records,
+        lambda record: process_record(record, writer, registry),
+        load_config()["record_concurrency"],
+    )
+    for message_id, result in zip(message_ids, results):
+        if result["status"] == FAILED:
+            failed_messages.add(message_id)
 
-        # Ingest the processed item into DynamoDB
-        table.put_item(Item=processed_item)
-        ingested_items += 1
+    # In the order of the messages
+    batch_item_failures = [
+        {"itemIdentifier": message["messageId"]}
+        for message in event["Records"]
+        if message["messageId"] in failed_messages
+    ]
 
     log = (
-        f"INGESTED ITEMS INTO DYNAMODB: {ingested_items}, "
-        f"SKIPPED ITEMS: {skipped_items}"
+        f"PROCESSED MESSAGES: {len(event['Records'])}, "
+        f"FAILED MESSAGES: {len(batch_item_failures)}"
     )
     logging.info(log)
+    emit_metrics(writer.metrics(), {"TableName": writer.table_name})
+    return {"batchItemFailures": batch_item_failures}
 
 
-def process_json_item(item: json) -> json:
+def process_record(record: dict, writer, registry) -> dict:
     """
-    Process a single json item.
-    Check for validity and clean the item.
+    Process a single record, download the json from S3,
+    process each item, and store it in DynamoDB.
+    The stations of the items are upserted in the station table
+    if they are new or changed.
 
     Parameters:
-    item (json): The item to process
-    """
-    # Check validity: check if the item has right units,
-    # strict positive values or is a an accepted parameter
-    if (
-        (item["value"] <= 0)
-        or (item["parameter"] not in ACCEPTED_PARAMS)
-        or (item["unit"] not in ACCEPTED_UNITS)
-    ):
-        # Skip the item if it's not valid
-        return None
-
-    # Check if the item has a valid location string,
-    # otherwise set it to "Unknown"
-    if item["location"] is None:
-        item["location"] = "Unknown"
-    else:
-        # Trim white spaces for location attribute
-        item["location"] = item["location"].strip()
-
-    # Trim white spaces for city attribute
-    if item["city"] is not None:
-        item["city"] = item["city"].strip()
+    record (dict): The record to process
+    writer (DynamoDBBatchWriter | ItemTable): The writer to store
+    the items with
+    registry (StationRegistry): The registry of the station table
 
-    # Convert the units to micrograms per cubic meter
-    if item["unit"] == "mg/m³":
-        item["value"] *= 1000
-        item["unit"] = "µg/m³"
-    elif item["unit"] != "µg/m³":
-        raise ValueError(f"Unknown unit detected: {item['unit']}")
+    Returns:
+    dict: The numbers of ingested and skipped items
+    """
+    # Download the file from S3 that has triggered the Lambda function
+    bucket = record["s3"]["bucket"]["name"]
+    key = unquote_plus(record["s3"]["object"]["key"])
+    body = object_store(bucket).get_object(key)
+    if body is None:
+        raise FileNotFoundError(f"Object {key} not found in bucket {bucket}")
+    logging.info(f"JSON DOWNLOADED FROM S3: {bucket}/{key}")
 
-    # Convert the coordinates to latitude and longitude attributes
-    item["latitude"] = item["coordinates"]["latitude"]
-    item["longitude"] = item["coordinates"]["longitude"]
-    del item["coordinates"]
+    # Validate the raw schema of each item while parsing, numbers as Decimal
+    # for DynamoDB. Invalid items are skipped.
+    s3_json, errors = decode_items(body, RawItem)
+    for error in errors:
+        logging.error(f"Invalid item in {bucket}/{key}: {error}")
 
-    # Define a Time to Live (TTL) epoch time attribute
-    date_object = datetime.strptime(item["lastUpdated"], DATE_FORMAT)
-    item["expireAt"] = int(time.mktime(date_object.timetuple())) + TTL_DURATION
+    # Process each item in the S3 JSON
+    stations = {}
+    processed_items, skipped_items = process_json_items(s3_json, stations)
+    skipped_items += len(errors)
+    registry.upsert(stations.values())
 
-    # Define a ingestedAt time attribute using the current UTC time
-    item["ingestedAt"] = datetime.now(timezone.utc).strftime(DATE_FORMAT)
+    # Ingest the processed items into DynamoDB
+    ingested_items = writer.put_items(processed_items)
 
-    return item
+    log = (
+        f"INGESTED ITEMS INTO DYNAMODB: {ingested_items}, "
+        f"SKIPPED ITEMS: {skipped_items}"
+    )
+    logging.info(log)
+    return {"ingestedItems": ingested_items, "skippedItems": skipped_items}
 
 
 if __name__ == "__main__":
-    DYNAMODB_TABLE_NAME = "table-clean"
-    REGION_NAME = "us-east-1"
+    os.environ["DYNAMODB_TABLE_NAME"] = "table-clean"
+    os.environ["STATION_TABLE_NAME"] = "table-stations"
+    os.environ["REGION_NAME"] = "us-east-1"
+    os.environ["WRITE_CAPACITY_UNITS"] = "10"
+
+    # Read and write data/00_storage instead of S3 and DynamoDB
+    # os.environ["STORAGE_BACKEND"] = "local"
 
     event = {
         "Records": [
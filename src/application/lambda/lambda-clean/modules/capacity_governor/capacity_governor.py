@@ -0,0 +1,178 @@
+import logging
+import threading
+import time
+from typing import Optional
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+TARGET_UTILIZATION = 0.9  # Stay just under the capacity limit
+BURST_SECONDS = 1.0  # Tokens the bucket holds, in seconds of rate
+MIN_RATE = 1.0  # capacity units per second
+DECREASE_FACTOR = 0.5  # Rate multiplier on throttling
+INCREASE_FRACTION = 0.05  # Fraction of the max rate added on success
+
+
+class WriteCapacityGovernor:
+    """
+    Client-side token bucket rate limiter for DynamoDB writes.
+    Each request acquires its estimated capacity units before it is sent,
+    the estimate is corrected with the ConsumedCapacity of the response.
+    Until the first throttled request, requests are not delayed, so the
+    burst capacity of the table absorbs short spikes. From then on they are
+    paced, and the rate adapts to throttling: it is halved when a request
+    is throttled and increases additively back to the capacity limit
+    on success.
+    Without capacity limit, e.g. for on-demand tables, requests are never
+    delayed but the consumed capacity and throttling are still recorded.
+    The governor is shared by threads, they only hold its lock to reserve
+    capacity units, not while they wait for them.
+    """
+
+    def __init__(
+        self,
+        capacity_units: Optional[float] = None,
+        target_utilization: float = TARGET_UTILIZATION,
+        burst_seconds: float = BURST_SECONDS,
+        min_rate: float = MIN_RATE,
+        pace_from_start: bool = False,
+    ) -> None:
+        """
+        Parameters:
+        capacity_units (float, optional): The provisioned, or auto-scaled
+        maximum, write capacity units the writer may consume,
+        e.g. its share of the table capacity. Unlimited if None.
+        target_utilization (float): Fraction of the capacity to consume
+        burst_seconds (float): Seconds of rate the token bucket can hold
+        min_rate (float): The minimum rate in capacity units per second
+        pace_from_start (bool): Pace the requests before any throttling,
+        e.g. for backfills that must leave the burst capacity to
+        the Lambda functions
+        """
+        self.max_rate = (
+            capacity_units * target_utilization if capacity_units else None
+        )
+        self.rate = self.max_rate
+        self.min_rate = min_rate
+        self.burst_seconds = burst_seconds
+        self.tokens = self.max_rate * burst_seconds if self.max_rate else 0.0
+        self.units_per_item = 1.0
+        self.pacing = pace_from_start
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.consumed_capacity = 0.0
+        self.throttled_requests = 0
+        self.wait_seconds = 0.0
+
+    def acquire(
+        self, num_items: int, deadline: Optional[float] = None
+    ) -> Optional[float]:
+        """
+        Reserve the estimated capacity units of a request and wait
+        until the bucket has refilled them.
+
+        Parameters:
+        num_items (int): The number of items written by the request
+        deadline (float, optional): The time.monotonic() time the request
+        must be sent before
+
+        Returns:
+        float | None: The estimated capacity units of the request,
+        None if it could not be sent before the deadline
+        """
+        with self._lock:
+            estimate = num_items * self.units_per_item
+            wait = 0.0
+            if self.rate is not None and self.pacing:
+                self._refill()
+                # The units are reserved now, the bucket goes into debt
+                # and the next requests wait for it to be repaid.
+                # Requests larger than the bucket would never fit,
+                # they wait for a full bucket.
+                wait = max(
+                    0.0,
+                    (min(estimate, self._bucket_size()) - self.tokens)
+                    / self.rate,
+                )
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return None
+            if self.rate is not None and self.pacing:
+                self.tokens -= estimate
+                self.wait_seconds += wait
+        if wait > 0:
+            time.sleep(wait)
+        return estimate
+
+    def record_consumed(
+        self, estimate: float, consumed: Optional[float], num_items: int
+    ) -> None:
+        """
+        Correct the tokens taken for a request with its consumed capacity.
+
+        Parameters:
+        estimate (float): The estimated capacity units of the request
+        consumed (float, optional): The ConsumedCapacity of the response,
+        None if the response did not report it
+        num_items (int): The number of items written by the request
+        """
+        with self._lock:
+            if consumed is None:
+                consumed = estimate
+            self.consumed_capacity += consumed
+            if self.rate is not None:
+                self.tokens -= consumed - estimate
+            if num_items > 0 and consumed > 0:
+                self.units_per_item = consumed / num_items
+
+    def record_success(self) -> None:
+        """
+        Increase the rate additively after a request without throttling.
+        """
+        with self._lock:
+            if self.rate is not None:
+                self.rate = min(
+                    self.max_rate,
+                    self.rate + self.max_rate * INCREASE_FRACTION,
+                )
+
+    def record_throttle(self) -> None:
+        """
+        Start pacing, or decrease the rate multiplicatively,
+        after a throttled request.
+        """
+        with self._lock:
+            self.throttled_requests += 1
+            if self.rate is not None:
+                if not self.pacing:
+                    # The burst capacity of the table is used up
+                    self.pacing = True
+                    self._refilled_at = time.monotonic()
+                self.rate = max(self.min_rate, self.rate * DECREASE_FACTOR)
+                self.tokens = min(self.tokens, 0.0)
+
+    def metrics(self) -> dict:
+        """
+        Get the capacity metrics recorded by the governor.
+
+        Returns:
+        dict: Metric names and values
+        """
+        return {
+            "ConsumedWriteCapacity": self.consumed_capacity,
+            "ThrottledWriteRequests": self.throttled_requests,
+            "WriteThrottleWaitSeconds": self.wait_seconds,
+        }
+
+    def _bucket_size(self) -> float:
+        return self.rate * self.burst_seconds
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self._bucket_size(),
+            self.tokens + (now - self._refilled_at) * self.rate,
+        )
+        self._refilled_at = now
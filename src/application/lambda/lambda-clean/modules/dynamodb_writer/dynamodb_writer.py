@@ -0,0 +1,272 @@
+import logging
+import threading
+import time
+from typing import Callable, Iterable, List, Optional, Sequence
+
+from modules.capacity_governor.capacity_governor import WriteCapacityGovernor
+from modules.storage.storage import DynamoDBTable, ItemTable
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+MAX_BATCH_SIZE = 25  # BatchWriteItem limit
+MAX_RETRIES = 8
+RETRY_BASE_DELAY = 0.05  # seconds
+KEY_ATTRIBUTES = ("location", "lastUpdated")
+THROTTLING_ERROR_CODES = (
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+)
+
+
+class WriteDeadlineExceeded(Exception):
+    """
+    Raised when the remaining items of a put could not be written
+    before the deadline of the writer.
+    """
+
+    def __init__(self, written_items: int, unwritten_items: List[dict]):
+        """
+        Parameters:
+        written_items (int): The number of items of the put written
+        unwritten_items (List[dict]): The items left unwritten
+        """
+        super().__init__(
+            f"{len(unwritten_items)} items left unwritten at the deadline, "
+            f"{written_items} items written"
+        )
+        self.written_items = written_items
+        self.unwritten_items = unwritten_items
+
+
+class DynamoDBBatchWriter:
+    """
+    Writes items to a DynamoDB table with BatchWriteItem requests.
+    Unprocessed items are retried with exponential backoff and the
+    requests are paced by a write capacity governor, shared by all the
+    items written with this writer. A writer is shared by the threads
+    processing the records of an invocation.
+    With a deadline, e.g. before the Lambda timeout, the writer stops
+    instead of waiting for capacity past it.
+    With a stamp function, the items of each request are stamped right
+    before it is sent, after any wait for capacity.
+    """
+
+    def __init__(
+        self,
+        table,
+        governor: Optional[WriteCapacityGovernor] = None,
+        key_attributes: Sequence[str] = KEY_ATTRIBUTES,
+        max_retries: int = MAX_RETRIES,
+        deadline: Optional[float] = None,
+        stamp: Optional[Callable[[List[dict]], None]] = None,
+    ) -> None:
+        """
+        Parameters:
+        table: The DynamoDB table resource to write to
+        governor (WriteCapacityGovernor, optional): The governor pacing
+        the requests. Requests are not paced if None.
+        key_attributes (Sequence[str]): The table key attribute names,
+        used to deduplicate items within a batch.
+        max_retries (int): Max retries of unprocessed items per batch.
+        deadline (float, optional): The time.monotonic() time no request
+        is sent after. No deadline if None.
+        stamp (Callable[[List[dict]], None], optional): Updates the items
+        of a request in place right before it is sent, e.g. with their
+        ingestion time
+        """
+        self.table_name = table.name
+        self.client = table.meta.client
+        self.governor = governor or WriteCapacityGovernor()
+        self.key_attributes = tuple(key_attributes)
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.stamp = stamp
+        self.written_items = 0
+        self._lock = threading.Lock()
+
+        # Count the throttled requests retried by botocore itself
+        self.client.meta.events.register(
+            "needs-retry.dynamodb.BatchWriteItem", self._count_throttling
+        )
+
+    def put_items(self, items: Iterable[dict]) -> int:
+        """
+        Write items to the table in batches of up to 25 items.
+        Items with the same key overwrite each other, last one wins,
+        as they would with successive PutItem calls.
+
+        Parameters:
+        items (Iterable[dict]): The items to write
+
+        Returns:
+        int: The number of items written
+
+        Raises:
+        WriteDeadlineExceeded: If the deadline is reached, with the items
+        left unwritten, so the caller can retry them
+        """
+        written_items = 0
+        items = iter(items)
+        batch = {}
+        for item in items:
+            key = tuple(item[name] for name in self.key_attributes)
+            batch[key] = item
+            if len(batch) == MAX_BATCH_SIZE:
+                unwritten_items = self._write_batch(list(batch.values()))
+                written_items += len(batch) - len(unwritten_items)
+                if unwritten_items:
+                    raise WriteDeadlineExceeded(
+                        written_items, [*unwritten_items, *items]
+                    )
+                batch = {}
+        if batch:
+            unwritten_items = self._write_batch(list(batch.values()))
+            written_items += len(batch) - len(unwritten_items)
+            if unwritten_items:
+                raise WriteDeadlineExceeded(written_items, unwritten_items)
+        return written_items
+
+    def _write_batch(self, items: List[dict]) -> List[dict]:
+        """
+        Write a single batch, retrying unprocessed items,
+        until the deadline.
+
+        Parameters:
+        items (List[dict]): At most 25 items with distinct keys
+
+        Returns:
+        List[dict]: The items left unwritten at the deadline
+        """
+        request_items = {
+            self.table_name: [{"PutRequest": {"Item": item}} for item in items]
+        }
+        retries = 0
+        while request_items:
+            num_items = len(request_items[self.table_name])
+            estimate = self.governor.acquire(num_items, self.deadline)
+            if estimate is None:
+                break
+            if self.stamp is not None:
+                self.stamp(
+                    [
+                        request["PutRequest"]["Item"]
+                        for request in request_items[self.table_name]
+                    ]
+                )
+            response = self.client.batch_write_item(
+                RequestItems=request_items,
+                ReturnConsumedCapacity="INDEXES",
+            )
+            self.governor.record_consumed(
+                estimate, self._consumed_capacity(response), num_items
+            )
+
+            request_items = response.get("UnprocessedItems") or {}
+            if not request_items:
+                self.governor.record_success()
+            else:
+                self.governor.record_throttle()
+                retries += 1
+                if retries > self.max_retries:
+                    raise RuntimeError(
+                        f"Unprocessed items left after {self.max_retries} "
+                        f"retries for table: {self.table_name}"
+                    )
+                delay = RETRY_BASE_DELAY * 2**retries
+                if (
+                    self.deadline is not None
+                    and time.monotonic() + delay > self.deadline
+                ):
+                    break
+                time.sleep(delay)
+
+        unwritten_items = [
+            request["PutRequest"]["Item"]
+            for request in request_items.get(self.table_name, [])
+        ]
+        with self._lock:
+            self.written_items += len(items) - len(unwritten_items)
+        return unwritten_items
+
+    def metrics(self) -> dict:
+        """
+        Get the write metrics of the writer and its governor.
+
+        Returns:
+        dict: Metric names and values
+        """
+        return {"WrittenItems": self.written_items, **self.governor.metrics()}
+
+    def _consumed_capacity(self, response: dict) -> Optional[float]:
+        """
+        Get the consumed capacity units of the most consumed of the table
+        and its global secondary indexes in a response.
+        The indexes are provisioned with the write capacity of the table,
+        and the first of them to run out of capacity throttles the writes.
+
+        Parameters:
+        response (dict): The BatchWriteItem response
+
+        Returns:
+        float: The consumed capacity units, None if not reported
+        """
+        if "ConsumedCapacity" not in response:
+            return None
+        return sum(
+            max(
+                [
+                    consumed.get("Table", consumed).get("CapacityUnits", 0),
+                    *(
+                        index.get("CapacityUnits", 0)
+                        for index in consumed.get(
+                            "GlobalSecondaryIndexes", {}
+                        ).values()
+                    ),
+                ]
+            )
+            for consumed in response["ConsumedCapacity"]
+        )
+
+    def _count_throttling(self, response=None, **kwargs) -> None:
+        """
+        Record throttled requests before botocore retries them.
+
+        Parameters:
+        response (tuple, optional): The HTTP response and parsed response
+        """
+        if response is None:
+            return
+        error_code = response[1].get("Error", {}).get("Code")
+        if error_code in THROTTLING_ERROR_CODES:
+            self.governor.record_throttle()
+
+
+def create_item_writer(
+    table: ItemTable,
+    governor: Optional[WriteCapacityGovernor] = None,
+    deadline: Optional[float] = None,
+    stamp: Optional[Callable[[List[dict]], None]] = None,
+):
+    """
+    Create the writer of a table. DynamoDB tables are written in paced
+    batches, the local tables write their items themselves, unpaced.
+
+    Parameters:
+    table (ItemTable): The table to write to
+    governor (WriteCapacityGovernor, optional): The governor pacing
+    the requests to DynamoDB
+    deadline (float, optional): The time.monotonic() time no request
+    to DynamoDB is sent after
+    stamp (Callable[[List[dict]], None], optional): Updates the items
+    of a request to DynamoDB in place right before it is sent
+
+    Returns:
+    DynamoDBBatchWriter | ItemTable: The writer, with put_items and metrics
+    """
+    if isinstance(table, DynamoDBTable):
+        return DynamoDBBatchWriter(
+            table.table, governor, deadline=deadline, stamp=stamp
+        )
+    return table
@@ -0,0 +1,441 @@
+import json
+import logging
+import random
+import time
+from decimal import Decimal
+from functools import lru_cache
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypedDict,
+    Union,
+    get_args,
+    get_origin,
+    get_type_hints,
+    is_typeddict,
+)
+
+# Keep this module identical in lambda-raw and lambda-clean,
+# the Lambda functions are built from their own folder only.
+# make shared-modules fails when the copies differ.
+
+# msgspec is a fast native JSON library, validating typed schemas while
+# parsing. Fall back to the standard library if it is not installed.
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+
+class DecodeError(ValueError):
+    """
+    Raised when a JSON payload is invalid or does not match its schema.
+    """
+
+
+# OpenAQ /v2/latest API response
+class Coordinates(TypedDict):
+    latitude: float
+    longitude: float
+
+
+class LatestMeasurement(TypedDict):
+    parameter: str
+    value: float
+    lastUpdated: str
+    unit: str
+
+
+class LatestResult(TypedDict):
+    location: Optional[str]
+    city: Optional[str]
+    country: Optional[str]
+    coordinates: Optional[Coordinates]
+    measurements: List[LatestMeasurement]
+
+
+class LatestResponse(TypedDict):
+    results: List[LatestResult]
+
+
+# Raw S3 object items, numbers as Decimal for DynamoDB
+class RawCoordinates(TypedDict):
+    latitude: Decimal
+    longitude: Decimal
+
+
+class RawItem(TypedDict):
+    location: Optional[str]
+    city: Optional[str]
+    country: Optional[str]
+    coordinates: Optional[RawCoordinates]
+    parameter: str
+    value: Decimal
+    lastUpdated: str
+    unit: str
+
+
+def decode(data: Union[bytes, str], type: Any = None) -> Any:
+    """
+    Decode a JSON payload, validating it against a schema if given.
+    Fields missing from the schema are dropped and numbers are converted
+    to the type of their field, with msgspec or the standard library.
+
+    Parameters:
+    data (bytes | str): The JSON payload
+    type (Any, optional): The schema, e.g. LatestResponse
+
+    Returns:
+    Any: The decoded payload, objects are decoded as dicts
+    """
+    if msgspec is not None:
+        try:
+            return _decoder(type).decode(data)
+        except msgspec.DecodeError as e:
+            raise DecodeError(str(e)) from e
+
+    value = _loads(data, type)
+    if type is None:
+        return value
+    try:
+        return _converter(type)(value)
+    except _SchemaError as e:
+        raise DecodeError(_schema_error_message(e)) from None
+
+
+def decode_items(
+    data: Union[bytes, str], item_type: Any, field: Optional[str] = None
+) -> Tuple[List[Any], List[str]]:
+    """
+    Decode a JSON array, or the array in a field of a JSON object,
+    validating each item against a schema. An invalid item, e.g. with
+    a null coordinate, is skipped instead of failing the whole payload.
+
+    Parameters:
+    data (bytes | str): The JSON payload
+    item_type (Any): The schema of the items, e.g. LatestResult
+    field (str, optional): The field holding the array, e.g. results
+
+    Returns:
+    Tuple[List[Any], List[str]]: The valid items, objects are decoded
+    as dicts, and the errors of the invalid items
+    """
+    # The path of the items in the payload, e.g. $.results
+    path = f"$.{field}" if field is not None else "$"
+    items = []
+    errors = []
+    if msgspec is not None:
+        try:
+            if field is not None:
+                data = _FIELDS_DECODER.decode(data).get(field)
+                if data is None:
+                    raise DecodeError(
+                        f"Object missing required field `{field}`"
+                    )
+            # The items are only validated once split
+            raw_items = _RAW_ITEMS_DECODER.decode(data)
+        except msgspec.DecodeError as e:
+            raise DecodeError(str(e)) from e
+
+        decoder = _decoder(item_type)
+        for i, raw_item in enumerate(raw_items):
+            try:
+                items.append(decoder.decode(raw_item))
+            except msgspec.DecodeError as e:
+                errors.append(_item_error(str(e), f"{path}[{i}]"))
+        return items, errors
+
+    value = _loads(data, item_type)
+    if field is not None:
+        if not isinstance(value, dict):
+            raise DecodeError(f"Expected `object`, got `{_json_type(value)}`")
+        if field not in value:
+            raise DecodeError(f"Object missing required field `{field}`")
+        value = value[field]
+    if not isinstance(value, list):
+        raise DecodeError(f"Expected `array`, got `{_json_type(value)}`")
+
+    convert = _converter(item_type)
+    for i, item in enumerate(value):
+        try:
+            items.append(convert(item))
+        except _SchemaError as e:
+            errors.append(
+                _item_error(_schema_error_message(e), f"{path}[{i}]")
+            )
+    return items, errors
+
+
+def encode(obj: Any, enc_hook: Optional[Callable] = None) -> bytes:
+    """
+    Encode an object to JSON.
+
+    Parameters:
+    obj (Any): The object to encode, Decimals are encoded as numbers
+    enc_hook (Callable, optional): Converts unsupported objects,
+    e.g. records, to supported ones
+
+    Returns:
+    bytes: The UTF-8 JSON payload
+    """
+    if msgspec is not None:
+        encoder = msgspec.json.Encoder(
+            enc_hook=enc_hook, decimal_format="number"
+        )
+        return encoder.encode(obj)
+
+    def default(value):
+        if isinstance(value, Decimal):
+            return float(value)
+        if enc_hook is not None:
+            return enc_hook(value)
+        raise TypeError(f"Object of type {value.__class__} is not supported")
+
+    return json.dumps(obj, default=default, ensure_ascii=False).encode()
+
+
+if msgspec is not None:
+    # The fields of an object and the items of an array, not decoded yet
+    _FIELDS_DECODER = msgspec.json.Decoder(Dict[str, msgspec.Raw])
+    _RAW_ITEMS_DECODER = msgspec.json.Decoder(List[msgspec.Raw])
+
+    @lru_cache(maxsize=None)
+    def _decoder(type: Any) -> "msgspec.json.Decoder":
+        """
+        Create the msgspec decoder of a schema, once per schema.
+
+        Parameters:
+        type (Any): The schema, None for any JSON value
+
+        Returns:
+        msgspec.json.Decoder: The decoder
+        """
+        return msgspec.json.Decoder(Any if type is None else type)
+
+
+def _loads(data: Union[bytes, str], type: Any) -> Any:
+    """
+    Parse a JSON payload with the standard library.
+    Decimal schemas keep the exact decimal value, as msgspec does.
+
+    Parameters:
+    data (bytes | str): The JSON payload
+    type (Any): The schema, or the schema of its items
+
+    Returns:
+    Any: The parsed payload
+    """
+    parse_float = Decimal if type in (RawItem, List[RawItem]) else None
+    try:
+        return json.loads(data, parse_float=parse_float)
+    except json.JSONDecodeError as e:
+        raise DecodeError(str(e)) from e
+
+
+class _SchemaError(Exception):
+    """
+    Raised by the standard library converters, with the path of the
+    invalid value collected while unwinding.
+    """
+
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+        self.path = []
+
+
+def _schema_error_message(error: _SchemaError) -> str:
+    # The same message as msgspec, e.g. Expected `float`, got `null`
+    # - at `$.coordinates.latitude`
+    if not error.path:
+        return str(error)
+    return f"{error} - at `$" + "".join(error.path) + "`"
+
+
+def _item_error(message: str, path: str) -> str:
+    # Prefix the path of the invalid value with the path of its item
+    if " - at `$" in message:
+        return message.replace(" - at `$", f" - at `{path}", 1)
+    return f"{message} - at `{path}`"
+
+
+def _json_type(value: Any) -> str:
+    # The JSON type name of a parsed value, as in the msgspec errors
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, (float, Decimal)):
+        return "float"
+    if isinstance(value, str):
+        return "str"
+    if isinstance(value, list):
+        return "array"
+    return "object"
+
+
+@lru_cache(maxsize=None)
+def _converter(expected: Any) -> Callable[[Any], Any]:
+    """
+    Compile a schema to a converter function, once per schema,
+    decoding a parsed value as msgspec would: fields missing from
+    the schema are dropped and numbers are converted to the type
+    of their field.
+
+    Parameters:
+    expected (Any): The schema
+
+    Returns:
+    Callable: Returns the converted value, raises _SchemaError
+    if the value does not match the schema
+    """
+    origin = get_origin(expected)
+    if origin is Union:
+        (inner,) = [arg for arg in get_args(expected) if arg is not type(None)]
+        convert_inner = _converter(inner)
+
+        def convert(value):
+            return None if value is None else convert_inner(value)
+
+    elif origin is list:
+        convert_item = _converter(get_args(expected)[0])
+
+        def convert(value):
+            if not isinstance(value, list):
+                raise _SchemaError(
+                    f"Expected `array`, got `{_json_type(value)}`"
+                )
+            items = []
+            for i, item in enumerate(value):
+                try:
+                    items.append(convert_item(item))
+                except _SchemaError as e:
+                    e.path.insert(0, f"[{i}]")
+                    raise
+            return items
+
+    elif is_typeddict(expected):
+        fields = [
+            (key, _converter(key_type))
+            for key, key_type in get_type_hints(expected).items()
+        ]
+
+        def convert(value):
+            if not isinstance(value, dict):
+                raise _SchemaError(
+                    f"Expected `object`, got `{_json_type(value)}`"
+                )
+            converted = {}
+            for key, convert_field in fields:
+                if key not in value:
+                    raise _SchemaError(
+                        f"Object missing required field `{key}`"
+                    )
+                try:
+                    converted[key] = convert_field(value[key])
+                except _SchemaError as e:
+                    e.path.insert(0, f".{key}")
+                    raise
+            return converted
+
+    elif expected in (float, Decimal):
+
+        def convert(value):
+            if type(value) not in (int, float, Decimal):
+                raise _SchemaError(
+                    f"Expected `{expected.__name__.lower()}`, "
+                    f"got `{_json_type(value)}`"
+                )
+            return expected(value)
+
+    else:
+
+        def convert(value):
+            if type(value) is not expected:
+                raise _SchemaError(
+                    f"Expected `{expected.__name__}`, "
+                    f"got `{_json_type(value)}`"
+                )
+            return value
+
+    return convert
+
+
+def _benchmark_payload(num_results: int) -> bytes:
+    """
+    Create an OpenAQ /v2/latest response of the given number of results,
+    with 8 measurements per result.
+    """
+    parameters = ["pm25", "pm10", "no2", "o3", "so2", "co", "no", "pm1"]
+    results = [
+        {
+            "location": f"Station {i}",
+            "city": "Brussels",
+            "country": "BE",
+            "coordinates": {
+                "latitude": 50 + random.random(),
+                "longitude": 4 + random.random(),
+            },
+            "measurements": [
+                {
+                    "parameter": parameter,
+                    "value": random.random() * 100,
+                    "lastUpdated": "2024-05-19T21:00:00+00:00",
+                    "unit": "µg/m³",
+                }
+                for parameter in parameters
+            ],
+        }
+        for i in range(num_results)
+    ]
+    return json.dumps({"results": results}).encode()
+
+
+if __name__ == "__main__":
+    # Benchmark the codec against the standard library,
+    # at the OpenAQ results limit of lambda-raw.
+    payload = _benchmark_payload(20000)
+    items = [
+        {
+            **{k: v for k, v in result.items() if k != "measurements"},
+            **measurement,
+        }
+        for result in json.loads(payload)["results"]
+        for measurement in result["measurements"]
+    ]
+    raw_payload = json.dumps(items).encode()
+    backend = "msgspec" if msgspec is not None else "json"
+    print(f"Payload: {len(payload) / 1e6:.1f} MB, codec backend: {backend}")
+
+    benchmarks = [
+        ("decode API (stdlib)", lambda: json.loads(payload)),
+        ("decode API (codec)", lambda: decode(payload, LatestResponse)),
+        (
+            "decode API by result (codec)",
+            lambda: decode_items(payload, LatestResult, "results"),
+        ),
+        (
+            "decode raw (stdlib)",
+            lambda: json.loads(raw_payload, parse_float=Decimal),
+        ),
+        ("decode raw (codec)", lambda: decode(raw_payload, List[RawItem])),
+        (
+            "decode raw by item (codec)",
+            lambda: decode_items(raw_payload, RawItem),
+        ),
+        ("encode raw (stdlib)", lambda: json.dumps(items).encode()),
+        ("encode raw (codec)", lambda: encode(items)),
+    ]
+    for name, function in benchmarks:
+        start = time.perf_counter()
+        function()
+        print(f"{name}: {time.perf_counter() - start:.3f} s")
@@ -0,0 +1,48 @@
+import json
+import time
+from typing import Dict, Optional
+
+METRICS_NAMESPACE = "OpenAQ"
+METRIC_UNITS = {
+    "ConsumedWriteCapacity": "Count",
+    "ThrottledWriteRequests": "Count",
+    "WriteThrottleWaitSeconds": "Seconds",
+    "WrittenItems": "Count",
+}
+
+
+def emit_metrics(
+    metrics: Dict[str, float],
+    dimensions: Optional[Dict[str, str]] = None,
+    namespace: str = METRICS_NAMESPACE,
+) -> None:
+    """
+    Emit metrics as a CloudWatch Embedded Metric Format log line.
+    CloudWatch extracts the metrics from the Lambda logs,
+    no PutMetricData call or permission is needed.
+
+    Parameters:
+    metrics (Dict[str, float]): Metric names and values
+    dimensions (Dict[str, str], optional): Dimension names and values
+    namespace (str): The CloudWatch metrics namespace
+    """
+    dimensions = dimensions or {}
+    log = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": namespace,
+                    "Dimensions": [list(dimensions.keys())],
+                    "Metrics": [
+                        {"Name": name, "Unit": METRIC_UNITS.get(name, "None")}
+                        for name in metrics
+                    ],
+                }
+            ],
+        },
+        **dimensions,
+        **metrics,
+    }
+    # EMF logs must be written to stdout as is, without logging prefix
+    print(json.dumps(log))
@@ -0,0 +1,191 @@
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from modules.measurement.measurement import (
+    Measurement,
+    Station,
+    parse_timestamp,
+)
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+TTL_DURATION = 86400 * 2  # 48 hours
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+ACCEPTED_PARAMS = ["no", "no2", "so2", "pm1", "pm10", "pm25", "o3", "co"]
+ACCEPTED_UNITS = ["µg/m³", "mg/m³"]
+
+
+def process_json_items(
+    s3_json: list, stations: Optional[Dict[tuple, Station]] = None
+) -> Tuple[List[dict], int]:
+    """
+    Process all json items of a raw S3 object.
+    The items of a same station share one cleaned station.
+
+    Parameters:
+    s3_json (list): The items of the raw S3 object
+    stations (Dict[tuple, Station], optional): Collects the cleaned
+    stations by raw station key, e.g. to upsert them in the station table
+
+    Returns:
+    tuple: The processed items and the number of skipped items
+    """
+    if stations is None:
+        stations = {}
+    ingested_at = datetime.now(timezone.utc).strftime(DATE_FORMAT)
+
+    processed_items = []
+    skipped_items = 0
+    for item in s3_json:
+        # Process the JSON item
+        processed_item = process_json_item(item, stations, ingested_at)
+        if processed_item is None:
+            log = f"ITEM SKIPPED: {item}"
+            logging.info(log)
+            skipped_items += 1
+            continue
+        processed_items.append(processed_item)
+    return processed_items, skipped_items
+
+
+def process_json_item(
+    item: json,
+    stations: Optional[Dict[tuple, Station]] = None,
+    ingested_at: Optional[str] = None,
+) -> json:
+    """
+    Process a single json item.
+    Check for validity and clean the item.
+
+    Parameters:
+    item (json): The item to process
+    stations (Dict[tuple, Station], optional): The cleaned stations
+    by raw station key, shared by the items of a raw S3 object
+    ingested_at (str, optional): The ingestion time, defaults to now
+    """
+    # Check validity: check if the item has right units,
+    # strict positive values or is a an accepted parameter
+    if (
+        (item["value"] <= 0)
+        or (item["parameter"] not in ACCEPTED_PARAMS)
+        or (item["unit"] not in ACCEPTED_UNITS)
+    ):
+        # Skip the item if it's not valid
+        return None
+
+    # Convert the units to micrograms per cubic meter
+    value = item["value"]
+    unit = item["unit"]
+    if unit == "mg/m³":
+        value *= 1000
+        unit = "µg/m³"
+    elif unit != "µg/m³":
+        raise ValueError(f"Unknown unit detected: {unit}")
+
+    measurement = Measurement(
+        get_station(item, stations if stations is not None else {}),
+        item["parameter"],
+        value,
+        unit,
+        item["lastUpdated"],
+    )
+    # The station metadata, including its geohash and cell,
+    # is kept in the station table
+    processed_item = measurement.to_item()
+
+    # Define a Time to Live (TTL) epoch time attribute
+    processed_item["expireAt"] = expire_at(item["lastUpdated"])
+
+    # Define the ingestion time attributes, stamped again by the writer
+    # of the DynamoDB table right before the item is written
+    stamp_ingestion([processed_item], ingested_at)
+
+    return processed_item
+
+
+def stamp_ingestion(
+    items: Iterable[dict], ingested_at: Optional[str] = None
+) -> None:
+    """
+    Set the ingestion time attributes of items, e.g. right before they
+    are written, so the items are ingested in the order of their
+    ingestion times, even when their writes wait for write capacity.
+
+    Parameters:
+    items (Iterable[dict]): The processed items, updated in place
+    ingested_at (str, optional): The ingestion time, defaults to now
+    """
+    if ingested_at is None:
+        ingested_at = datetime.now(timezone.utc).strftime(DATE_FORMAT)
+    for item in items:
+        item["ingestedAt"] = ingested_at
+        # Define the hour of ingestion, e.g. 2024-05-19T21, the partition
+        # key of the ingested index for queries of the items ingested
+        # since a time
+        item["ingestedHour"] = ingested_at[:13]
+
+
+def get_station(item: json, stations: Dict[tuple, Station]) -> Station:
+    """
+    Get the cleaned station of an item, cleaning it once per station.
+
+    Parameters:
+    item (json): The raw item
+    stations (Dict[tuple, Station]): The cleaned stations by raw station key
+
+    Returns:
+    Station: The cleaned station
+    """
+    raw_station = Station.from_raw(item)
+    key = raw_station.key()
+    station = stations.get(key)
+    if station is None:
+        station = clean_station(raw_station)
+        stations[key] = station
+    return station
+
+
+def clean_station(station: Station) -> Station:
+    """
+    Clean the station metadata.
+
+    Parameters:
+    station (Station): The raw station
+
+    Returns:
+    Station: The cleaned station
+    """
+    # Check if the station has a valid location string,
+    # otherwise set it to "Unknown"
+    if station.location is None:
+        station.location = "Unknown"
+    else:
+        # Trim white spaces for location attribute
+        station.location = station.location.strip()
+
+    # Trim white spaces for city attribute
+    if station.city is not None:
+        station.city = station.city.strip()
+
+    return station
+
+
+@lru_cache(maxsize=4096)
+def expire_at(last_updated: str) -> int:
+    """
+    Get the Time to Live (TTL) epoch time of a measurement.
+
+    Parameters:
+    last_updated (str): The lastUpdated time of the measurement
+
+    Returns:
+    int: The TTL epoch time
+    """
+    date_object = parse_timestamp(last_updated)
+    return int(time.mktime(date_object.timetuple())) + TTL_DURATION
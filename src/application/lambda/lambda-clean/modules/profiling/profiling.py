@@ -0,0 +1,269 @@
+import cProfile
+import gzip
+import io
+import logging
+import marshal
+import os
+import pstats
+import random
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from functools import lru_cache, wraps
+from typing import Callable, Optional, Tuple
+
+from modules.storage.storage import object_store
+
+# Keep this module identical in lambda-raw, lambda-clean and lambda-refined,
+# the Lambda functions are built from their own folder only.
+# make shared-modules fails when the copies differ.
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+EVENT_FIELD = "profile"
+KEY_DATE_FORMAT = "%Y-%m-%d-%H-%M-%S"
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+# Frames kept per allocation, more frames cost more time and memory
+TRACEMALLOC_FRAMES = 1
+
+
+@lru_cache(maxsize=1)
+def load_profiling_config() -> dict:
+    """
+    Read the profiling configuration from the environment variables,
+    once per execution environment, at the first invocation.
+
+    Returns:
+    dict: The configuration
+    """
+    return {
+        "enabled": os.environ.get("PROFILING", "").lower()
+        in ("1", "true", "on"),
+        # Profile 1 in N invocations, never if 0
+        "sample_rate": int(os.environ.get("PROFILING_SAMPLE_RATE", 0)),
+        # The reports are written to the bucket if set, else to the directory
+        "bucket": os.environ.get("PROFILING_BUCKET"),
+        "prefix": os.environ.get("PROFILING_PREFIX", "diagnostics"),
+        "directory": os.environ.get("PROFILING_DIR", "/tmp"),
+    }
+
+
+def profiled(handler: Callable) -> Callable:
+    """
+    Wrap a Lambda handler to profile the invocations with cProfile
+    and trace their allocations with tracemalloc, when enabled by the
+    PROFILING environment variable, by a true "profile" field in the event,
+    or for 1 in PROFILING_SAMPLE_RATE invocations.
+    The reports are written once the handler returns or raises,
+    profiling errors never fail the invocation.
+    cProfile only profiles the handler thread, the allocations of all
+    threads are traced.
+
+    Parameters:
+    handler (Callable): The Lambda handler
+
+    Returns:
+    Callable: The wrapped handler
+    """
+
+    @wraps(handler)
+    def wrapper(event: dict, context):
+        if not is_profiled(event):
+            return handler(event, context)
+
+        profile = cProfile.Profile()
+        # Not stopping the tracing of a caller, e.g. a benchmark
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        start = time.perf_counter()
+        try:
+            return profile.runcall(handler, event, context)
+        finally:
+            duration = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if not tracing:
+                tracemalloc.stop()
+            try:
+                write_reports(
+                    profile, snapshot, peak, duration, *invocation(context)
+                )
+            except Exception as e:
+                logging.error(f"Error writing the profiling reports: {e}")
+
+    return wrapper
+
+
+def is_profiled(event: dict) -> bool:
+    """
+    Check whether an invocation is profiled.
+
+    Parameters:
+    event (dict): Incoming event data
+
+    Returns:
+    bool: True if the invocation is profiled
+    """
+    config = load_profiling_config()
+    if config["enabled"]:
+        return True
+    if isinstance(event, dict) and event.get(EVENT_FIELD) is True:
+        return True
+    return (
+        config["sample_rate"] > 0
+        and random.randrange(config["sample_rate"]) == 0
+    )
+
+
+def invocation(context) -> Tuple[str, str]:
+    """
+    Get the names of the invoked Lambda function and of the invocation.
+
+    Parameters:
+    context (LambdaContext | dict): AWS Lambda context, a dict locally
+
+    Returns:
+    Tuple[str, str]: The function name, local outside of Lambda,
+    and the request ID, random outside of Lambda
+    """
+    name = getattr(context, "function_name", None) or os.environ.get(
+        "AWS_LAMBDA_FUNCTION_NAME", "local"
+    )
+    request_id = getattr(context, "aws_request_id", None)
+    return name, request_id or f"{random.getrandbits(32):08x}"
+
+
+def profile_report(
+    stats: pstats.Stats,
+    snapshot: tracemalloc.Snapshot,
+    peak: int,
+    duration: float,
+) -> str:
+    """
+    Create the text report of a profiled invocation: the top functions
+    by cumulative time and the top allocations by line, of the memory
+    still held when the handler returns, e.g. by the caches kept across
+    warm invocations.
+
+    Parameters:
+    stats (pstats.Stats): The profile statistics of the invocation
+    snapshot (tracemalloc.Snapshot): The allocations of the invocation
+    peak (int): The peak traced memory in bytes
+    duration (float): The duration of the invocation in seconds
+
+    Returns:
+    str: The report
+    """
+    stream = io.StringIO()
+    stream.write(
+        f"Duration: {duration:.3f} s, "
+        f"peak traced memory: {peak / 1024 / 1024:.1f} MiB\n\n"
+    )
+    stats.stream = stream
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+
+    statistics = snapshot.filter_traces(
+        [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, cProfile.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+    ).statistics("lineno")
+    stream.write(f"Top {TOP_ALLOCATIONS} allocations held, by line:\n")
+    for statistic in statistics[:TOP_ALLOCATIONS]:
+        stream.write(f"{statistic}\n")
+    return stream.getvalue()
+
+
+def write_reports(
+    profile: cProfile.Profile,
+    snapshot: tracemalloc.Snapshot,
+    peak: int,
+    duration: float,
+    name: str,
+    request_id: str,
+    now: Optional[datetime] = None,
+) -> str:
+    """
+    Write the gzip text report and the gzip pstats profile, for snakeviz
+    or pstats, of a profiled invocation to the diagnostics prefix
+    of the bucket, or to the local directory.
+
+    Parameters:
+    profile (cProfile.Profile): The profile of the invocation
+    snapshot (tracemalloc.Snapshot): The allocations of the invocation
+    peak (int): The peak traced memory in bytes
+    duration (float): The duration of the invocation in seconds
+    name (str): The name of the Lambda function
+    request_id (str): The request ID of the invocation
+    now (datetime, optional): The UTC time of the reports
+
+    Returns:
+    str: The key or path of the reports, without extension
+    """
+    config = load_profiling_config()
+    now = now or datetime.now(timezone.utc)
+    base = (
+        f"{config['prefix']}/{name}/"
+        f"{now.strftime(KEY_DATE_FORMAT)}-{request_id}"
+    )
+    # Stats takes over the statistics of the profile
+    stats = pstats.Stats(profile)
+    reports = {
+        ".txt.gz": gzip.compress(
+            profile_report(stats, snapshot, peak, duration).encode()
+        ),
+        ".pstats.gz": gzip.compress(marshal.dumps(stats.stats)),
+    }
+
+    if config["bucket"]:
+        objects = object_store(config["bucket"])
+        for extension, body in reports.items():
+            objects.put_object(
+                f"{base}{extension}",
+                body,
+                content_type="application/gzip",
+            )
+        location = f"{config['bucket']}/{base}"
+    else:
+        location = os.path.join(config["directory"], base)
+        os.makedirs(os.path.dirname(location), exist_ok=True)
+        for extension, body in reports.items():
+            with open(f"{location}{extension}", "wb") as file:
+                file.write(body)
+    logging.info(f"PROFILING REPORTS WRITTEN: {location}")
+    return location
+
+
+if __name__ == "__main__":
+    # Measure the overhead of the hook on a handler that allocates,
+    # disabled and enabled, writing the reports to /tmp/diagnostics/local
+    import json
+
+    def handler(event: dict, context) -> dict:
+        items = [{"value": i, "label": str(i)} for i in range(2000)]
+        return {"statusCode": 200, "body": json.dumps(items)[:16]}
+
+    profiled_handler = profiled(handler)
+    for name, function, event, num_calls in [
+        ("plain", handler, {}, 500),
+        ("hook disabled", profiled_handler, {}, 500),
+        ("hook enabled", profiled_handler, {EVENT_FIELD: True}, 20),
+    ]:
+        start = time.perf_counter()
+        for _ in range(num_calls):
+            function(event, {})
+        duration = (time.perf_counter() - start) / num_calls
+        print(f"{name}: {duration * 1000:.3f} ms per invocation")
+
+    # The overhead of the disabled hook alone, on an empty handler
+    empty_handler = profiled(lambda event, context: None)
+    start = time.perf_counter()
+    for _ in range(100000):
+        empty_handler({}, {})
+    duration = (time.perf_counter() - start) / 100000
+    print(f"disabled hook: {duration * 1e6:.2f} µs per invocation")
@@ -0,0 +1,223 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+MAX_CONCURRENT_RECORDS = 4
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+def record_location(record: dict) -> str:
+    """
+    Get the bucket and key of an S3 event record, for the logs.
+
+    Parameters:
+    record (dict): The S3 event record
+
+    Returns:
+    str: The bucket and key, e.g. bucket-raw/2024-05-19-21-05-00.json
+    """
+    s3 = record.get("s3", {})
+    bucket = s3.get("bucket", {}).get("name")
+    key = s3.get("object", {}).get("key")
+    return f"{bucket}/{key}"
+
+
+def process_records(
+    records: List[dict],
+    process_record: Callable[[dict], dict],
+    max_concurrency: int = MAX_CONCURRENT_RECORDS,
+) -> List[dict]:
+    """
+    Process S3 event records concurrently, on up to max_concurrency
+    threads, so the download, parsing and writes of the records overlap.
+    A failed record does not stop the others.
+
+    Parameters:
+    records (List[dict]): The S3 event records
+    process_record (Callable[[dict], dict]): Processes a record,
+    returns its counts, e.g. of ingested and skipped items
+    max_concurrency (int, optional): Max records processed at once
+
+    Returns:
+    List[dict]: The result of each record, in order: its location,
+    status, duration, and counts or error
+    """
+
+    def process(record: dict) -> dict:
+        start = time.perf_counter()
+        result = {"record": record_location(record)}
+        try:
+            result.update(process_record(record))
+            result["status"] = SUCCEEDED
+        except Exception as e:
+            logging.error(f"Error processing record {result['record']}: {e}")
+            result["status"] = FAILED
+            result["error"] = str(e)
+        result["durationSeconds"] = round(time.perf_counter() - start, 3)
+        return result
+
+    max_workers = min(max_concurrency, len(records))
+    if max_workers <= 1:
+        results = [process(record) for record in records]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(process, records))
+
+    num_failed = sum(result["status"] == FAILED for result in results)
+    logging.info(
+        f"PROCESSED RECORDS: {len(results)}, FAILED RECORDS: {num_failed}, "
+        f"CONCURRENCY: {max(max_workers, 1)}"
+    )
+    return results
+
+
+def _benchmark_raw_items(num_items: int, offset: int) -> List[dict]:
+    """
+    Create the raw items of one raw object, measured 10 minutes ago.
+    """
+    from datetime import datetime, timedelta, timezone
+
+    last_updated = (
+        datetime.now(timezone.utc).replace(microsecond=0)
+        - timedelta(minutes=10)
+    ).isoformat()
+    return [
+        {
+            "location": f"Station {offset + i}",
+            "city": None,
+            "country": "BE",
+            "coordinates": {"latitude": 50.5, "longitude": 4.5 + i * 1e-4},
+            "parameter": "pm25",
+            "value": i % 97 + 0.5,
+            "lastUpdated": last_updated,
+            "unit": "µg/m³",
+        }
+        for i in range(num_items)
+    ]
+
+
+def _serve_aws(port: int) -> None:
+    """
+    Serve a local S3 and DynamoDB on a local port.
+    """
+    import threading
+
+    from moto.server import ThreadedMotoServer
+
+    # Not logging the requests
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    ThreadedMotoServer("127.0.0.1", port, verbose=False).start()
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    # Benchmark the handler on 8 records at several concurrency levels,
+    # with a local S3 and DynamoDB served by a child process, so it does
+    # not share the handler's GIL, and 20 ms of network latency added
+    # to each request. The last record is missing.
+    import json
+    import multiprocessing
+    import os
+    import socket
+
+    import boto3
+    import lambda_function
+    import requests
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = multiprocessing.Process(
+        target=_serve_aws, args=(port,), daemon=True
+    )
+    server.start()
+    for _ in range(100):
+        try:
+            requests.get(f"http://127.0.0.1:{port}")
+            break
+        except requests.ConnectionError:
+            time.sleep(0.1)
+
+    os.environ.update(
+        {
+            "AWS_ENDPOINT_URL": f"http://127.0.0.1:{port}",
+            "AWS_ACCESS_KEY_ID": "benchmark",
+            "AWS_SECRET_ACCESS_KEY": "benchmark",
+            "DYNAMODB_TABLE_NAME": "table-clean-benchmark",
+            "STATION_TABLE_NAME": "table-stations-benchmark",
+            "REGION_NAME": "us-east-1",
+        }
+    )
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="bucket-raw-benchmark")
+    # The clients of the handler are created after the hook
+    boto3.setup_default_session()
+    boto3.DEFAULT_SESSION.events.register(
+        "before-send", lambda **kwargs: time.sleep(0.02)
+    )
+    dynamodb = boto3.client("dynamodb", region_name="us-east-1")
+    for table_name, key_attributes in [
+        ("table-clean-benchmark", ["location", "lastUpdated"]),
+        ("table-stations-benchmark", ["location"]),
+    ]:
+        dynamodb.create_table(
+            TableName=table_name,
+            KeySchema=[
+                {"AttributeName": name, "KeyType": key_type}
+                for name, key_type in zip(key_attributes, ["HASH", "RANGE"])
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": name, "AttributeType": "S"}
+                for name in key_attributes
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+    num_records, num_items = 8, 500
+    records = []
+    for record in range(num_records):
+        key = f"benchmark-{record}.json"
+        if record < num_records - 1:
+            s3.put_object(
+                Bucket="bucket-raw-benchmark",
+                Key=key,
+                Body=json.dumps(
+                    _benchmark_raw_items(num_items, record * num_items)
+                ),
+            )
+        records.append(
+            {
+                "s3": {
+                    "bucket": {"name": "bucket-raw-benchmark"},
+                    "object": {"key": key},
+                }
+            }
+        )
+
+    # The first invocation writes the stations to the station table
+    lambda_function.lambda_handler({"Records": records}, {})
+    for concurrency in [1, 2, 4, 8] * 2:
+        os.environ["RECORD_CONCURRENCY"] = str(concurrency)
+        lambda_function.load_config.cache_clear()
+        start = time.perf_counter()
+        response = lambda_function.lambda_handler({"Records": records}, {})
+        duration = time.perf_counter() - start
+
+        statuses = [result["status"] for result in response["records"]]
+        assert response["statusCode"] == 500, response
+        assert statuses == [SUCCEEDED] * (num_records - 1) + [FAILED]
+        ingested_items = sum(
+            result.get("ingestedItems", 0) for result in response["records"]
+        )
+        print(
+            f"concurrency {concurrency}: {duration:.3f} s, "
+            f"{ingested_items} items, "
+            f"{ingested_items / duration:.0f} items/s, "
+            f"{statuses.count(FAILED)} failed record"
+        )
@@ -0,0 +1,337 @@
+import argparse
+import json
+import logging
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import List, Optional, Set, TextIO, Tuple
+
+from modules.capacity_governor.capacity_governor import WriteCapacityGovernor
+from modules.dynamodb_writer.dynamodb_writer import create_item_writer
+from modules.json_codec.json_codec import RawItem, decode_items
+from modules.process_item.process_item import (
+    process_json_items,
+    stamp_ingestion,
+)
+from modules.station_registry.station_registry import (
+    StationRegistry,
+    station_registry,
+)
+from modules.storage.storage import (
+    ItemTable,
+    ObjectStore,
+    item_table,
+    object_store,
+)
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+# Raw objects are named after their ingestion time by lambda-raw,
+# or sharded under a prefix named after it, with a run manifest
+RAW_KEY_DATE_FORMAT = "%Y-%m-%d-%H-%M-%S"
+RAW_KEY_SUFFIX = ".json"
+MAX_WORKERS = 8
+
+
+def list_raw_keys(
+    objects: ObjectStore,
+    prefix: str = "",
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+) -> List[str]:
+    """
+    List the raw JSON objects of a bucket within a prefix and time range.
+
+    Parameters:
+    objects (ObjectStore): The raw bucket
+    prefix (str): Only list objects with this key prefix
+    start_time (datetime, optional): Only list objects ingested at or after
+    end_time (datetime, optional): Only list objects ingested before
+
+    Returns:
+    List[str]: The sorted object keys
+    """
+    keys = []
+    for key, last_modified in objects.list_objects(prefix):
+        if not key.endswith(RAW_KEY_SUFFIX):
+            continue
+        ingested_at = raw_key_time(key) or last_modified
+        if start_time is not None and ingested_at < start_time:
+            continue
+        if end_time is not None and ingested_at >= end_time:
+            continue
+        keys.append(key)
+    return sorted(keys)
+
+
+def raw_key_time(key: str) -> Optional[datetime]:
+    """
+    Parse the ingestion time from a raw object key, named after its run,
+    or in the prefix of its run for sharded runs.
+
+    Parameters:
+    key (str): The raw object key, e.g. 2024-05-01-10-05-00.json
+    or 2024-05-01-10-05-00/shard-0003.json
+
+    Returns:
+    datetime: The UTC ingestion time, or None if the key is not time-named
+    """
+    name = os.path.basename(key)[: -len(RAW_KEY_SUFFIX)]
+    run = os.path.basename(os.path.dirname(key))
+    for name in [name, run]:
+        try:
+            return datetime.strptime(name, RAW_KEY_DATE_FORMAT).replace(
+                tzinfo=timezone.utc
+            )
+        except ValueError:
+            continue
+    return None
+
+
+def load_checkpoint(checkpoint_path: Optional[str]) -> Set[str]:
+    """
+    Load the keys completed by previous replay runs. The checkpoint file
+    holds one JSON key per line, a line cut off by a killed run is ignored.
+    Checkpoints of a single JSON object with the completed_keys are read
+    as well.
+
+    Parameters:
+    checkpoint_path (str, optional): The local checkpoint file
+
+    Returns:
+    Set[str]: The completed object keys
+    """
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return set()
+    keys = set()
+    with open(checkpoint_path, "r") as file:
+        for line in file:
+            try:
+                value = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(value, dict):
+                keys.update(value["completed_keys"])
+            else:
+                keys.add(value)
+    return keys
+
+
+def append_checkpoint(file: Optional[TextIO], key: str) -> None:
+    """
+    Append a completed key to the checkpoint file, so saving a checkpoint
+    costs the same for the first and the last object of a backfill.
+
+    Parameters:
+    file (TextIO, optional): The checkpoint file, opened to append
+    key (str): The completed object key
+    """
+    if file is None:
+        return
+    file.write(f"{json.dumps(key)}\n")
+    file.flush()
+
+
+def download_and_process(
+    objects: ObjectStore, key: str
+) -> Tuple[str, List[dict], int, list]:
+    """
+    Download a raw object from S3 and process its items.
+
+    Parameters:
+    objects (ObjectStore): The raw bucket
+    key (str): The raw object key
+
+    Returns:
+    tuple: The key, the processed items, the number of skipped items
+    and the cleaned stations of the items
+    """
+    body = objects.get_object(key)
+    if body is None:
+        raise FileNotFoundError(f"Object {key} not found")
+    s3_json, errors = decode_items(body, RawItem)
+    stations = {}
+    processed_items, skipped_items = process_json_items(s3_json, stations)
+    skipped_items += len(errors)
+    return key, processed_items, skipped_items, list(stations.values())
+
+
+def replay_raw_objects(
+    objects: ObjectStore,
+    table: ItemTable,
+    prefix: str = "",
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    max_workers: int = MAX_WORKERS,
+    write_capacity_units: Optional[float] = None,
+    checkpoint_path: Optional[str] = None,
+    registry: Optional[StationRegistry] = None,
+) -> dict:
+    """
+    Reprocess historical raw objects into the clean DynamoDB table.
+    Objects are downloaded and processed on a worker pool, while their items
+    are written in batches within the write capacity budget. Each object is
+    checkpointed once all its items are written, so a killed run resumes
+    from the checkpoint. Writes are idempotent puts, hence an object that was
+    partially written before the run was killed is safely written again.
+
+    Parameters:
+    objects (ObjectStore): The raw bucket
+    table (ItemTable): The clean table
+    prefix (str): Only replay objects with this key prefix
+    start_time (datetime, optional): Only replay objects ingested at or after
+    end_time (datetime, optional): Only replay objects ingested before
+    max_workers (int): The number of download and processing workers
+    write_capacity_units (float, optional): Write capacity units per second
+    the replay may consume. Unlimited if None.
+    checkpoint_path (str, optional): The local checkpoint file
+    registry (StationRegistry, optional): The registry to upsert the
+    stations of the items in, not updated if None
+
+    Returns:
+    dict: Summary of the replayed objects and items, with the keys
+    and errors of the failed objects. A failed object is logged and
+    not checkpointed, so the next run retries it, and the replay
+    continues with the other objects.
+    """
+    completed_keys = load_checkpoint(checkpoint_path)
+    keys = [
+        key
+        for key in list_raw_keys(objects, prefix, start_time, end_time)
+        if key not in completed_keys
+    ]
+    logging.info(
+        f"Replaying {len(keys)} objects from bucket {objects.bucket_name}, "
+        f"{len(completed_keys)} objects already completed"
+    )
+
+    writer = create_item_writer(
+        table,
+        WriteCapacityGovernor(write_capacity_units, pace_from_start=True),
+        stamp=stamp_ingestion,
+    )
+    summary = {
+        "objects": 0,
+        "ingested_items": 0,
+        "skipped_items": 0,
+        "failures": [],
+    }
+    pending_keys = iter(keys)
+    checkpoint_file = (
+        open(checkpoint_path, "a") if checkpoint_path is not None else None
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Bound the downloaded objects waiting for the writer
+        futures = {}
+        for key in pending_keys:
+            future = executor.submit(download_and_process, objects, key)
+            futures[future] = key
+            if len(futures) >= 2 * max_workers:
+                break
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = futures.pop(future)
+                try:
+                    _, processed_items, skipped_items, stations = (
+                        future.result()
+                    )
+                    ingested_items = writer.put_items(processed_items)
+                    if registry is not None:
+                        registry.upsert(stations)
+                except Exception as e:
+                    logging.error(f"Error replaying {key}: {e}")
+                    summary["failures"].append({"key": key, "error": str(e)})
+                else:
+                    append_checkpoint(checkpoint_file, key)
+                    summary["objects"] += 1
+                    summary["ingested_items"] += ingested_items
+                    summary["skipped_items"] += skipped_items
+                    logging.info(
+                        f"REPLAYED {key}: INGESTED ITEMS: {ingested_items}, "
+                        f"SKIPPED ITEMS: {skipped_items}"
+                    )
+
+                next_key = next(pending_keys, None)
+                if next_key is not None:
+                    future = executor.submit(
+                        download_and_process, objects, next_key
+                    )
+                    futures[future] = next_key
+    if checkpoint_file is not None:
+        checkpoint_file.close()
+
+    summary.update(writer.metrics())
+    logging.info(
+        f"Replay finished: {summary['objects']} objects, "
+        f"{len(summary['failures'])} failed objects, "
+        f"{summary['ingested_items']} ingested items, "
+        f"{summary['skipped_items']} skipped items"
+    )
+    return summary
+
+
+def parse_time(value: str) -> datetime:
+    """
+    Parse an ISO 8601 time argument, assuming UTC if no offset is given.
+
+    Parameters:
+    value (str): The ISO 8601 time
+
+    Returns:
+    datetime: The timezone-aware time
+    """
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay raw S3 objects into the clean DynamoDB table."
+    )
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--station-table", default=None)
+    parser.add_argument("--region", default="us-east-1")
+    parser.add_argument("--prefix", default="")
+    parser.add_argument("--start-time", type=parse_time, default=None)
+    parser.add_argument("--end-time", type=parse_time, default=None)
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--wcu", type=float, default=None)
+    parser.add_argument("--checkpoint", default="replay-checkpoint.jsonl")
+    parser.add_argument("--failures", default="replay-failures.json")
+    args = parser.parse_args()
+
+    # The STORAGE_BACKEND environment variable selects S3 and DynamoDB,
+    # or their local stand-ins
+    summary = replay_raw_objects(
+        object_store(args.bucket, region_name=args.region),
+        item_table(args.table, args.region),
+        args.prefix,
+        args.start_time,
+        args.end_time,
+        args.workers,
+        args.wcu,
+        args.checkpoint,
+        (
+            station_registry(args.station_table, args.region)
+            if args.station_table
+            else None
+        ),
+    )
+    if summary["failures"]:
+        with open(args.failures, "w") as file:
+            json.dump(summary["failures"], file, indent=2)
+        for failure in summary["failures"]:
+            logging.error(f"FAILED {failure['key']}: {failure['error']}")
+        logging.error(
+            f"{len(summary['failures'])} objects failed, "
+            f"written to {args.failures}"
+        )
+        sys.exit(1)
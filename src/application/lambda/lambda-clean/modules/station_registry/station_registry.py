@@ -0,0 +1,133 @@
+import logging
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, Iterable, Optional
+
+from modules.geohash.geohash import CELL_PRECISION, encode
+from modules.measurement.measurement import Station
+from modules.storage.storage import ItemTable, item_table
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+STATION_KEY_ATTRIBUTES = ("location",)
+STATION_ATTRIBUTES = ("city", "country", "latitude", "longitude")
+UPDATED_ATTRIBUTE = "updatedAt"
+# The partition key of the updated-index, the same for all stations,
+# so the stations upserted after a time are read with one query
+UPDATED_PARTITION_ATTRIBUTE = "updatedPartition"
+UPDATED_PARTITION = "stations"
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+
+
+class StationRegistry:
+    """
+    The station metadata of the station table, by location.
+    The table is read once, at the first upsert, and the known stations
+    are kept for the lifetime of the execution environment, so a station
+    is only written when it is new or its metadata changed.
+    """
+
+    def __init__(self, table: ItemTable) -> None:
+        self.table = table
+        self.stations: Optional[Dict[str, dict]] = None
+        self.lock = threading.Lock()
+
+    def upsert(self, stations: Iterable[Station]) -> int:
+        """
+        Write the new and changed stations to the station table.
+
+        Parameters:
+        stations (Iterable[Station]): The cleaned stations
+
+        Returns:
+        int: The number of stations written
+        """
+        with self.lock:
+            if self.stations is None:
+                self.stations = {
+                    item["location"]: item
+                    for item in self.table.scan_after(UPDATED_ATTRIBUTE, "")
+                }
+                logging.info(
+                    f"STATIONS LOADED FROM {self.table.table_name}: "
+                    f"{len(self.stations)}"
+                )
+
+            # Stations sharing a location are one station, the last wins
+            updated_at = datetime.now(timezone.utc).strftime(DATE_FORMAT)
+            items = {
+                station.location: station_item(station, updated_at)
+                for station in stations
+            }
+            changed_items = {}
+            for location, item in items.items():
+                known_item = self.stations.get(location)
+                if known_item is None or any(
+                    known_item.get(name) != item[name]
+                    for name in STATION_ATTRIBUTES
+                ):
+                    changed_items[location] = item
+
+            if changed_items:
+                self.table.put_items(changed_items.values())
+                self.stations.update(changed_items)
+                logging.info(
+                    f"UPSERTED STATIONS INTO {self.table.table_name}: "
+                    f"{len(changed_items)}"
+                )
+            return len(changed_items)
+
+
+def station_item(station: Station, updated_at: str) -> dict:
+    """
+    Convert a cleaned station to its item of the station table,
+    with the geohash attributes of its coordinates and the partition key
+    of the updated-index.
+
+    Parameters:
+    station (Station): The cleaned station
+    updated_at (str): The time of the upsert
+
+    Returns:
+    dict: The station item
+    """
+    item = {
+        "location": station.location,
+        "city": station.city,
+        "country": station.country,
+        "latitude": station.latitude,
+        "longitude": station.longitude,
+        UPDATED_ATTRIBUTE: updated_at,
+        UPDATED_PARTITION_ATTRIBUTE: UPDATED_PARTITION,
+    }
+    if station.latitude is not None and station.longitude is not None:
+        item["geohash"] = encode(station.latitude, station.longitude)
+        item["cell"] = encode(
+            station.latitude, station.longitude, CELL_PRECISION
+        )
+    return item
+
+
+@lru_cache(maxsize=None)
+def station_registry(
+    table_name: str, region_name: Optional[str] = None
+) -> StationRegistry:
+    """
+    Get the registry of a station table, shared by the invocations
+    of an execution environment.
+
+    Parameters:
+    table_name (str): The name of the station table
+    region_name (str, optional): The AWS region of the table
+
+    Returns:
+    StationRegistry: The station registry
+    """
+    return StationRegistry(
+        item_table(
+            table_name, region_name, key_attributes=STATION_KEY_ATTRIBUTES
+        )
+    )
@@ -0,0 +1,709 @@
+import abc
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from decimal import Decimal
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Keep this module identical in lambda-raw, lambda-clean and lambda-refined,
+# the Lambda functions are built from their own folder only.
+# make shared-modules fails when the copies differ.
+
+# boto3 is only needed by the AWS backend.
+# The local and memory backends run without it, e.g. in CI.
+try:
+    import boto3
+    from boto3.dynamodb.conditions import Attr, Key
+except ImportError:
+    boto3 = None
+
+# Storage backends, selected by the STORAGE_BACKEND environment variable
+AWS = "aws"  # S3 buckets and DynamoDB tables
+LOCAL = "local"  # Directories and SQLite tables under STORAGE_ROOT
+MEMORY = "memory"  # Dictionaries of the running process
+STORAGE_BACKENDS = (AWS, LOCAL, MEMORY)
+DEFAULT_STORAGE_ROOT = "data/00_storage"
+SQLITE_FILE = "tables.sqlite3"
+
+KEY_ATTRIBUTES = ("location", "lastUpdated")
+ATTRIBUTE_PATTERN = re.compile(r"^\w+$")
+
+# Objects and items of the memory backend, shared by all stores and tables
+_MEMORY_BUCKETS: Dict[str, Dict[str, Tuple[bytes, datetime]]] = {}
+_MEMORY_TABLES: Dict[str, Dict[tuple, dict]] = {}
+
+
+class ObjectStore(abc.ABC):
+    """
+    Objects of a bucket, stored in S3, in a local directory or in memory.
+    The content headers are only kept by S3.
+    """
+
+    def __init__(self, bucket_name: str) -> None:
+        self.bucket_name = bucket_name
+
+    @abc.abstractmethod
+    def put_object(
+        self,
+        key: str,
+        body: bytes,
+        content_type: Optional[str] = None,
+        cache_control: Optional[str] = None,
+        content_encoding: Optional[str] = None,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """
+        Write an object.
+
+        Parameters:
+        key (str): The key of the object
+        body (bytes): The object
+        content_type (str, optional): The Content-Type header
+        cache_control (str, optional): The Cache-Control header
+        content_encoding (str, optional): The Content-Encoding header
+        metadata (Dict[str, str], optional): The user metadata
+        """
+
+    @abc.abstractmethod
+    def get_object(self, key: str) -> Optional[bytes]:
+        """
+        Read an object.
+
+        Parameters:
+        key (str): The key of the object
+
+        Returns:
+        bytes: The object, None if it does not exist
+        """
+
+    @abc.abstractmethod
+    def list_objects(self, prefix: str = "") -> List[Tuple[str, datetime]]:
+        """
+        List the objects of a prefix.
+
+        Parameters:
+        prefix (str, optional): Only list objects with this key prefix
+
+        Returns:
+        List[Tuple[str, datetime]]: The key and last modified time
+        of each object
+        """
+
+    def upload_file(
+        self,
+        local_file: str,
+        key: str,
+        content_type: Optional[str] = None,
+        cache_control: Optional[str] = None,
+    ) -> None:
+        """
+        Write a local file as an object.
+
+        Parameters:
+        local_file (str): The local file
+        key (str): The key of the object
+        content_type (str, optional): The Content-Type header
+        cache_control (str, optional): The Cache-Control header
+        """
+        with open(local_file, "rb") as file:
+            self.put_object(key, file.read(), content_type, cache_control)
+
+
+class S3ObjectStore(ObjectStore):
+    """
+    Objects of an S3 bucket.
+    """
+
+    def __init__(
+        self, bucket_name: str, region_name: Optional[str] = None
+    ) -> None:
+        super().__init__(bucket_name)
+        self.client = aws_client("s3", region_name)
+
+    def put_object(
+        self,
+        key: str,
+        body: bytes,
+        content_type: Optional[str] = None,
+        cache_control: Optional[str] = None,
+        content_encoding: Optional[str] = None,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.client.put_object(
+            Bucket=self.bucket_name,
+            Key=key,
+            Body=body,
+            **_headers(content_type, cache_control, content_encoding),
+            **({"Metadata": metadata} if metadata else {}),
+        )
+
+    def get_object(self, key: str) -> Optional[bytes]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket_name, Key=key)
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return response["Body"].read()
+
+    def list_objects(self, prefix: str = "") -> List[Tuple[str, datetime]]:
+        objects = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for s3_object in page.get("Contents", []):
+                objects.append((s3_object["Key"], s3_object["LastModified"]))
+        return objects
+
+    def upload_file(
+        self,
+        local_file: str,
+        key: str,
+        content_type: Optional[str] = None,
+        cache_control: Optional[str] = None,
+    ) -> None:
+        # Managed transfer, multipart for large files
+        self.client.upload_file(
+            local_file,
+            self.bucket_name,
+            key,
+            ExtraArgs=_headers(content_type, cache_control),
+        )
+
+
+class LocalObjectStore(ObjectStore):
+    """
+    Objects of a bucket stored as files in a local directory,
+    one folder per bucket.
+    """
+
+    def __init__(self, bucket_name: str, root: str) -> None:
+        super().__init__(bucket_name)
+        self.directory = os.path.join(root, bucket_name)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, *key.split("/"))
+
+    def put_object(
+        self,
+        key: str,
+        body: bytes,
+        content_type: Optional[str] = None,
+        cache_control: Optional[str] = None,
+        content_encoding: Optional[str] = None,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> None:
+        # Written next to the object and renamed, readers never see a part
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(body)
+        os.replace(tmp_path, path)
+
+    def get_object(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def list_objects(self, prefix: str = "") -> List[Tuple[str, datetime]]:
+        objects = []
+        for directory, _, files in os.walk(self.directory):
+            for file in files:
+                if file.endswith(".tmp"):
+                    continue
+                path = os.path.join(directory, file)
+                key = os.path.relpath(path, self.directory).replace(
+                    os.sep, "/"
+                )
+                if key.startswith(prefix):
+                    modified = datetime.fromtimestamp(
+                        os.path.getmtime(path), timezone.utc
+                    )
+                    objects.append((key, modified))
+        return sorted(objects)
+
+
+class MemoryObjectStore(ObjectStore):
+    """
+    Objects of a bucket kept in memory, for the lifetime of the process.
+    """
+
+    def __init__(self, bucket_name: str) -> None:
+        super().__init__(bucket_name)
+        self.objects = _MEMORY_BUCKETS.setdefault(bucket_name, {})
+
+    def put_object(
+        self,
+        key: str,
+        body: bytes,
+        content_type: Optional[str] = None,
+        cache_control: Optional[str] = None,
+        content_encoding: Optional[str] = None,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.objects[key] = (bytes(body), datetime.now(timezone.utc))
+
+    def get_object(self, key: str) -> Optional[bytes]:
+        body, _ = self.objects.get(key, (None, None))
+        return body
+
+    def list_objects(self, prefix: str = "") -> List[Tuple[str, datetime]]:
+        return sorted(
+            (key, modified)
+            for key, (_, modified) in list(self.objects.items())
+            if key.startswith(prefix)
+        )
+
+
+class ItemTable(abc.ABC):
+    """
+    Items of a table, stored in DynamoDB, in SQLite or in memory.
+    Items with the same key overwrite each other, last one wins.
+    """
+
+    def __init__(
+        self, table_name: str, key_attributes: Sequence[str] = KEY_ATTRIBUTES
+    ) -> None:
+        self.table_name = table_name
+        self.key_attributes = tuple(key_attributes)
+        self.written_items = 0
+
+    @abc.abstractmethod
+    def put_items(self, items: Iterable[dict]) -> int:
+        """
+        Write items to the table.
+
+        Parameters:
+        items (Iterable[dict]): The items to write
+
+        Returns:
+        int: The number of items written
+        """
+
+    @abc.abstractmethod
+    def scan_after(self, attribute: str, value: str) -> List[dict]:
+        """
+        Get the items of which an attribute is greater than a value,
+        e.g. the items updated after a time.
+
+        Parameters:
+        attribute (str): The attribute to compare
+        value (str): The value to compare with
+
+        Returns:
+        List[dict]: The items
+        """
+
+    @abc.abstractmethod
+    def query_after(
+        self,
+        index_name: str,
+        key_attribute: str,
+        key_value: str,
+        attribute: str,
+        value: str,
+    ) -> List[dict]:
+        """
+        Get the items of a key of an index, of which an attribute
+        is greater than a value, e.g. the items of an hour ingested after
+        a time.
+
+        Parameters:
+        index_name (str): The name of the index
+        key_attribute (str): The partition key of the index
+        key_value (str): The value of the partition key
+        attribute (str): The sort key of the index
+        value (str): The value to compare with
+
+        Returns:
+        List[dict]: The items
+        """
+
+    def metrics(self) -> dict:
+        """
+        Get the write metrics of the table.
+
+        Returns:
+        dict: Metric names and values
+        """
+        return {"WrittenItems": self.written_items}
+
+    def _key(self, item: dict) -> tuple:
+        return tuple(item[name] for name in self.key_attributes)
+
+
+class DynamoDBTable(ItemTable):
+    """
+    Items of a DynamoDB table, all pages of scans and queries are read.
+    """
+
+    def __init__(
+        self,
+        table_name: str,
+        region_name: Optional[str] = None,
+        key_attributes: Sequence[str] = KEY_ATTRIBUTES,
+    ) -> None:
+        super().__init__(table_name, key_attributes)
+        if boto3 is None:
+            raise ImportError("boto3 is required by the aws backend")
+        self.table = boto3.resource("dynamodb", region_name).Table(table_name)
+
+    def put_items(self, items: Iterable[dict]) -> int:
+        written_items = 0
+        with self.table.batch_writer(
+            overwrite_by_pkeys=list(self.key_attributes)
+        ) as batch:
+            for item in items:
+                batch.put_item(Item=item)
+                written_items += 1
+        self.written_items += written_items
+        return written_items
+
+    def scan_after(self, attribute: str, value: str) -> List[dict]:
+        return self._read_pages(
+            self.table.scan, FilterExpression=Attr(attribute).gt(value)
+        )
+
+    def query_after(
+        self,
+        index_name: str,
+        key_attribute: str,
+        key_value: str,
+        attribute: str,
+        value: str,
+    ) -> List[dict]:
+        return self._read_pages(
+            self.table.query,
+            IndexName=index_name,
+            KeyConditionExpression=Key(key_attribute).eq(key_value)
+            & Key(attribute).gt(value),
+        )
+
+    def _read_pages(self, operation, **kwargs) -> List[dict]:
+        """
+        Read all pages of a scan or query, a page holds up to 1 MB.
+        """
+        items = []
+        while True:
+            response = operation(**kwargs)
+            items.extend(response["Items"])
+            if "LastEvaluatedKey" not in response:
+                return items
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+class SQLiteTable(ItemTable):
+    """
+    Items of a table stored as JSON in a local SQLite database.
+    Numbers are read back as Decimal, as from DynamoDB.
+    The compared attributes are indexed on first use.
+    """
+
+    def __init__(
+        self,
+        table_name: str,
+        path: str,
+        key_attributes: Sequence[str] = KEY_ATTRIBUTES,
+    ) -> None:
+        super().__init__(table_name, key_attributes)
+        self.connection, self.lock = sqlite_connection(path)
+        self.indexed_attributes = set()
+        with self.lock, self.connection:
+            self.connection.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table_name}" '
+                "(key TEXT PRIMARY KEY, item TEXT NOT NULL)"
+            )
+
+    def put_items(self, items: Iterable[dict]) -> int:
+        rows = [
+            (json.dumps(self._key(item), default=str), _dumps_item(item))
+            for item in items
+        ]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                f'INSERT OR REPLACE INTO "{self.table_name}" VALUES (?, ?)',
+                rows,
+            )
+        self.written_items += len(rows)
+        return len(rows)
+
+    def scan_after(self, attribute: str, value: str) -> List[dict]:
+        return self._select(f"{self._indexed(attribute)} > ?", value)
+
+    def query_after(
+        self,
+        index_name: str,
+        key_attribute: str,
+        key_value: str,
+        attribute: str,
+        value: str,
+    ) -> List[dict]:
+        return self._select(
+            f"{self._indexed(key_attribute)} = ? "
+            f"AND {self._indexed(attribute)} > ?",
+            key_value,
+            value,
+        )
+
+    def _indexed(self, attribute: str) -> str:
+        """
+        Get the expression of an attribute, indexed on first use.
+        """
+        if not ATTRIBUTE_PATTERN.match(attribute):
+            raise ValueError(f"Invalid attribute name: {attribute}")
+        expression = f"json_extract(item, '$.{attribute}')"
+        if attribute not in self.indexed_attributes:
+            with self.lock, self.connection:
+                self.connection.execute(
+                    "CREATE INDEX IF NOT EXISTS "
+                    f'"{self.table_name}_{attribute}" '
+                    f'ON "{self.table_name}" ({expression})'
+                )
+            self.indexed_attributes.add(attribute)
+        return expression
+
+    def _select(self, condition: str, *parameters) -> List[dict]:
+        with self.lock:
+            rows = self.connection.execute(
+                f'SELECT item FROM "{self.table_name}" WHERE {condition}',
+                parameters,
+            ).fetchall()
+        return [_loads_item(item) for (item,) in rows]
+
+
+class MemoryTable(ItemTable):
+    """
+    Items of a table kept in memory, for the lifetime of the process.
+    """
+
+    def __init__(
+        self, table_name: str, key_attributes: Sequence[str] = KEY_ATTRIBUTES
+    ) -> None:
+        super().__init__(table_name, key_attributes)
+        self.items = _MEMORY_TABLES.setdefault(table_name, {})
+        self.lock = threading.Lock()
+
+    def put_items(self, items: Iterable[dict]) -> int:
+        keyed_items = {self._key(item): dict(item) for item in items}
+        with self.lock:
+            self.items.update(keyed_items)
+            self.written_items += len(keyed_items)
+        return len(keyed_items)
+
+    def scan_after(self, attribute: str, value: str) -> List[dict]:
+        return [
+            dict(item)
+            for item in list(self.items.values())
+            if attribute in item and item[attribute] > value
+        ]
+
+    def query_after(
+        self,
+        index_name: str,
+        key_attribute: str,
+        key_value: str,
+        attribute: str,
+        value: str,
+    ) -> List[dict]:
+        return [
+            item
+            for item in self.scan_after(attribute, value)
+            if item.get(key_attribute) == key_value
+        ]
+
+
+def storage_backend(backend: Optional[str] = None) -> str:
+    """
+    Get the storage backend, from the STORAGE_BACKEND environment variable
+    if not given. Read on each call, so it can be set after import.
+
+    Parameters:
+    backend (str, optional): "aws", "local" or "memory"
+
+    Returns:
+    str: The storage backend, defaults to "aws"
+    """
+    backend = backend or os.environ.get("STORAGE_BACKEND") or AWS
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    return backend
+
+
+def storage_root() -> str:
+    """
+    Get the directory of the local backend,
+    from the STORAGE_ROOT environment variable.
+
+    Returns:
+    str: The directory of the buckets and the SQLite tables
+    """
+    return os.environ.get("STORAGE_ROOT") or DEFAULT_STORAGE_ROOT
+
+
+def object_store(
+    bucket_name: str,
+    backend: Optional[str] = None,
+    region_name: Optional[str] = None,
+) -> ObjectStore:
+    """
+    Get the object store of a bucket.
+
+    Parameters:
+    bucket_name (str): The name of the bucket
+    backend (str, optional): The storage backend, see storage_backend
+    region_name (str, optional): The AWS region of the bucket
+
+    Returns:
+    ObjectStore: The object store
+    """
+    backend = storage_backend(backend)
+    if backend == LOCAL:
+        return LocalObjectStore(bucket_name, storage_root())
+    if backend == MEMORY:
+        return MemoryObjectStore(bucket_name)
+    return S3ObjectStore(bucket_name, region_name)
+
+
+def item_table(
+    table_name: str,
+    region_name: Optional[str] = None,
+    backend: Optional[str] = None,
+    key_attributes: Sequence[str] = KEY_ATTRIBUTES,
+) -> ItemTable:
+    """
+    Get an item table.
+
+    Parameters:
+    table_name (str): The name of the table
+    region_name (str, optional): The AWS region of the table
+    backend (str, optional): The storage backend, see storage_backend
+    key_attributes (Sequence[str], optional): The key attribute names
+
+    Returns:
+    ItemTable: The item table
+    """
+    backend = storage_backend(backend)
+    if backend == LOCAL:
+        path = os.path.join(storage_root(), SQLITE_FILE)
+        return SQLiteTable(table_name, path, key_attributes)
+    if backend == MEMORY:
+        return MemoryTable(table_name, key_attributes)
+    return DynamoDBTable(table_name, region_name, key_attributes)
+
+
+@lru_cache(maxsize=None)
+def aws_client(service_name: str, region_name: Optional[str] = None):
+    """
+    Get an AWS client, created once per service and region.
+    Clients are thread safe and reused by warm invocations.
+
+    Parameters:
+    service_name (str): The AWS service, e.g. s3
+    region_name (str, optional): The AWS region
+
+    Returns:
+    botocore.client.BaseClient: The client
+    """
+    if boto3 is None:
+        raise ImportError("boto3 is required by the aws backend")
+    return boto3.client(service_name, region_name=region_name)
+
+
+@lru_cache(maxsize=None)
+def sqlite_connection(path: str) -> Tuple[sqlite3.Connection, threading.Lock]:
+    """
+    Get the connection to a SQLite database, opened once per file
+    and shared by the threads with its lock.
+
+    Parameters:
+    path (str): The database file
+
+    Returns:
+    Tuple[sqlite3.Connection, threading.Lock]: The connection and its lock
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection, threading.Lock()
+
+
+def clear_memory_storage() -> None:
+    """
+    Remove all objects and items of the memory backend.
+    """
+    _MEMORY_BUCKETS.clear()
+    _MEMORY_TABLES.clear()
+
+
+def _headers(
+    content_type: Optional[str] = None,
+    cache_control: Optional[str] = None,
+    content_encoding: Optional[str] = None,
+) -> Dict[str, str]:
+    """
+    Get the S3 arguments of the given content headers.
+    """
+    headers = {
+        "ContentType": content_type,
+        "CacheControl": cache_control,
+        "ContentEncoding": content_encoding,
+    }
+    return {name: value for name, value in headers.items() if value}
+
+
+def _json_number(value):
+    """
+    Encode the Decimal numbers of DynamoDB items as JSON numbers.
+    """
+    if isinstance(value, Decimal):
+        return (
+            int(value) if value == value.to_integral_value() else float(value)
+        )
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON")
+
+
+def _dumps_item(item: dict) -> str:
+    return json.dumps(item, default=_json_number, separators=(",", ":"))
+
+
+def _loads_item(item: str) -> dict:
+    return json.loads(item, parse_float=Decimal, parse_int=Decimal)
+
+
+if __name__ == "__main__":
+    # Benchmark the local backends, as used by local pipeline runs
+    import tempfile
+    import time
+
+    os.environ["STORAGE_ROOT"] = tempfile.mkdtemp()
+    num_items = 100000
+    items = [
+        {
+            "location": f"Station {i % 1000}",
+            "lastUpdated": (
+                f"2024-05-19T{i // 5000:02d}:{i // 1000 % 5 * 10:02d}:00+00:00"
+            ),
+            "parameter": "pm25",
+            "value": Decimal(i % 100),
+        }
+        for i in range(num_items)
+    ]
+    for backend in (LOCAL, MEMORY):
+        table = item_table("table-clean", backend=backend)
+        start = time.perf_counter()
+        table.put_items(items)
+        put_duration = time.perf_counter() - start
+
+        start = time.perf_counter()
+        found = table.scan_after("lastUpdated", "2024-05-19T18:00:00+00:00")
+        scan_duration = time.perf_counter() - start
+        assert len(found) == 9000
+        print(
+            f"{backend}: put {num_items} items {put_duration:.3f} s, "
+            f"scan {len(found)} items {scan_duration:.3f} s"
+        )
@@ -1,41 +1,51 @@
+import asyncio
 import json
 import logging
 import os
 from datetime import datetime, timezone
+from functools import lru_cache
+from typing import List
 
-import boto3
 from botocore.exceptions import BotoCoreError, ClientError
+from modules.async_ingestion.async_ingestion import ingest_latest_async
+from modules.ingestion.ingestion import split_results
+from modules.profiling.profiling import profiled
 from modules.query_api.query_api import query_api
 from modules.query_secret.query_secret import extract_api_token_from_secret
+from modules.sharding.sharding import (
+    MAX_SHARDS,
+    TARGET_SHARD_ITEMS,
+    raw_run_objects,
+    write_run,
+)
+from modules.storage.storage import object_store
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel("INFO")
 
-if __name__ != "__main__":
-    LAMBDA_SECRET_NAME = os.environ["LAMBDA_SECRET_NAME"]
-    API_TOKEN_API_KEY_NAME = os.environ["API_TOKEN_API_KEY_NAME"]
-    REGION_NAME = os.environ["REGION_NAME"]
-    OPENAQ_API_KEY = extract_api_token_from_secret(
-        LAMBDA_SECRET_NAME, API_TOKEN_API_KEY_NAME, REGION_NAME
-    )
-
-    COUNTRY = os.environ["COUNTRY"]
-    S3_BUCKET_NAME = os.environ["S3_BUCKET_NAME"]
-
 OPENAQ_RESULTS_LIMIT = 20000
-OPENAQ_URL = (
-    f"https://api.openaq.org/v2/latest?limit={OPENAQ_RESULTS_LIMIT}&page=1"
+OPENAQ_URL_TEMPLATE = (
+    "https://api.openaq.org/v2/latest?limit={limit}&page={page}"
     "&offset=0&sort=desc&radius=1000&order_by=lastUpdated&dump_raw=false"
 )
+OPENAQ_URL = OPENAQ_URL_TEMPLATE.format(limit=OPENAQ_RESULTS_LIMIT, page=1)
+INGESTION_MODES = ("sync", "async")
 
 
+@profiled
 def lambda_handler(event: dict, context: dict) -> dict:
     """
     AWS Lambda function handler.
     Queries the OpenAQ API for the latest measurements,
     filters them by country, splits the measurements by
     individual measurements of today, and uploads the results to S3.
+    The measurements are sharded by station, and the shards of a run
+    written under one prefix with a run manifest, so each shard is
+    cleaned by its own lambda-clean invocation.
+    The INGESTION_MODE environment variable selects the sync ingestion,
+    the default, or the async ingestion, which fetches the pages
+    concurrently. Both give the same S3 objects.
 
     Parameters:
     event (dict): Incoming event data
@@ -45,72 +55,31 @@ def lambda_handler(event: dict, context: dict) -> dict:
     dict: Response with status code and body message
     """
     try:
-        # Query the OpenAQ API
-        json_raw_response = query_api(
-            OPENAQ_URL, OPENAQ_API_KEY, OPENAQ_RESULTS_LIMIT
-        )
-
-        # Filter the results by country
-        json_raw_response_BE = [
-            result
-            for result in json_raw_response["results"]
-            if result["country"] == COUNTRY
-        ]
-        logging.info(
-            (
-                f"Number of items API of country {COUNTRY}: "
-                f"{len(json_raw_response_BE)}"
-            )
-        )
-
-        json_raw_response_BE_splitted = []
-        last_updated_times = []
-        today = datetime.now().date()
-
-        for item in json_raw_response_BE:
-            for measurement in item["measurements"]:
-                # Copy the item to preserve the metadata
-                new_item = item.copy()
-                # Replace the 'measurements' field with the single measurement
-                new_item.update(measurement)
-                del new_item["measurements"]
-
-                # Convert 'lastUpdated' to a date and check if it's today
-                last_updated_time = datetime.fromisoformat(
-                    new_item["lastUpdated"].replace("Z", "+00:00")
+        config = load_config()
+        country = config["country"]
+        s3_bucket_name = config["s3_bucket_name"]
+
+        if config["ingestion_mode"] == "async":
+            # Overlap the page fetches, parsing and S3 writes
+            asyncio.run(
+                ingest_latest_async(
+                    OPENAQ_URL_TEMPLATE,
+                    config["openaq_api_key"],
+                    country,
+                    object_store(s3_bucket_name),
+                    OPENAQ_RESULTS_LIMIT,
+                    target_items=config["shard_target_items"],
+                    max_shards=config["max_shards"],
                 )
-                if last_updated_time.date() == today:
-                    json_raw_response_BE_splitted.append(new_item)
-                    last_updated_times.append(last_updated_time)
-
-        logging.info(
-            (
-                f"Number of items API of country {COUNTRY} "
-                f"of today and splitted: {len(json_raw_response_BE_splitted)}"
             )
-        )
-
-        time_earliest = min(last_updated_times).strftime("%Y-%m-%d-%H-%M-%S")
-        time_latest = max(last_updated_times).strftime("%Y-%m-%d-%H-%M-%S")
-        logging.info(f"Earliest time of items: {time_earliest}")
-        logging.info(f"Latest time of items: {time_latest}")
-
-        # Upload the final JSON to S3
-        s3 = boto3.client("s3")
-        now = datetime.now(timezone.utc).strftime("%Y-%m-%d-%H-%M-%S")
-        s3_key = f"{now}.json"
-        s3.put_object(
-            Bucket=S3_BUCKET_NAME,
-            Key=s3_key,
-            Body=json.dumps(json_raw_response_BE_splitted),
-            Metadata={
-                "time_earliest_data": time_earliest,
-                "time_latest_data": time_latest,
-            },
-        )
-        logging.info(
-            f"S3 object {s3_key} ingested in bucket: {S3_BUCKET_NAME}"
-        )
+        else:
+            ingest_latest(
+                config["openaq_api_key"],
+                country,
+                s3_bucket_name,
+                config["shard_target_items"],
+                config["max_shards"],
+            )
 
         return {
             "statusCode": 200,
@@ -137,6 +106,87 @@ def lambda_handler(event: dict, context: dict) -> dict:
         }
 
 
+def ingest_latest(
+    api_key: str,
+    country: str,
+    s3_bucket_name: str,
+    target_items: int = TARGET_SHARD_ITEMS,
+    max_shards: int = MAX_SHARDS,
+) -> List[str]:
+    """
+    Ingest the latest measurements of a country, with one API request.
+
+    Parameters:
+    api_key (str): The OpenAQ API key
+    country (str): The country code, e.g. BE
+    s3_bucket_name (str): The raw S3 bucket name
+    target_items (int, optional): The target number of items per shard
+    max_shards (int, optional): The maximum number of shards
+
+    Returns:
+    List[str]: The keys of the S3 objects, the run manifest last
+    """
+    # Query the OpenAQ API
+    json_raw_response = query_api(OPENAQ_URL, api_key, OPENAQ_RESULTS_LIMIT)
+
+    # Filter the results by country and split them by measurement
+    today = datetime.now().date()
+    num_results, measurements = split_results(
+        json_raw_response["results"], country, today
+    )
+    logging.info(f"Number of items API of country {country}: {num_results}")
+    logging.info(
+        (
+            f"Number of items API of country {country} "
+            f"of today and splitted: {len(measurements)}"
+        )
+    )
+
+    # Upload the JSON shards to S3, then the run manifest
+    shards, manifest = raw_run_objects(
+        measurements, datetime.now(timezone.utc), target_items, max_shards
+    )
+    return write_run(object_store(s3_bucket_name), shards, manifest)
+
+
+@lru_cache(maxsize=1)
+def load_config() -> dict:
+    """
+    Read the configuration from the environment variables,
+    once per execution environment, at the first invocation.
+    The OpenAQ API key is read from AWS Secrets Manager,
+    unless it is set in the OPENAQ_API_KEY environment variable,
+    e.g. for local runs.
+
+    Returns:
+    dict: The configuration
+    """
+    openaq_api_key = os.environ.get("OPENAQ_API_KEY")
+    if not openaq_api_key:
+        openaq_api_key = extract_api_token_from_secret(
+            os.environ["LAMBDA_SECRET_NAME"],
+            os.environ["API_TOKEN_API_KEY_NAME"],
+            os.environ["REGION_NAME"],
+        )
+    ingestion_mode = os.environ.get("INGESTION_MODE", "sync")
+    if ingestion_mode not in INGESTION_MODES:
+        raise ValueError(
+            f"Unknown INGESTION_MODE {ingestion_mode}, "
+            f"expected one of {INGESTION_MODES}"
+        )
+    return {
+        "openaq_api_key": openaq_api_key,
+        "country": os.environ["COUNTRY"],
+        "s3_bucket_name": os.environ["S3_BUCKET_NAME"],
+        "ingestion_mode": ingestion_mode,
+        # Runs of more items are split in more shards, up to the maximum
+        "shard_target_items": int(
+            os.environ.get("SHARD_TARGET_ITEMS", TARGET_SHARD_ITEMS)
+        ),
+        "max_shards": int(os.environ.get("MAX_SHARDS", MAX_SHARDS)),
+    }
+
+
 if __name__ == "__main__":
     # Define event, context, and environment variables as needed
     event = {}
@@ -145,18 +195,21 @@ if __name__ == "__main__":
     # Reading the OpenAQ API key from a local file
     # local_open_api_key_path = "data/01_raw/openaq-api-key.txt"
     # with open(local_open_api_key_path, "r") as file:
-    #     OPENAQ_API_KEY = file.read().strip()
+    #     os.environ["OPENAQ_API_KEY"] = file.read().strip()
 
     # Reading the OpenAQ API key from AWS Secrets Manager
-    LAMBDA_SECRET_NAME = "lambda-raw-lambda-secret-Wy76f"
-    API_TOKEN_API_KEY_NAME = "OPENAQ_API_KEY"
-    REGION_NAME = "us-east-1"
-    OPENAQ_API_KEY = extract_api_token_from_secret(
-        LAMBDA_SECRET_NAME, API_TOKEN_API_KEY_NAME, REGION_NAME
-    )
+    os.environ["LAMBDA_SECRET_NAME"] = "lambda-raw-lambda-secret-Wy76f"
+    os.environ["API_TOKEN_API_KEY_NAME"] = "OPENAQ_API_KEY"
+    os.environ["REGION_NAME"] = "us-east-1"
+
+    os.environ["COUNTRY"] = "BE"
+    os.environ["S3_BUCKET_NAME"] = "bucket-raw-4i4y"
+
+    # Fetch the API pages concurrently
+    # os.environ["INGESTION_MODE"] = "async"
 
-    COUNTRY = "BE"
-    S3_BUCKET_NAME = "bucket-raw-4i4y"
+    # Write to data/00_storage instead of S3
+    # os.environ["STORAGE_BACKEND"] = "local"
 
     # Call the lambda_handler function
     lambda_handler(event, context)
@@ -0,0 +1,523 @@
+import asyncio
+import logging
+import math
+from datetime import datetime, timezone
+from typing import Dict, FrozenSet, List, Tuple
+
+from modules.ingestion.ingestion import split_results
+from modules.json_codec.json_codec import LatestResult, decode_items
+from modules.measurement.measurement import Measurement
+from modules.sharding.sharding import (
+    MAX_SHARDS,
+    TARGET_SHARD_ITEMS,
+    raw_shards,
+    run_manifest,
+    run_prefix,
+    shard_count,
+    write_manifest,
+)
+from modules.storage.storage import ObjectStore, S3ObjectStore
+
+# aiohttp fetches the pages and aiobotocore writes to S3 without blocking.
+# The async ingestion is not available without aiohttp, and writes
+# through the sync object store in a thread without aiobotocore.
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+try:
+    from aiobotocore.session import get_session
+except ImportError:
+    get_session = None
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+OPENAQ_PAGE_SIZE = 5000
+MAX_CONCURRENT_REQUESTS = 4
+MAX_PENDING_PAGES = 2  # Fetched pages waiting to be parsed
+MAX_CONCURRENT_WRITES = 4
+MAX_PENDING_SHARDS = 2  # Created shards waiting to be written
+REQUEST_TIMEOUT = 25  # seconds, within the Lambda timeout
+
+
+async def fetch_pages(
+    session,
+    url_template: str,
+    api_key: str,
+    num_pages: int,
+    page_size: int,
+    pages: asyncio.Queue,
+) -> None:
+    """
+    Fetch the pages of the OpenAQ API concurrently, and queue them
+    as they complete. A request holds its slot until its page is queued,
+    so at most MAX_CONCURRENT_REQUESTS + MAX_PENDING_PAGES pages
+    are held in memory.
+
+    Parameters:
+    session (aiohttp.ClientSession): The HTTP session
+    url_template (str): The API URL, with {limit} and {page} fields
+    api_key (str): The API key
+    num_pages (int): The number of pages to fetch
+    page_size (int): The number of results per page
+    pages (asyncio.Queue): The queue of the page numbers and contents
+    """
+    headers = {"accept": "application/json", "X-API-Key": api_key}
+    slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def fetch_page(page: int) -> None:
+        async with slots:
+            url = url_template.format(limit=page_size, page=page)
+            async with session.get(url, headers=headers) as response:
+                response.raise_for_status()
+                content = await response.read()
+            await pages.put((page, content))
+
+    await asyncio.gather(
+        *(fetch_page(page) for page in range(1, num_pages + 1))
+    )
+
+
+async def parse_pages(
+    pages: asyncio.Queue, num_pages: int, country: str, today
+) -> Dict[int, Tuple[int, FrozenSet[str], int, List[Measurement]]]:
+    """
+    Parse the pages as they are fetched, while the next pages download.
+
+    Parameters:
+    pages (asyncio.Queue): The queue of the page numbers and contents
+    num_pages (int): The number of pages to parse
+    country (str): The country code, e.g. BE
+    today (date): The local date of today
+
+    Returns:
+    Dict[int, Tuple[int, FrozenSet[str], int, List[Measurement]]]:
+    The number of results, valid or not, the locations of the results,
+    the number of results of the country and their measurements of today,
+    by page number
+    """
+    parsed = {}
+    for _ in range(num_pages):
+        page, content = await pages.get()
+        # Validate the OpenAQ schema of each result while parsing,
+        # invalid results are skipped
+        results, errors = decode_items(content, LatestResult, "results")
+        for error in errors:
+            logging.error(f"Invalid result on page {page}: {error}")
+        parsed[page] = (
+            len(results) + len(errors),
+            frozenset(result["location"] for result in results),
+            *split_results(results, country, today),
+        )
+    return parsed
+
+
+def consistent_pages(
+    parsed: Dict[int, Tuple[int, FrozenSet[str], int, List[Measurement]]],
+    page_size: int,
+) -> bool:
+    """
+    Check that the pages hold the results of one request of all pages:
+    full pages, then at most one partial page, then empty pages, without
+    a location on two pages. The results are sorted by update time, so
+    stations updated between the page requests move across the pages,
+    and their results are missed or repeated.
+
+    Parameters:
+    parsed (Dict[int, Tuple[int, FrozenSet[str], int, List[Measurement]]]):
+    The parsed pages, by page number
+    page_size (int): The number of results per page
+
+    Returns:
+    bool: True if the pages are consistent
+    """
+    seen_locations = set()
+    partial = False
+    for page in sorted(parsed):
+        num_items, locations = parsed[page][:2]
+        if num_items and partial:
+            logging.warning(f"Results on page {page}, after a partial page")
+            return False
+        partial = num_items < page_size
+        if not seen_locations.isdisjoint(locations - {None}):
+            logging.warning(f"Results repeated on page {page}")
+            return False
+        seen_locations |= locations
+    return True
+
+
+async def write_objects(
+    objects: ObjectStore, outputs: asyncio.Queue
+) -> List[str]:
+    """
+    Write the queued outputs to the object store, until None is queued.
+    An output is only taken from the queue once a write slot is free,
+    so the queue bounds the outputs waiting to be written.
+
+    Parameters:
+    objects (ObjectStore): The object store
+    outputs (asyncio.Queue): The queue of the keys, bodies and metadata
+
+    Returns:
+    List[str]: The written keys
+    """
+    slots = asyncio.Semaphore(MAX_CONCURRENT_WRITES)
+    writes = []
+
+    async def write(client, key: str, body: bytes, metadata: dict) -> str:
+        try:
+            if client is None:
+                await asyncio.to_thread(
+                    objects.put_object, key, body, metadata=metadata
+                )
+            else:
+                await client.put_object(
+                    Bucket=objects.bucket_name,
+                    Key=key,
+                    Body=body,
+                    Metadata=metadata,
+                )
+        finally:
+            slots.release()
+        logging.info(
+            f"S3 object {key} ingested in bucket: {objects.bucket_name}"
+        )
+        return key
+
+    async def consume(client) -> List[str]:
+        while True:
+            await slots.acquire()
+            output = await outputs.get()
+            if output is None:
+                slots.release()
+                return list(await asyncio.gather(*writes))
+            writes.append(asyncio.ensure_future(write(client, *output)))
+
+    if get_session is not None and isinstance(objects, S3ObjectStore):
+        region_name = objects.client.meta.region_name
+        async with get_session().create_client("s3", region_name) as client:
+            return await consume(client)
+    return await consume(None)
+
+
+async def ingest_latest_async(
+    url_template: str,
+    api_key: str,
+    country: str,
+    objects: ObjectStore,
+    max_items: int,
+    page_size: int = OPENAQ_PAGE_SIZE,
+    target_items: int = TARGET_SHARD_ITEMS,
+    max_shards: int = MAX_SHARDS,
+) -> List[str]:
+    """
+    Ingest the latest measurements of a country, as the sync ingestion,
+    in a bounded pipeline: the pages are fetched concurrently, parsed as
+    they complete, and the shards are written concurrently.
+    The shard count depends on the number of measurements of all pages,
+    so the shards are final once the last page is parsed. They are then
+    created one at a time, each written while the next one is created.
+    The run manifest is written once all shards are written.
+    If the pages are not consistent, e.g. stations were updated between
+    the page requests, the results are fetched again with one request,
+    as the sync ingestion, so both ingest the same results.
+
+    Parameters:
+    url_template (str): The API URL, with {limit} and {page} fields
+    api_key (str): The API key
+    country (str): The country code, e.g. BE
+    objects (ObjectStore): The raw bucket
+    max_items (int): Max items to fetch, over all pages
+    page_size (int, optional): The number of results per page
+    target_items (int, optional): The target number of items per shard
+    max_shards (int, optional): The maximum number of shards
+
+    Returns:
+    List[str]: The keys of the written objects, the run manifest last
+    """
+    if aiohttp is None:
+        raise ImportError("aiohttp is required by the async ingestion")
+    num_pages = math.ceil(max_items / page_size)
+    today = datetime.now().date()
+    pages = asyncio.Queue(MAX_PENDING_PAGES)
+    outputs = asyncio.Queue(MAX_PENDING_SHARDS)
+
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    try:
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with asyncio.TaskGroup() as tasks:
+                writing = tasks.create_task(write_objects(objects, outputs))
+                tasks.create_task(
+                    fetch_pages(
+                        session,
+                        url_template,
+                        api_key,
+                        num_pages,
+                        page_size,
+                        pages,
+                    )
+                )
+                parsed = await tasks.create_task(
+                    parse_pages(pages, num_pages, country, today)
+                )
+                if not consistent_pages(parsed, page_size):
+                    logging.warning(
+                        "Inconsistent pages, fetching the results again "
+                        "with one request"
+                    )
+                    num_pages, page_size = 1, max_items
+                    tasks.create_task(
+                        fetch_pages(
+                            session,
+                            url_template,
+                            api_key,
+                            num_pages,
+                            page_size,
+                            pages,
+                        )
+                    )
+                    parsed = await tasks.create_task(
+                        parse_pages(pages, num_pages, country, today)
+                    )
+
+                # The raw object of all pages, in page order as the sync path
+                num_items = sum(parsed[page][0] for page in parsed)
+                num_results = sum(parsed[page][2] for page in parsed)
+                measurements = [
+                    measurement
+                    for page in sorted(parsed)
+                    for measurement in parsed[page][3]
+                ]
+                logging.info(
+                    f"Number of items from API: {num_items}, "
+                    f"Max items: {max_items}, Pages: {num_pages}"
+                )
+                logging.info(
+                    f"Number of items API of country {country}: {num_results}"
+                )
+                logging.info(
+                    f"Number of items API of country {country} "
+                    f"of today and splitted: {len(measurements)}"
+                )
+                now = datetime.now(timezone.utc)
+                prefix = run_prefix(now)
+                num_shards = shard_count(
+                    len(measurements), target_items, max_shards
+                )
+                # Create the shards in a thread, so the event loop writes
+                # the created shards meanwhile
+                shards = raw_shards(measurements, prefix, num_shards)
+                manifest_shards = []
+                while created := await asyncio.to_thread(next, shards, None):
+                    shard, manifest_shard = created
+                    manifest_shards.append(manifest_shard)
+                    await outputs.put(shard)
+                await outputs.put(None)
+                manifest = run_manifest(
+                    prefix,
+                    now,
+                    len(measurements),
+                    num_shards,
+                    manifest_shards,
+                )
+    except ExceptionGroup as errors:
+        # Raise the first error, as the sync ingestion
+        raise errors.exceptions[0]
+    await asyncio.to_thread(write_manifest, objects, manifest)
+    return [*writing.result(), manifest[0]]
+
+
+def _fake_api_results(num_results: int, country: str) -> List[dict]:
+    """
+    Create OpenAQ results of today, 2 measurements per station.
+    """
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    last_updated = now.isoformat().replace("+00:00", "Z")
+    return [
+        {
+            "location": f"Station {i}",
+            "city": None,
+            "country": country if i % 4 else "NL",
+            "coordinates": {"latitude": 50.5, "longitude": 4.5 + i * 1e-4},
+            "measurements": [
+                {
+                    "parameter": parameter,
+                    "value": i % 97 + 0.5,
+                    "lastUpdated": last_updated,
+                    "unit": "µg/m³",
+                }
+                for parameter in ("pm25", "no2")
+            ],
+        }
+        for i in range(num_results)
+    ]
+
+
+def _free_port() -> int:
+    """
+    Get a free local port.
+    """
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve_fake_api(
+    port: int,
+    results: List[dict],
+    latency: float,
+    latency_per_result: float,
+    drift: int = 0,
+) -> None:
+    """
+    Serve the results as the OpenAQ latest API on a local port,
+    with a response latency growing with the page size.
+    With a drift, the pages after the first are shifted by a number
+    of results, as if stations were updated after the first page.
+    """
+    import json
+
+    from aiohttp import web
+
+    async def latest(request):
+        limit = int(request.query["limit"])
+        page = int(request.query["page"])
+        shift = drift if page > 1 else 0
+        first, end = (page - 1) * limit - shift, page * limit - shift
+        page_results = results[first:end]
+        await asyncio.sleep(latency + latency_per_result * len(page_results))
+        return web.Response(
+            body=json.dumps({"results": page_results}),
+            content_type="application/json",
+        )
+
+    app = web.Application()
+    app.router.add_get("/v2/latest", latest)
+    web.run_app(app, host="127.0.0.1", port=port, print=None)
+
+
+def _serve_s3(port: int) -> None:
+    """
+    Serve a local S3 on a local port.
+    """
+    import threading
+
+    from moto.server import ThreadedMotoServer
+
+    ThreadedMotoServer("127.0.0.1", port, verbose=False).start()
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    # Benchmark the sync and async handlers, with a fake API and local S3
+    # served by child processes, so they do not share the handler's GIL.
+    # Then check that both ingest the same results when stations are
+    # updated between the page requests of the async handler.
+    import multiprocessing
+    import os
+    import time
+
+    import boto3
+    import lambda_function
+    import requests
+    from modules.sharding.sharding import SHARD_KEY_SUFFIX
+
+    # 300 ms per request and 100 ms per 1000 results
+    api_port, drift_api_port, s3_port = (
+        _free_port(),
+        _free_port(),
+        _free_port(),
+    )
+    results = _fake_api_results(lambda_function.OPENAQ_RESULTS_LIMIT, "BE")
+    servers = [
+        multiprocessing.Process(
+            target=_serve_fake_api,
+            args=(api_port, results, 0.3, 0.0001),
+            daemon=True,
+        ),
+        multiprocessing.Process(
+            target=_serve_fake_api,
+            args=(drift_api_port, results, 0.3, 0.0001, 100),
+            daemon=True,
+        ),
+        multiprocessing.Process(
+            target=_serve_s3, args=(s3_port,), daemon=True
+        ),
+    ]
+    for server in servers:
+        server.start()
+    for port in [api_port, drift_api_port, s3_port]:
+        for _ in range(100):
+            try:
+                requests.get(f"http://127.0.0.1:{port}")
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+
+    os.environ.update(
+        {
+            "AWS_ENDPOINT_URL_S3": f"http://127.0.0.1:{s3_port}",
+            "AWS_ACCESS_KEY_ID": "benchmark",
+            "AWS_SECRET_ACCESS_KEY": "benchmark",
+            "AWS_DEFAULT_REGION": "us-east-1",
+            "OPENAQ_API_KEY": "benchmark",
+            "COUNTRY": "BE",
+            "S3_BUCKET_NAME": "bucket-raw-benchmark",
+        }
+    )
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="bucket-raw-benchmark")
+    url_query = lambda_function.OPENAQ_URL_TEMPLATE.split("?", 1)[1]
+
+    def run(mode: str, port: int) -> Dict[str, bytes]:
+        """
+        Run the handler against the fake API on a port, and get the
+        shards of the run by name, without the run manifest.
+        """
+        lambda_function.OPENAQ_URL_TEMPLATE = (
+            f"http://127.0.0.1:{port}/v2/latest?{url_query}"
+        )
+        lambda_function.OPENAQ_URL = (
+            lambda_function.OPENAQ_URL_TEMPLATE.format(
+                limit=lambda_function.OPENAQ_RESULTS_LIMIT, page=1
+            )
+        )
+        os.environ["INGESTION_MODE"] = mode
+        lambda_function.load_config.cache_clear()
+        start = time.perf_counter()
+        response = lambda_function.lambda_handler({}, {})
+        duration = time.perf_counter() - start
+        assert response["statusCode"] == 200, response
+
+        bodies = {}
+        for s3_object in s3.list_objects_v2(Bucket="bucket-raw-benchmark")[
+            "Contents"
+        ]:
+            key = s3_object["Key"]
+            if key.endswith(SHARD_KEY_SUFFIX):
+                bodies[key.split("/")[-1]] = s3.get_object(
+                    Bucket="bucket-raw-benchmark", Key=key
+                )["Body"].read()
+            s3.delete_object(Bucket="bucket-raw-benchmark", Key=key)
+        num_bytes = sum(len(body) for body in bodies.values())
+        print(
+            f"{mode}: {duration:.3f} s, {len(bodies)} shards, "
+            f"{num_bytes} bytes"
+        )
+        return bodies
+
+    bodies = {}
+    for mode in ["sync", "async"] * 3:
+        bodies[mode] = run(mode, api_port)
+    assert bodies["sync"] == bodies["async"]
+    print("Same raw objects for the sync and async handlers.")
+
+    print("Stations updated between the page requests:")
+    for mode in ["sync", "async"]:
+        bodies[mode] = run(mode, drift_api_port)
+    assert bodies["sync"] == bodies["async"]
+    print("Same raw objects for the sync and async handlers.")
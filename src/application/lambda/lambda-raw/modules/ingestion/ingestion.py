@@ -0,0 +1,70 @@
+import logging
+from datetime import date
+from typing import Iterable, List, Tuple
+
+from modules.measurement.measurement import (
+    Measurement,
+    Station,
+    dumps_measurements,
+)
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+KEY_DATE_FORMAT = "%Y-%m-%d-%H-%M-%S"
+
+
+def split_results(
+    results: Iterable[dict], country: str, today: date
+) -> Tuple[int, List[Measurement]]:
+    """
+    Filter the OpenAQ results by country and split them by measurement,
+    keeping the measurements of today.
+    Shared by the sync and async ingestion, so both give the same outputs.
+
+    Parameters:
+    results (Iterable[dict]): The OpenAQ results
+    country (str): The country code, e.g. BE
+    today (date): The local date of today
+
+    Returns:
+    Tuple[int, List[Measurement]]: The number of results of the country
+    and their measurements of today, referencing the station metadata
+    """
+    num_results = 0
+    measurements = []
+    for item in results:
+        if item["country"] != country:
+            continue
+        num_results += 1
+        station = Station.from_raw(item)
+        for measurement in item["measurements"]:
+            # Check if 'lastUpdated' is today
+            new_item = Measurement.from_raw(station, measurement)
+            if new_item.last_updated_time.date() == today:
+                measurements.append(new_item)
+    return num_results, measurements
+
+
+def raw_object(measurements: List[Measurement]) -> Tuple[bytes, dict]:
+    """
+    Create the raw S3 object of the measurements.
+
+    Parameters:
+    measurements (List[Measurement]): The measurements, at least one
+
+    Returns:
+    Tuple[bytes, dict]: The JSON array and the S3 metadata with
+    the earliest and latest time of the measurements
+    """
+    last_updated_times = [item.last_updated_time for item in measurements]
+    time_earliest = min(last_updated_times).strftime(KEY_DATE_FORMAT)
+    time_latest = max(last_updated_times).strftime(KEY_DATE_FORMAT)
+    logging.info(f"Earliest time of items: {time_earliest}")
+    logging.info(f"Latest time of items: {time_latest}")
+    metadata = {
+        "time_earliest_data": time_earliest,
+        "time_latest_data": time_latest,
+    }
+    return dumps_measurements(measurements), metadata
@@ -0,0 +1,215 @@
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from modules.json_codec.json_codec import encode
+
+# Keep this module identical in lambda-raw and lambda-clean,
+# the Lambda functions are built from their own folder only.
+# make shared-modules fails when the copies differ.
+
+
+@lru_cache(maxsize=4096)
+def parse_timestamp(value: str) -> datetime:
+    """
+    Parse an OpenAQ ISO 8601 timestamp.
+    Measurements share few distinct timestamps, each is parsed once.
+
+    Parameters:
+    value (str): The timestamp, e.g. 2024-05-19T21:00:00Z
+
+    Returns:
+    datetime: The timezone-aware timestamp
+    """
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class Station:
+    """
+    Station metadata, referenced by all the measurements of the station.
+    """
+
+    __slots__ = (
+        "location",
+        "city",
+        "country",
+        "latitude",
+        "longitude",
+        "_raw_fields",
+    )
+
+    def __init__(
+        self,
+        location: Optional[str],
+        city: Optional[str],
+        country: Optional[str],
+        latitude,
+        longitude,
+    ) -> None:
+        self.location = location
+        self.city = city
+        self.country = country
+        self.latitude = latitude
+        self.longitude = longitude
+        self._raw_fields = None
+
+    @classmethod
+    def from_raw(cls, item: dict) -> "Station":
+        """
+        Create the station of an OpenAQ result or raw measurement item.
+
+        Parameters:
+        item (dict): The OpenAQ result or raw measurement item
+
+        Returns:
+        Station: The station metadata
+        """
+        coordinates = item.get("coordinates") or {}
+        return cls(
+            item.get("location"),
+            item.get("city"),
+            item.get("country"),
+            coordinates.get("latitude"),
+            coordinates.get("longitude"),
+        )
+
+    def key(self) -> tuple:
+        """
+        Get the values identifying the station.
+
+        Returns:
+        tuple: The location, city, country, latitude and longitude
+        """
+        return (
+            self.location,
+            self.city,
+            self.country,
+            self.latitude,
+            self.longitude,
+        )
+
+    def raw_fields(self) -> dict:
+        """
+        Get the station fields of the raw JSON format, built once.
+
+        Returns:
+        dict: The location, city, country and coordinates fields
+        """
+        if self._raw_fields is None:
+            coordinates = None
+            if self.latitude is not None or self.longitude is not None:
+                coordinates = {
+                    "latitude": self.latitude,
+                    "longitude": self.longitude,
+                }
+            self._raw_fields = {
+                "location": self.location,
+                "city": self.city,
+                "country": self.country,
+                "coordinates": coordinates,
+            }
+        return self._raw_fields
+
+
+class Measurement:
+    """
+    A single measurement of a station.
+    """
+
+    __slots__ = (
+        "station",
+        "parameter",
+        "value",
+        "unit",
+        "last_updated",
+        "last_updated_time",
+    )
+
+    def __init__(
+        self,
+        station: Station,
+        parameter: str,
+        value,
+        unit: str,
+        last_updated: str,
+        last_updated_time: Optional[datetime] = None,
+    ) -> None:
+        self.station = station
+        self.parameter = parameter
+        self.value = value
+        self.unit = unit
+        self.last_updated = last_updated
+        self.last_updated_time = (
+            last_updated_time
+            if last_updated_time is not None
+            else parse_timestamp(last_updated)
+        )
+
+    @classmethod
+    def from_raw(cls, station: Station, measurement: dict) -> "Measurement":
+        """
+        Create a measurement from an OpenAQ result measurement.
+
+        Parameters:
+        station (Station): The station of the measurement
+        measurement (dict): The OpenAQ result measurement
+
+        Returns:
+        Measurement: The measurement
+        """
+        return cls(
+            station,
+            measurement["parameter"],
+            measurement["value"],
+            measurement["unit"],
+            measurement["lastUpdated"],
+        )
+
+    def to_raw_dict(self) -> dict:
+        """
+        Convert the measurement to the raw JSON format,
+        the station metadata followed by the measurement fields.
+
+        Returns:
+        dict: The raw item
+        """
+        return {
+            **self.station.raw_fields(),
+            "parameter": self.parameter,
+            "value": self.value,
+            "lastUpdated": self.last_updated,
+            "unit": self.unit,
+        }
+
+    def to_item(self) -> dict:
+        """
+        Convert the measurement to a slim item, referencing its station
+        by location. The station metadata is kept in the station table,
+        and the values are in µg/m³ once cleaned.
+
+        Returns:
+        dict: The item
+        """
+        return {
+            "location": self.station.location,
+            "parameter": self.parameter,
+            "value": self.value,
+            "lastUpdated": self.last_updated,
+        }
+
+
+def dumps_measurements(measurements: Iterable[Measurement]) -> bytes:
+    """
+    Serialise measurements to a raw JSON array.
+    The measurements are collected in a list, which only references them,
+    and the whole array is encoded in memory. Each measurement is converted
+    to its raw item dict while encoding, so the dicts are not all held
+    at once.
+
+    Parameters:
+    measurements (Iterable[Measurement]): The measurements
+
+    Returns:
+    bytes: The JSON array
+    """
+    return encode(list(measurements), enc_hook=Measurement.to_raw_dict)
@@ -1,7 +1,7 @@
-import json
 import logging
 
 import requests
+from modules.json_codec.json_codec import LatestResult, decode_items
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -26,9 +26,15 @@ def query_api(url: str, api_key: str, max_items: int) -> dict:
     }
 
     raw_response = requests.get(url, headers=headers)
-    json_raw_response = json.loads(raw_response.text)
+    # Validate the OpenAQ schema of each result while parsing,
+    # invalid results are skipped
+    results, errors = decode_items(
+        raw_response.content, LatestResult, "results"
+    )
+    for error in errors:
+        logging.error(f"Invalid result from API: {error}")
     logging.info(
-        f"Number of items from API: {len(json_raw_response['results'])}, "
-        f"Max items: {max_items}"
+        f"Number of items from API: {len(results)}, "
+        f"Invalid items: {len(errors)}, Max items: {max_items}"
     )
-    return json_raw_response
+    return {"results": results}
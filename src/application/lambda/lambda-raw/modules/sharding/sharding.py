@@ -0,0 +1,427 @@
+import json
+import logging
+import math
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Iterator, List, Tuple
+
+from modules.ingestion.ingestion import KEY_DATE_FORMAT, raw_object
+from modules.measurement.measurement import Measurement
+from modules.storage.storage import ObjectStore
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+TARGET_SHARD_ITEMS = 2000
+MAX_SHARDS = 16
+MAX_CONCURRENT_WRITES = 4
+SHARD_KEY_SUFFIX = ".json"
+# Without the .json suffix, so it does not trigger lambda-clean
+MANIFEST_NAME = "manifest"
+
+
+def shard_count(
+    num_items: int,
+    target_items: int = TARGET_SHARD_ITEMS,
+    max_shards: int = MAX_SHARDS,
+) -> int:
+    """
+    Get the number of shards of a run, adapted to its number of items.
+
+    Parameters:
+    num_items (int): The number of measurements of the run
+    target_items (int, optional): The target number of items per shard
+    max_shards (int, optional): The maximum number of shards
+
+    Returns:
+    int: The number of shards, from 1 to max_shards
+    """
+    return max(1, min(max_shards, math.ceil(num_items / target_items)))
+
+
+def shard_index(location: str, num_shards: int) -> int:
+    """
+    Get the shard of a station, with a hash of its location that is
+    stable across runs and Python processes.
+
+    Parameters:
+    location (str): The location of the station
+    num_shards (int): The number of shards
+
+    Returns:
+    int: The shard index
+    """
+    return zlib.crc32((location or "").encode()) % num_shards
+
+
+def shard_measurements(
+    measurements: List[Measurement], num_shards: int
+) -> List[List[Measurement]]:
+    """
+    Split measurements by the shard of their station, so all measurements
+    of a station are cleaned by the same invocation.
+
+    Parameters:
+    measurements (List[Measurement]): The measurements
+    num_shards (int): The number of shards
+
+    Returns:
+    List[List[Measurement]]: The measurements of each shard, in order
+    """
+    shards = [[] for _ in range(num_shards)]
+    for measurement in measurements:
+        shards[shard_index(measurement.station.location, num_shards)].append(
+            measurement
+        )
+    return shards
+
+
+def run_prefix(now: datetime) -> str:
+    """
+    Get the prefix of the raw objects of a run, named after its
+    ingestion time.
+
+    Parameters:
+    now (datetime): The UTC ingestion time
+
+    Returns:
+    str: The prefix, e.g. 2024-05-19-21-05-00
+    """
+    return now.strftime(KEY_DATE_FORMAT)
+
+
+def shard_key(prefix: str, index: int) -> str:
+    """
+    Get the key of a raw shard object.
+
+    Parameters:
+    prefix (str): The prefix of the run
+    index (int): The shard index
+
+    Returns:
+    str: The key, e.g. 2024-05-19-21-05-00/shard-0000.json
+    """
+    return f"{prefix}/shard-{index:04d}{SHARD_KEY_SUFFIX}"
+
+
+def raw_shards(
+    measurements: List[Measurement], prefix: str, num_shards: int
+) -> Iterator[Tuple[Tuple[str, bytes, dict], dict]]:
+    """
+    Create the raw shard objects of a run one at a time, in shard order,
+    so each shard can be written as soon as it is created.
+    Empty shards are not written.
+
+    Parameters:
+    measurements (List[Measurement]): The measurements of the run
+    prefix (str): The prefix of the run
+    num_shards (int): The number of shards
+
+    Returns:
+    Iterator[Tuple[Tuple[str, bytes, dict], dict]]: The key, body
+    and S3 metadata of each shard, and its entry of the run manifest
+    """
+    for index, shard in enumerate(
+        shard_measurements(measurements, num_shards)
+    ):
+        if not shard:
+            continue
+        body, metadata = raw_object(shard)
+        key = shard_key(prefix, index)
+        yield (key, body, metadata), {
+            "key": key,
+            "items": len(shard),
+            "bytes": len(body),
+            **metadata,
+        }
+
+
+def run_manifest(
+    prefix: str,
+    now: datetime,
+    num_items: int,
+    num_shards: int,
+    manifest_shards: List[dict],
+) -> Tuple[str, bytes]:
+    """
+    Create the manifest of a run.
+
+    Parameters:
+    prefix (str): The prefix of the run
+    now (datetime): The UTC ingestion time
+    num_items (int): The number of measurements of the run
+    num_shards (int): The number of shards
+    manifest_shards (List[dict]): The entries of the written shards
+
+    Returns:
+    Tuple[str, bytes]: The key and body of the manifest
+    """
+    manifest = {
+        "run": prefix,
+        "createdAt": now.isoformat(),
+        "items": num_items,
+        "shardCount": num_shards,
+        "shards": manifest_shards,
+    }
+    logging.info(
+        f"Run {prefix}: {num_items} items "
+        f"in {len(manifest_shards)} of {num_shards} shards"
+    )
+    return f"{prefix}/{MANIFEST_NAME}", json.dumps(manifest).encode()
+
+
+def raw_run_objects(
+    measurements: List[Measurement],
+    now: datetime,
+    target_items: int = TARGET_SHARD_ITEMS,
+    max_shards: int = MAX_SHARDS,
+) -> Tuple[List[Tuple[str, bytes, dict]], Tuple[str, bytes]]:
+    """
+    Create the raw shard objects of a run and its manifest.
+    Empty shards are not written.
+
+    Parameters:
+    measurements (List[Measurement]): The measurements of the run
+    now (datetime): The UTC ingestion time
+    target_items (int, optional): The target number of items per shard
+    max_shards (int, optional): The maximum number of shards
+
+    Returns:
+    Tuple[List[Tuple[str, bytes, dict]], Tuple[str, bytes]]: The keys,
+    bodies and S3 metadata of the shards, and the key and body
+    of the manifest
+    """
+    prefix = run_prefix(now)
+    num_shards = shard_count(len(measurements), target_items, max_shards)
+    shards = []
+    manifest_shards = []
+    for shard, manifest_shard in raw_shards(measurements, prefix, num_shards):
+        shards.append(shard)
+        manifest_shards.append(manifest_shard)
+    return shards, run_manifest(
+        prefix, now, len(measurements), num_shards, manifest_shards
+    )
+
+
+def write_run(
+    objects: ObjectStore,
+    shards: List[Tuple[str, bytes, dict]],
+    manifest: Tuple[str, bytes],
+) -> List[str]:
+    """
+    Write the shards of a run concurrently, then its manifest,
+    so the manifest is only written for complete runs.
+
+    Parameters:
+    objects (ObjectStore): The raw bucket
+    shards (List[Tuple[str, bytes, dict]]): The keys, bodies
+    and S3 metadata of the shards
+    manifest (Tuple[str, bytes]): The key and body of the manifest
+
+    Returns:
+    List[str]: The written keys, the manifest last
+    """
+
+    def write(shard: Tuple[str, bytes, dict]) -> str:
+        key, body, metadata = shard
+        objects.put_object(key, body, metadata=metadata)
+        logging.info(
+            f"S3 object {key} ingested in bucket: {objects.bucket_name}"
+        )
+        return key
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_WRITES) as executor:
+        keys = list(executor.map(write, shards))
+    write_manifest(objects, manifest)
+    return [*keys, manifest[0]]
+
+
+def write_manifest(objects: ObjectStore, manifest: Tuple[str, bytes]) -> None:
+    """
+    Write the manifest of a run.
+
+    Parameters:
+    objects (ObjectStore): The raw bucket
+    manifest (Tuple[str, bytes]): The key and body of the manifest
+    """
+    key, body = manifest
+    objects.put_object(key, body, content_type="application/json")
+    logging.info(
+        f"Run manifest {key} written in bucket: {objects.bucket_name}"
+    )
+
+
+def _serve_s3(port: int) -> None:
+    """
+    Serve a local S3 on a local port.
+    """
+    import threading
+
+    from moto.server import ThreadedMotoServer
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    ThreadedMotoServer("127.0.0.1", port, verbose=False).start()
+    threading.Event().wait()
+
+
+def _clean_worker(clean_dir: str, s3_port: int, latency: float, conn) -> None:
+    """
+    Run lambda-clean as a warm execution environment, with its own local
+    DynamoDB, invoked with the events received on a connection.
+    """
+    import os
+    import sys
+    import time
+
+    import boto3
+    from modules.async_ingestion.async_ingestion import _free_port
+    from moto.server import ThreadedMotoServer
+
+    # Import the modules of lambda-clean instead of lambda-raw
+    for name in list(sys.modules):
+        if name.split(".")[0] in ("modules", "lambda_function"):
+            del sys.modules[name]
+    sys.path.insert(0, clean_dir)
+    logging.disable(logging.INFO)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    sys.stdout = open(os.devnull, "w")
+
+    dynamodb_port = _free_port()
+    ThreadedMotoServer("127.0.0.1", dynamodb_port, verbose=False).start()
+    os.environ.update(
+        {
+            "AWS_ENDPOINT_URL_S3": f"http://127.0.0.1:{s3_port}",
+            "AWS_ENDPOINT_URL_DYNAMODB": f"http://127.0.0.1:{dynamodb_port}",
+            "DYNAMODB_TABLE_NAME": "table-clean-benchmark",
+            "STATION_TABLE_NAME": "table-stations-benchmark",
+        }
+    )
+    dynamodb = boto3.client("dynamodb", region_name="us-east-1")
+    for table_name, key_attributes in [
+        ("table-clean-benchmark", ["location", "lastUpdated"]),
+        ("table-stations-benchmark", ["location"]),
+    ]:
+        dynamodb.create_table(
+            TableName=table_name,
+            KeySchema=[
+                {"AttributeName": name, "KeyType": key_type}
+                for name, key_type in zip(key_attributes, ["HASH", "RANGE"])
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": name, "AttributeType": "S"}
+                for name in key_attributes
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+    boto3.setup_default_session()
+    boto3.DEFAULT_SESSION.events.register(
+        "before-send", lambda **kwargs: time.sleep(latency)
+    )
+    import lambda_function
+
+    conn.send("ready")
+    while (event := conn.recv()) is not None:
+        conn.send(lambda_function.lambda_handler(event, {})["statusCode"])
+
+
+if __name__ == "__main__":
+    # Benchmark the end-to-end ingestion latency of a run by shard count:
+    # lambda-raw writes the shards to a local S3, and each shard is cleaned
+    # by its own warm lambda-clean process with its own local DynamoDB.
+    # 20 ms of network latency is added to each AWS request.
+    import multiprocessing
+    import os
+    import time
+    from datetime import timezone
+
+    import boto3
+    import requests
+    from modules.async_ingestion.async_ingestion import (
+        _fake_api_results,
+        _free_port,
+    )
+    from modules.ingestion.ingestion import split_results
+    from modules.storage.storage import object_store
+
+    latency, max_shards = 0.02, 8
+    logging.disable(logging.INFO)
+    os.environ.update(
+        {
+            "AWS_ACCESS_KEY_ID": "benchmark",
+            "AWS_SECRET_ACCESS_KEY": "benchmark",
+            "AWS_DEFAULT_REGION": "us-east-1",
+            "REGION_NAME": "us-east-1",
+        }
+    )
+    s3_port = _free_port()
+    multiprocessing.Process(
+        target=_serve_s3, args=(s3_port,), daemon=True
+    ).start()
+    for _ in range(100):
+        try:
+            requests.get(f"http://127.0.0.1:{s3_port}")
+            break
+        except requests.ConnectionError:
+            time.sleep(0.1)
+
+    clean_dir = os.path.join(os.getcwd(), "..", "lambda-clean")
+    workers = []
+    for _ in range(max_shards):
+        conn, worker_conn = multiprocessing.Pipe()
+        multiprocessing.Process(
+            target=_clean_worker,
+            args=(clean_dir, s3_port, latency, worker_conn),
+            daemon=True,
+        ).start()
+        workers.append(conn)
+    for conn in workers:
+        conn.recv()
+
+    os.environ["AWS_ENDPOINT_URL_S3"] = f"http://127.0.0.1:{s3_port}"
+    boto3.client("s3").create_bucket(Bucket="bucket-raw-benchmark")
+    boto3.setup_default_session()
+    boto3.DEFAULT_SESSION.events.register(
+        "before-send", lambda **kwargs: time.sleep(latency)
+    )
+    objects = object_store("bucket-raw-benchmark")
+
+    _, measurements = split_results(
+        _fake_api_results(4000, "BE"), "BE", datetime.now().date()
+    )
+    print(f"{len(measurements)} measurements per run")
+    for num_items in [500, 2000, 8000, 40000]:
+        print(f"{num_items} items, shards: {shard_count(num_items)}")
+
+    for num_shards in [1, 2, 4, 8] * 2:
+        start = time.perf_counter()
+        # The shard count of the run, instead of the adaptive one
+        target_items = math.ceil(len(measurements) / num_shards)
+        shards, manifest = raw_run_objects(
+            measurements, datetime.now(timezone.utc), target_items, num_shards
+        )
+        keys = write_run(objects, shards, manifest)
+        written = time.perf_counter()
+
+        # One S3 notification, and invocation, per shard
+        for conn, key in zip(workers, keys[:-1]):
+            record = {
+                "s3": {
+                    "bucket": {"name": "bucket-raw-benchmark"},
+                    "object": {"key": key},
+                }
+            }
+            conn.send({"Records": [record]})
+        statuses = [conn.recv() for conn in workers[: len(keys) - 1]]
+        assert statuses == [200] * len(statuses), statuses
+        duration = time.perf_counter() - start
+        print(
+            f"shards {num_shards}: {duration:.3f} s end-to-end, "
+            f"raw {written - start:.3f} s, "
+            f"clean {duration - written + start:.3f} s"
+        )
+        time.sleep(1)  # The next run has another prefix
+
+    for conn in workers:
+        conn.send(None)
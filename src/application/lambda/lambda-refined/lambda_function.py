@@ -1,27 +1,45 @@
 import os
 import uuid
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 
 import pandas as pd
-from modules.dynamodb_query.dynamodb_query import query_dynamodb_last_hours
+from modules.aggregation.aggregation import (
+    aggregate_windows,
+    parse_windows,
+    sum_parameters,
+    window_file_name,
+)
+from modules.data_artifacts.data_artifacts import (
+    ARTIFACTS_PREFIX,
+    publish_data_artifacts,
+)
+from modules.history.history import compact_history
 from modules.plots.make_save_plots import (
     make_save_bar_plot,
     make_save_dist_plot,
     make_save_folium_map_html,
 )
+from modules.profiling.profiling import profiled
 from modules.s3_upload.s3_upload import upload_files_to_s3
+from modules.spatial_index.spatial_index import (
+    SpatialIndex,
+    aggregate_cells,
+    station_index,
+)
+from modules.station_cache.station_cache import (
+    join_stations,
+    station_cache,
+    stations_with_items,
+)
+from modules.window_cache.window_cache import window_cache
 
-if __name__ != "__main__":
-    S3_BUCKET_NAME = os.environ["S3_BUCKET_NAME"]
-    DYNAMODB_TABLE_NAME = os.environ["DYNAMODB_TABLE_NAME"]
-    REGION_NAME = os.environ["REGION_NAME"]
-    QUERY_HOURS = int(os.environ["QUERY_HOURS"])
-
-    LAMBDA_TMP_PREFIX = "/tmp/{}".format(uuid.uuid4())
-    LOCAL_MAP_HTML_FILE = "{}_map_latest.html".format(LAMBDA_TMP_PREFIX)
-    LOCAL_DATA_HTML_FILE = "{}_data_latest.html".format(LAMBDA_TMP_PREFIX)
-    LOCAL_DATA_HTML_FILE_TEMPLATE = "modules/s3_upload/index_template.html"
-    LOCAL_BAR_PNG_FILE = "{}_bar_latest.png".format(LAMBDA_TMP_PREFIX)
-    LOCAL_DIST_PNG_FILE = "{}_dist_latest.png".format(LAMBDA_TMP_PREFIX)
+LAMBDA_TMP_PREFIX = "/tmp/{}".format(uuid.uuid4())
+LOCAL_MAP_HTML_FILE = "{}_map_latest.html".format(LAMBDA_TMP_PREFIX)
+LOCAL_DATA_HTML_FILE = "{}_data_latest.html".format(LAMBDA_TMP_PREFIX)
+LOCAL_DATA_HTML_FILE_TEMPLATE = "modules/s3_upload/index_template.html"
+LOCAL_BAR_PNG_FILE = "{}_bar_latest.png".format(LAMBDA_TMP_PREFIX)
+LOCAL_DIST_PNG_FILE = "{}_dist_latest.png".format(LAMBDA_TMP_PREFIX)
 
 # Define the file paths for the plots
 
@@ -36,11 +54,16 @@ ADD_LOCATIONS_ON_MAP = True
 S3_DATA_HTML_FILE = "data_index.html"
 S3_MAP_HTML_FILE = "index.html"
 
+# Define the data HTML tables, "table" or "json" for a paginated data island
+REPORT_FORMAT = "table"
+REPORT_MAX_ROWS = 1000
+REPORT_PAGE_SIZE = 50
+
 # Define the date formats
-DATE_FORMAT_QUERY = "%Y-%m-%dT%H:%M:%S%z"
 DATE_FORMAT_PLOTS = "%Y-%m-%d %H:%M"
 
 
+@profiled
 def lambda_handler(event: dict, context: dict) -> dict:
     """
     AWS Lambda function handler.
@@ -52,80 +75,139 @@ def lambda_handler(event: dict, context: dict) -> dict:
     Returns:
     dict: Response with status code and body.
     """
+    config = load_config()
+    query_windows = config["query_windows"]
 
-    # Query DynamoDB for items from the last specified hours
-    from_time, to_time, items = query_dynamodb_last_hours(
-        DYNAMODB_TABLE_NAME,
-        QUERY_HOURS,
-        REGION_NAME,
-        DATE_FORMAT_QUERY,
-        DATE_FORMAT_PLOTS,
+    # Query DynamoDB once for items of the largest window,
+    # only the items ingested since the previous warm invocation
+    now = datetime.now(timezone.utc)
+    to_time = now.strftime(DATE_FORMAT_PLOTS)
+    query_hours = max(query_windows)
+    df = window_cache().query(
+        config["dynamodb_table_name"],
+        query_hours,
+        config["region_name"],
+        now,
     )
-    num_measurements = len(items)
-    if num_measurements == 0:
+    if len(df) == 0:
         return {
             "statusCode": 200,
-            "body": f"No items found in the last {QUERY_HOURS} hours.",
+            "body": f"No items found in the last {query_hours} hours.",
         }
 
-    # Convert the items to a DataFrame
-    df = pd.DataFrame(items)
+    # Read the station metadata, cached across invocations
+    df_stations = stations_with_items(
+        station_cache(
+            config["station_table_name"], config["region_name"]
+        ).refresh(),
+        df,
+    )
+
+    # Index the stations by their cell, built again only when
+    # the stations change
+    index = station_index(df_stations)
 
     # Calculate the average pollutants for each location and parameter
-    # Assumes all location have same longitude and latitude
-    df_avg_value_parameters = (
-        df.groupby(["location", "parameter"])
-        .agg(
-            {
-                "value": ["mean", "count"],
-                "longitude": "first",
-                "latitude": "first",
-            }
+    # of every window, in a single pass
+    aggregates = aggregate_windows(df, query_windows, now)
+
+    # Downsample the complete hours into the long-range history
+    compact_history(config["s3_bucket_name"], df, now, query_hours)
+
+    # Plot and save the results of each window
+    for hours, (
+        num_measurements,
+        df_avg_value_parameters,
+    ) in aggregates.items():
+        if num_measurements == 0:
+            continue
+        from_time = (now - timedelta(hours=hours)).strftime(DATE_FORMAT_PLOTS)
+        save_window_results(
+            hours,
+            hours == query_windows[0],
+            from_time,
+            to_time,
+            num_measurements,
+            join_stations(df_avg_value_parameters, df_stations),
+            df_stations,
+            index,
+            config["s3_bucket_name"],
+            config["region_name"],
         )
-        .reset_index()
-    )
 
-    # Flatten the MultiIndex columns
-    df_avg_value_parameters.columns = [
-        "_".join(col).strip() for col in df_avg_value_parameters.columns.values
-    ]
+    return {"statusCode": 200, "body": "Results saved to S3."}
 
-    # Rename the columns
-    df_avg_value_parameters.rename(
-        columns={
-            "location_": "location",
-            "parameter_": "parameter",
-            "value_mean": "avg_pollutants",
-            "value_count": "num_measurements",
-            "longitude_first": "longitude",
-            "latitude_first": "latitude",
-        },
-        inplace=True,
-    )
 
-    # Calculate the sum of average pollutants for each location
-    df_sum_parameters = (
-        df_avg_value_parameters.groupby("location")
-        .agg(
-            {
-                "avg_pollutants": "sum",
-                "num_measurements": "sum",
-                "longitude": "first",
-                "latitude": "first",
-            }
-        )
-        .reset_index()
+@lru_cache(maxsize=1)
+def load_config() -> dict:
+    """
+    Read the configuration from the environment variables,
+    once per execution environment, at the first invocation.
+
+    Returns:
+    dict: The configuration
+    """
+    return {
+        "s3_bucket_name": os.environ["S3_BUCKET_NAME"],
+        "dynamodb_table_name": os.environ["DYNAMODB_TABLE_NAME"],
+        "station_table_name": os.environ["STATION_TABLE_NAME"],
+        "region_name": os.environ["REGION_NAME"],
+        # Windows in hours, the first one is the primary window
+        "query_windows": parse_windows(
+            os.environ.get("QUERY_WINDOWS") or os.environ["QUERY_HOURS"]
+        ),
+    }
+
+
+def save_window_results(
+    hours: int,
+    primary: bool,
+    from_time: str,
+    to_time: str,
+    num_measurements: int,
+    df_avg_value_parameters: pd.DataFrame,
+    df_stations: pd.DataFrame,
+    index: SpatialIndex,
+    s3_bucket_name: str,
+    region_name: str,
+) -> None:
+    """
+    Plot the results of a window and save them to S3.
+    The outputs of the primary window keep their file names,
+    the others are suffixed with the window, e.g. bar_latest_24h.png.
+
+    Parameters:
+    hours (int): The window in hours.
+    primary (bool): Whether the window is the primary window.
+    from_time (str): The start of the window.
+    to_time (str): The end of the window.
+    num_measurements (int): The number of measurements in the window.
+    df_avg_value_parameters (pd.DataFrame): The average pollutants
+    for each location and parameter in the window.
+    df_stations (pd.DataFrame): The station metadata, one row per location.
+    index (SpatialIndex): The index of the stations by cell.
+    s3_bucket_name (str): The name of the refined S3 bucket.
+    region_name (str): The AWS region name.
+    """
+    # Calculate the sum of average pollutants for each location,
+    # and its regional rollup for each grid cell and its neighbourhood
+    df_sum_parameters = join_stations(
+        sum_parameters(df_avg_value_parameters), df_stations
     )
+    df_cells = aggregate_cells(df_sum_parameters, index=index)
 
-    df_sum_parameters.rename(
-        columns={"avg_pollutants": "sum_avg_pollutants"}, inplace=True
+    local_map_html_file = window_file_name(LOCAL_MAP_HTML_FILE, hours, primary)
+    local_data_html_file = window_file_name(
+        LOCAL_DATA_HTML_FILE, hours, primary
     )
+    local_bar_png_file = window_file_name(LOCAL_BAR_PNG_FILE, hours, primary)
+    local_dist_png_file = window_file_name(LOCAL_DIST_PNG_FILE, hours, primary)
 
     # Plot the results
     make_save_folium_map_html(
         df_sum_parameters,
         ADD_LOCATIONS_ON_MAP,
-        LOCAL_MAP_HTML_FILE,
+        local_map_html_file,
     )
     make_save_bar_plot(
         from_time,
@@ -134,7 +216,7 @@ def lambda_handler(event: dict, context: dict) -> dict:
         df_sum_parameters,
         df_avg_value_parameters,
         TOP_BAR,
-        LOCAL_BAR_PNG_FILE,
+        local_bar_png_file,
     )
     make_save_dist_plot(
         from_time,
@@ -142,41 +224,63 @@ def lambda_handler(event: dict, context: dict) -> dict:
         num_measurements,
         df_sum_parameters,
         TOP_DIST,
-        LOCAL_DIST_PNG_FILE,
+        local_dist_png_file,
     )
 
     # Save the DataFrame to S3
     png_files = [
         # (LOCAL_MAP_HTML_FILE, S3_MAP_HTML_FILE),
-        (LOCAL_BAR_PNG_FILE, S3_BAR_PNG_FILE),
-        (LOCAL_DIST_PNG_FILE, S3_DIST_PNG_FILE),
+        (
+            local_bar_png_file,
+            window_file_name(S3_BAR_PNG_FILE, hours, primary),
+        ),
+        (
+            local_dist_png_file,
+            window_file_name(S3_DIST_PNG_FILE, hours, primary),
+        ),
     ]
     upload_files_to_s3(
         from_time,
         to_time,
-        S3_BUCKET_NAME,
-        REGION_NAME,
+        s3_bucket_name,
+        region_name,
         df_sum_parameters,
         df_avg_value_parameters,
-        LOCAL_DATA_HTML_FILE,
-        S3_DATA_HTML_FILE,
+        local_data_html_file,
+        window_file_name(S3_DATA_HTML_FILE, hours, primary),
         LOCAL_DATA_HTML_FILE_TEMPLATE,
-        LOCAL_MAP_HTML_FILE,
-        S3_MAP_HTML_FILE,
+        local_map_html_file,
+        window_file_name(S3_MAP_HTML_FILE, hours, primary),
         png_files,
+        REPORT_FORMAT,
+        REPORT_MAX_ROWS,
+        REPORT_PAGE_SIZE,
     )
 
-    return {"statusCode": 200, "body": "Results saved to S3."}
+    # Publish the aggregates as data artifacts
+    publish_data_artifacts(
+        s3_bucket_name,
+        from_time,
+        to_time,
+        df_sum_parameters,
+        df_avg_value_parameters,
+        artifacts_prefix=window_file_name(ARTIFACTS_PREFIX, hours, primary),
+        df_cells=df_cells,
+    )
 
 
 if __name__ == "__main__":
     # Define event, context, and environment variables as needed
     event = {}
     context = {}
-    S3_BUCKET_NAME = "bucket-refined-ad29"
-    DYNAMODB_TABLE_NAME = "table-clean"
-    REGION_NAME = "us-east-1"
-    QUERY_HOURS = 12
+    os.environ["S3_BUCKET_NAME"] = "bucket-refined-ad29"
+    os.environ["DYNAMODB_TABLE_NAME"] = "table-clean"
+    os.environ["STATION_TABLE_NAME"] = "table-stations"
+    os.environ["REGION_NAME"] = "us-east-1"
+    os.environ["QUERY_WINDOWS"] = "12,1,24"
+
+    # Read and write data/00_storage instead of DynamoDB and S3
+    # os.environ["STORAGE_BACKEND"] = "local"
 
     LOCAL_TMP_PREFIX = "data/00_test"
     LOCAL_MAP_HTML_FILE = "{}/map_latest.html".format(LOCAL_TMP_PREFIX)
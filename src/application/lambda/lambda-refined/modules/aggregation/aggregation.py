@@ -0,0 +1,215 @@
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+DATE_ATTRIBUTE = "lastUpdated"
+
+
+def parse_windows(windows: str) -> List[int]:
+    """
+    Parse a comma separated list of windows in hours, e.g. "6,1,24".
+    The first window is the primary window of the refined outputs.
+
+    Parameters:
+    windows (str): The windows in hours
+
+    Returns:
+    List[int]: The unique windows in hours, in order
+    """
+    hours = [int(window) for window in windows.split(",") if window.strip()]
+    if not hours or min(hours) <= 0:
+        raise ValueError(f"Invalid windows: {windows}")
+    return list(dict.fromkeys(hours))
+
+
+def window_file_name(file_name: str, hours: int, primary: bool) -> str:
+    """
+    Get the file name of a window output, e.g. bar_latest_24h.png.
+    The outputs of the primary window keep their file name.
+
+    Parameters:
+    file_name (str): The file name of the output
+    hours (int): The window in hours
+    primary (bool): Whether the window is the primary window
+
+    Returns:
+    str: The file name of the window output
+    """
+    if primary:
+        return file_name
+    root, extension = os.path.splitext(file_name)
+    return f"{root}_{hours}h{extension}"
+
+
+def aggregate_windows(
+    df: pd.DataFrame, windows: List[int], now: datetime
+) -> Dict[int, Tuple[int, pd.DataFrame]]:
+    """
+    Calculate the average pollutants for each location and parameter
+    of several time windows, in a single pass over the measurements.
+    The measurements are sorted once by location, parameter and time,
+    each window is then a suffix of each group, found by binary search,
+    and its sum a difference of cumulative sums.
+
+    Parameters:
+    df (pd.DataFrame): The measurements of the largest window
+    windows (List[int]): The windows in hours
+    now (datetime): The end of the windows
+
+    Returns:
+    Dict[int, Tuple[int, pd.DataFrame]]: The number of measurements
+    and the average pollutants of each window
+    """
+    # Group codes, sorted by location then parameter
+    location_codes, locations = pd.factorize(df["location"], sort=True)
+    parameter_codes, parameters = pd.factorize(df["parameter"], sort=True)
+    group_codes = location_codes.astype(np.int64) * len(parameters)
+    group_codes += parameter_codes
+
+    # Times in seconds, relative to the earliest measurement
+    times = pd.to_datetime(df[DATE_ATTRIBUTE], utc=True, format="ISO8601")
+    seconds = times.dt.tz_localize(None).to_numpy()
+    seconds = seconds.astype("datetime64[s]").astype(np.int64)
+    earliest = int(seconds.min()) if len(seconds) else 0
+    seconds -= earliest
+    span = int(seconds.max()) + 1 if len(seconds) else 1
+
+    # Sort once by group and time, and accumulate the values
+    sort_keys = group_codes * span + seconds
+    order = np.argsort(sort_keys, kind="stable")
+    sort_keys = sort_keys[order]
+    values = pd.to_numeric(df["value"]).to_numpy(dtype=np.float64)[order]
+    cumulative_sums = np.concatenate(([0.0], np.cumsum(values)))
+
+    # Group boundaries in the sorted measurements
+    sorted_codes = group_codes[order]
+    starts = np.flatnonzero(
+        np.concatenate(([True], sorted_codes[1:] != sorted_codes[:-1]))
+    )
+    ends = np.append(starts[1:], len(sorted_codes))
+    codes = sorted_codes[starts]
+
+    # Group attributes, the station metadata is joined by location
+    group_locations = np.asarray(locations)[codes // len(parameters)]
+    group_parameters = np.asarray(parameters)[codes % len(parameters)]
+
+    aggregates = {}
+    for hours in windows:
+        # Measurements strictly after the start of the window
+        window_start = now - timedelta(hours=hours)
+        start_seconds = int(window_start.timestamp()) - earliest
+        window_starts = np.searchsorted(
+            sort_keys, codes * span + start_seconds, side="right"
+        )
+        window_starts = np.clip(window_starts, starts, ends)
+
+        counts = ends - window_starts
+        sums = cumulative_sums[ends] - cumulative_sums[window_starts]
+        in_window = counts > 0
+        df_avg_value_parameters = pd.DataFrame(
+            {
+                "location": group_locations[in_window],
+                "parameter": group_parameters[in_window],
+                "avg_pollutants": sums[in_window] / counts[in_window],
+                "num_measurements": counts[in_window],
+            }
+        )
+        aggregates[hours] = (int(counts.sum()), df_avg_value_parameters)
+        logging.info(f"Found {counts.sum()} items in the last {hours} hours.")
+    return aggregates
+
+
+def sum_parameters(df_avg_value_parameters: pd.DataFrame) -> pd.DataFrame:
+    """
+    Calculate the sum of average pollutants for each location.
+
+    Parameters:
+    df_avg_value_parameters (pd.DataFrame): The average pollutants
+    for each location and parameter
+
+    Returns:
+    pd.DataFrame: The sum of average pollutants for each location
+    """
+    df_sum_parameters = (
+        df_avg_value_parameters.groupby("location")
+        .agg(
+            {
+                "avg_pollutants": "sum",
+                "num_measurements": "sum",
+            }
+        )
+        .reset_index()
+    )
+
+    df_sum_parameters.rename(
+        columns={"avg_pollutants": "sum_avg_pollutants"}, inplace=True
+    )
+    return df_sum_parameters
+
+
+def _benchmark_measurements(num_locations: int, now: datetime) -> pd.DataFrame:
+    """
+    Create 24 hours of hourly measurements of the given number of
+    locations, with 8 pollutants per location.
+    """
+    parameters = ["pm25", "pm10", "no2", "o3", "so2", "co", "no", "pm1"]
+    hours = [
+        (now - timedelta(hours=hour)).strftime("%Y-%m-%dT%H:%M:%S+00:00")
+        for hour in range(24)
+    ]
+    num_items = num_locations * len(parameters) * len(hours)
+    return pd.DataFrame(
+        {
+            "location": np.repeat(
+                [f"Station {i}" for i in range(num_locations)],
+                len(parameters) * len(hours),
+            ),
+            "parameter": np.tile(
+                np.repeat(parameters, len(hours)), num_locations
+            ),
+            "lastUpdated": hours * num_locations * len(parameters),
+            "value": np.random.random(num_items) * 100,
+            "longitude": 4.5,
+            "latitude": 50.5,
+        }
+    )
+
+
+if __name__ == "__main__":
+    # Benchmark the single pass against one groupby per window
+    now = datetime.now(timezone.utc).replace(minute=30)
+    windows = [6, 1, 24]
+    df = _benchmark_measurements(1000, now)
+    print(f"{len(df)} measurements, windows: {windows}")
+
+    start = time.perf_counter()
+    aggregates = aggregate_windows(df, windows, now)
+    print(f"single pass: {time.perf_counter() - start:.3f} s")
+
+    start = time.perf_counter()
+    times = pd.to_datetime(df["lastUpdated"], utc=True, format="ISO8601")
+    for hours in windows:
+        df_window = df[times > now - timedelta(hours=hours)]
+        expected = (
+            df_window.groupby(["location", "parameter"])
+            .agg(
+                avg_pollutants=("value", "mean"),
+                num_measurements=("value", "count"),
+            )
+            .reset_index()
+        )
+        _, df_avg_value_parameters = aggregates[hours]
+        assert np.allclose(
+            expected["avg_pollutants"],
+            df_avg_value_parameters["avg_pollutants"],
+        )
+    print(f"groupby per window: {time.perf_counter() - start:.3f} s")
@@ -0,0 +1,207 @@
+import gzip
+import io
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import pandas as pd
+from modules.storage.storage import ObjectStore, object_store
+
+# pyarrow writes the Parquet artifacts.
+# Only the JSON artifact is published if it is not installed.
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+ARTIFACTS_PREFIX = "data/aggregates"
+LATEST_FILE = "latest.json"
+KEY_DATE_FORMAT = "%Y-%m-%d-%H-%M-%S"
+
+# Versioned artifacts never change, the latest pointer is always
+# revalidated against its ETag, a cheap 304 if unchanged.
+VERSIONED_CACHE_CONTROL = "public, max-age=31536000, immutable"
+LATEST_CACHE_CONTROL = "no-cache"
+
+
+def publish_data_artifacts(
+    s3_bucket_name: str,
+    from_time: str,
+    to_time: str,
+    df_sum_parameters: pd.DataFrame,
+    df_avg_value_parameters: pd.DataFrame,
+    generated_at: Optional[datetime] = None,
+    artifacts_prefix: str = ARTIFACTS_PREFIX,
+    df_cells: Optional[pd.DataFrame] = None,
+) -> dict:
+    """
+    Publish the refined aggregates as versioned data artifacts:
+    a gzip JSON document of both tables for the browser,
+    a Parquet file per table for analytics,
+    and the latest pointer to the artifacts.
+
+    Parameters:
+    s3_bucket_name (str): The name of the S3 bucket
+    from_time (str): The start of the aggregated time range
+    to_time (str): The end of the aggregated time range
+    df_sum_parameters (pd.DataFrame): The sum of average pollutants
+    df_avg_value_parameters (pd.DataFrame): The average pollutants
+    generated_at (datetime, optional): The version time, defaults to now
+    artifacts_prefix (str, optional): The S3 prefix of the artifacts
+    df_cells (pd.DataFrame, optional): The regional rollup by grid cell
+
+    Returns:
+    dict: The latest pointer
+    """
+    if generated_at is None:
+        generated_at = datetime.now(timezone.utc)
+    version_prefix = (
+        f"{artifacts_prefix}/{generated_at.strftime(KEY_DATE_FORMAT)}"
+    )
+    tables = {
+        "sumParameters": to_numeric(df_sum_parameters),
+        "avgParameters": to_numeric(df_avg_value_parameters),
+    }
+    if df_cells is not None:
+        tables["cellParameters"] = to_numeric(df_cells)
+    metadata = {
+        "fromTime": from_time,
+        "toTime": to_time,
+        "generatedAt": generated_at.isoformat(),
+    }
+
+    objects = object_store(s3_bucket_name)
+
+    # The JSON document of both tables
+    json_key = f"{version_prefix}/aggregates.json.gz"
+    put_artifact(
+        objects,
+        json_key,
+        gzip_json_document(metadata, tables),
+        "application/json",
+        VERSIONED_CACHE_CONTROL,
+        content_encoding="gzip",
+    )
+
+    # The Parquet file of each table
+    parquet_keys = {}
+    if pyarrow is not None:
+        for name, df in tables.items():
+            parquet_key = f"{version_prefix}/{name}.parquet"
+            put_artifact(
+                objects,
+                parquet_key,
+                parquet_file(df),
+                "application/vnd.apache.parquet",
+                VERSIONED_CACHE_CONTROL,
+            )
+            parquet_keys[name] = parquet_key
+    else:
+        logging.info("pyarrow is not installed, Parquet artifacts skipped.")
+
+    # The latest pointer, written last so it never points to missing keys
+    latest = {**metadata, "json": json_key, "parquet": parquet_keys}
+    put_artifact(
+        objects,
+        f"{artifacts_prefix}/{LATEST_FILE}",
+        json.dumps(latest).encode(),
+        "application/json",
+        LATEST_CACHE_CONTROL,
+    )
+    logging.info(f"Data artifacts published to S3: {version_prefix}")
+    return latest
+
+
+def gzip_json_document(
+    metadata: dict, tables: Dict[str, pd.DataFrame]
+) -> bytes:
+    """
+    Create the gzip JSON document of the tables,
+    each table as its columns and rows.
+    A same document always gives the same bytes, hence the same ETag.
+
+    Parameters:
+    metadata (dict): The document fields, e.g. the time range
+    tables (Dict[str, pd.DataFrame]): The tables by document field
+
+    Returns:
+    bytes: The gzip JSON document
+    """
+    fields = [
+        f"{json.dumps(key)}:{json.dumps(value)}"
+        for key, value in metadata.items()
+    ]
+    fields += [
+        f"{json.dumps(key)}:"
+        + df.to_json(orient="split", index=False, double_precision=6)
+        for key, df in tables.items()
+    ]
+    document = "{" + ",".join(fields) + "}"
+    return gzip.compress(document.encode(), mtime=0)
+
+
+def parquet_file(df: pd.DataFrame) -> bytes:
+    """
+    Create the Parquet file of a table.
+
+    Parameters:
+    df (pd.DataFrame): The table
+
+    Returns:
+    bytes: The Parquet file
+    """
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False, engine="pyarrow")
+    return buffer.getvalue()
+
+
+def to_numeric(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert the Decimal columns of DynamoDB numbers to floats.
+
+    Parameters:
+    df (pd.DataFrame): The table
+
+    Returns:
+    pd.DataFrame: The table with numeric columns
+    """
+    columns = {}
+    for column in df.columns[df.dtypes == object]:
+        numeric = pd.to_numeric(df[column], errors="coerce")
+        if numeric.notna().sum() == df[column].notna().sum():
+            columns[column] = numeric
+    return df.assign(**columns) if columns else df
+
+
+def put_artifact(
+    objects: ObjectStore,
+    s3_key: str,
+    body: bytes,
+    content_type: str,
+    cache_control: str,
+    content_encoding: Optional[str] = None,
+) -> None:
+    """
+    Upload a data artifact to S3 with its caching headers.
+
+    Parameters:
+    objects (ObjectStore): The S3 bucket
+    s3_key (str): The key of the artifact
+    body (bytes): The artifact
+    content_type (str): The content type of the artifact
+    cache_control (str): The Cache-Control header of the artifact
+    content_encoding (str, optional): The content encoding, e.g. gzip
+    """
+    objects.put_object(
+        s3_key,
+        body,
+        content_type=content_type,
+        cache_control=cache_control,
+        content_encoding=content_encoding,
+    )
+    logging.info(f"Data artifact uploaded to S3: {s3_key}")
@@ -1,8 +1,8 @@
 import logging
 from datetime import datetime, timedelta, timezone
+from typing import List, Optional
 
-import boto3
-from boto3.dynamodb.conditions import Attr
+from modules.storage.storage import item_table
 
 # Set up logging
 logger = logging.getLogger()
@@ -11,6 +11,10 @@ logger.setLevel("INFO")
 DATE_ATTRIBUTE = "lastUpdated"
 DATE_FORMAT_QUERY = "%Y-%m-%dT%H:%M:%S%z"
 DATE_FORMAT_PLOTS = "%Y-%m-%d %H:%M"
+INGESTED_ATTRIBUTE = "ingestedAt"
+INGESTED_HOUR_ATTRIBUTE = "ingestedHour"
+INGESTED_INDEX_NAME = "ingested-index"
+INGESTED_HOUR_FORMAT = "%Y-%m-%dT%H"
 
 
 def query_dynamodb_last_hours(
@@ -19,6 +23,7 @@ def query_dynamodb_last_hours(
     region_name: str = "us-east-1",
     date_format_query: str = DATE_FORMAT_QUERY,
     date_format_plots: str = DATE_FORMAT_PLOTS,
+    now: Optional[datetime] = None,
 ) -> tuple:
     """
     Query DynamoDB for items from the last specified hours.
@@ -29,16 +34,17 @@ def query_dynamodb_last_hours(
     region_name (str): The AWS region name. Default is 'us-east-1'.
     date_format_query (str): The date format for the query.
     date_format_plots (str): The date format for the plots.
+    now (datetime, optional): The end of the query, defaults to now.
 
     Returns:
     tuple: A tuple containing the from_time, to_time, and the items found.
     """
-    # Initialize DynamoDB client
-    dynamodb = boto3.resource("dynamodb", region_name)
-    table = dynamodb.Table(dynamodb_table_name)
+    # Initialize DynamoDB table, or its local stand-in
+    table = item_table(dynamodb_table_name, region_name)
 
     # Get the time of specified hours ago in the required format
-    now = datetime.now(timezone.utc)
+    if now is None:
+        now = datetime.now(timezone.utc)
     hours_ago = now - timedelta(hours=hours)
     hours_ago_str = hours_ago.strftime(date_format_query)
 
@@ -47,12 +53,56 @@ def query_dynamodb_last_hours(
     logging.info(
         f"Scanning items ingested after this UTC time: {hours_ago_str}..."
     )
-    response = table.scan(
-        FilterExpression=Attr(DATE_ATTRIBUTE).gt(hours_ago_str)
-    )
-    items = response["Items"]
+    # Scan all pages, the largest window may exceed one page of 1 MB
+    items = table.scan_after(DATE_ATTRIBUTE, hours_ago_str)
     logging.info(f"Found {len(items)} items in the last {hours} hours.")
 
     from_time = hours_ago.strftime(date_format_plots)
     to_time = now.strftime(date_format_plots)
     return from_time, to_time, items
+
+
+def query_dynamodb_ingested_after(
+    dynamodb_table_name: str,
+    after: datetime,
+    region_name: str = "us-east-1",
+    date_format_query: str = DATE_FORMAT_QUERY,
+    now: Optional[datetime] = None,
+    index_name: str = INGESTED_INDEX_NAME,
+) -> List[dict]:
+    """
+    Query DynamoDB for items ingested after a time,
+    through the ingested index, one query per hour of ingestion,
+    instead of scanning the table.
+
+    Parameters:
+    dynamodb_table_name (str): The name of the DynamoDB table.
+    after (datetime): The ingestion time to query after.
+    region_name (str): The AWS region name. Default is 'us-east-1'.
+    date_format_query (str): The date format for the query.
+    now (datetime, optional): The end of the query, defaults to now.
+    index_name (str): The name of the ingested index.
+
+    Returns:
+    List[dict]: The items found.
+    """
+    table = item_table(dynamodb_table_name, region_name)
+    if now is None:
+        now = datetime.now(timezone.utc)
+    after_str = after.strftime(date_format_query)
+
+    items = []
+    hour = after.replace(minute=0, second=0, microsecond=0)
+    while hour <= now:
+        items.extend(
+            table.query_after(
+                index_name,
+                INGESTED_HOUR_ATTRIBUTE,
+                hour.strftime(INGESTED_HOUR_FORMAT),
+                INGESTED_ATTRIBUTE,
+                after_str,
+            )
+        )
+        hour += timedelta(hours=1)
+    logging.info(f"Found {len(items)} items ingested after {after_str}.")
+    return items
@@ -0,0 +1,252 @@
+import math
+from functools import lru_cache
+from typing import List, Tuple
+
+# Keep this module identical in lambda-clean and lambda-refined,
+# the Lambda functions are built from their own folder only.
+# make shared-modules fails when the copies differ.
+
+# numpy assigns the cells of many coordinates at once.
+# Only the scalar functions are available if it is not installed.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+BASE32_INDEX = {char: i for i, char in enumerate(BASE32)}
+
+# ~150 m cells for stations, ~40 x 20 km cells for regional rollups and lookups
+GEOHASH_PRECISION = 7
+CELL_PRECISION = 4
+MAX_BBOX_CELLS = 10000
+
+KM_PER_DEGREE_LATITUDE = 111.32
+
+
+def _bits(precision: int) -> Tuple[int, int]:
+    """
+    Get the number of latitude and longitude bits of a precision,
+    the longitude gets the extra bit of odd numbers of bits.
+    """
+    num_bits = precision * 5
+    return num_bits // 2, (num_bits + 1) // 2
+
+
+def _interleave(lat_index: int, lon_index: int, precision: int) -> str:
+    """
+    Interleave the bits of the cell indexes, longitude first,
+    and encode them in base 32.
+    """
+    lat_bits, lon_bits = _bits(precision)
+    code = 0
+    for i in range(precision * 5):
+        if i % 2 == 0:
+            bit = (lon_index >> (lon_bits - 1 - i // 2)) & 1
+        else:
+            bit = (lat_index >> (lat_bits - 1 - i // 2)) & 1
+        code = (code << 1) | bit
+    return "".join(
+        BASE32[(code >> (5 * (precision - 1 - i))) & 31]
+        for i in range(precision)
+    )
+
+
+def _index(value: float, low: float, high: float, bits: int) -> int:
+    """
+    Get the index of the cell of a value along one axis.
+    """
+    index = int((value - low) / (high - low) * (1 << bits))
+    return min(max(index, 0), (1 << bits) - 1)
+
+
+@lru_cache(maxsize=4096)
+def encode(latitude, longitude, precision: int = GEOHASH_PRECISION) -> str:
+    """
+    Get the geohash of coordinates, computed once per station.
+
+    Parameters:
+    latitude (float | Decimal): The latitude
+    longitude (float | Decimal): The longitude
+    precision (int, optional): The number of characters of the geohash
+
+    Returns:
+    str: The geohash, e.g. u151703 in Brussels
+    """
+    lat_bits, lon_bits = _bits(precision)
+    return _interleave(
+        _index(float(latitude), -90.0, 90.0, lat_bits),
+        _index(float(longitude), -180.0, 180.0, lon_bits),
+        precision,
+    )
+
+
+def encode_array(latitudes, longitudes, precision: int = CELL_PRECISION):
+    """
+    Get the geohashes of many coordinates at once.
+
+    Parameters:
+    latitudes (array-like): The latitudes
+    longitudes (array-like): The longitudes
+    precision (int, optional): The number of characters of the geohashes
+
+    Returns:
+    np.ndarray: The geohashes, None for missing coordinates
+    """
+    if np is None:
+        raise ImportError("numpy is required to encode arrays")
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    lat_bits, lon_bits = _bits(precision)
+
+    valid = ~(np.isnan(latitudes) | np.isnan(longitudes))
+    lat_index = _index_array(latitudes[valid], -90.0, 90.0, lat_bits)
+    lon_index = _index_array(longitudes[valid], -180.0, 180.0, lon_bits)
+
+    code = np.zeros(len(lat_index), dtype=np.int64)
+    for i in range(precision * 5):
+        if i % 2 == 0:
+            bit = (lon_index >> (lon_bits - 1 - i // 2)) & 1
+        else:
+            bit = (lat_index >> (lat_bits - 1 - i // 2)) & 1
+        code = (code << 1) | bit
+
+    # Characters as ASCII codes, viewed as one string per row
+    alphabet = np.frombuffer(BASE32.encode(), dtype=np.uint8)
+    shifts = 5 * np.arange(precision - 1, -1, -1, dtype=np.int64)
+    chars = alphabet[(code[:, None] >> shifts) & 31]
+    geohashes = np.ascontiguousarray(chars).view(f"S{precision}").ravel()
+
+    result = np.full(len(latitudes), None, dtype=object)
+    result[valid] = geohashes.astype(str)
+    return result
+
+
+def _index_array(values, low: float, high: float, bits: int):
+    """
+    Get the indexes of the cells of values along one axis.
+    """
+    indexes = np.floor((values - low) / (high - low) * (1 << bits))
+    return np.clip(indexes, 0, (1 << bits) - 1).astype(np.int64)
+
+
+def decode_bbox(geohash: str) -> Tuple[float, float, float, float]:
+    """
+    Get the bounding box of a geohash cell.
+
+    Parameters:
+    geohash (str): The geohash
+
+    Returns:
+    Tuple[float, float, float, float]: The minimum latitude,
+    minimum longitude, maximum latitude and maximum longitude
+    """
+    precision = len(geohash)
+    lat_bits, lon_bits = _bits(precision)
+    code = 0
+    for char in geohash:
+        code = (code << 5) | BASE32_INDEX[char]
+
+    lat_index = lon_index = 0
+    for i in range(precision * 5):
+        bit = (code >> (precision * 5 - 1 - i)) & 1
+        if i % 2 == 0:
+            lon_index = (lon_index << 1) | bit
+        else:
+            lat_index = (lat_index << 1) | bit
+
+    lat_size = 180.0 / (1 << lat_bits)
+    lon_size = 360.0 / (1 << lon_bits)
+    min_lat = -90.0 + lat_index * lat_size
+    min_lon = -180.0 + lon_index * lon_size
+    return min_lat, min_lon, min_lat + lat_size, min_lon + lon_size
+
+
+def cells_in_bbox(
+    min_lat: float,
+    min_lon: float,
+    max_lat: float,
+    max_lon: float,
+    precision: int = CELL_PRECISION,
+) -> List[str]:
+    """
+    Get the geohash cells covering a bounding box.
+
+    Parameters:
+    min_lat (float): The minimum latitude
+    min_lon (float): The minimum longitude
+    max_lat (float): The maximum latitude
+    max_lon (float): The maximum longitude
+    precision (int, optional): The number of characters of the cells
+
+    Returns:
+    List[str]: The cells
+    """
+    lat_bits, lon_bits = _bits(precision)
+    lat_range = range(
+        _index(min_lat, -90.0, 90.0, lat_bits),
+        _index(max_lat, -90.0, 90.0, lat_bits) + 1,
+    )
+    lon_range = range(
+        _index(min_lon, -180.0, 180.0, lon_bits),
+        _index(max_lon, -180.0, 180.0, lon_bits) + 1,
+    )
+    if len(lat_range) * len(lon_range) > MAX_BBOX_CELLS:
+        raise ValueError(
+            f"Bounding box covers more than {MAX_BBOX_CELLS} cells, "
+            f"use a lower precision than {precision}"
+        )
+    return [
+        _interleave(lat_index, lon_index, precision)
+        for lat_index in lat_range
+        for lon_index in lon_range
+    ]
+
+
+def radius_bbox(
+    latitude: float, longitude: float, radius_km: float
+) -> Tuple[float, float, float, float]:
+    """
+    Get the bounding box of a circle.
+
+    Parameters:
+    latitude (float): The latitude of the center
+    longitude (float): The longitude of the center
+    radius_km (float): The radius in kilometers
+
+    Returns:
+    Tuple[float, float, float, float]: The minimum latitude,
+    minimum longitude, maximum latitude and maximum longitude
+    """
+    lat_delta = radius_km / KM_PER_DEGREE_LATITUDE
+    cos_latitude = max(math.cos(math.radians(latitude)), 1e-6)
+    lon_delta = min(radius_km / (KM_PER_DEGREE_LATITUDE * cos_latitude), 180)
+    return (
+        max(latitude - lat_delta, -90.0),
+        max(longitude - lon_delta, -180.0),
+        min(latitude + lat_delta, 90.0),
+        min(longitude + lon_delta, 180.0),
+    )
+
+
+def cells_in_radius(
+    latitude: float,
+    longitude: float,
+    radius_km: float,
+    precision: int = CELL_PRECISION,
+) -> List[str]:
+    """
+    Get the geohash cells covering a circle.
+
+    Parameters:
+    latitude (float): The latitude of the center
+    longitude (float): The longitude of the center
+    radius_km (float): The radius in kilometers
+    precision (int, optional): The number of characters of the cells
+
+    Returns:
+    List[str]: The cells
+    """
+    return cells_in_bbox(
+        *radius_bbox(latitude, longitude, radius_km), precision=precision
+    )
@@ -0,0 +1,315 @@
+import io
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import pandas as pd
+from modules.storage.storage import ObjectStore, object_store
+
+# pyarrow reads and writes the Parquet history.
+# The history is not compacted if it is not installed.
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+HISTORY_PREFIX = "history"
+HOURLY = "hourly"
+DAILY = "daily"
+RESOLUTIONS = (HOURLY, DAILY)
+
+KEY_COLUMNS = ["time", "location", "parameter"]
+HISTORY_COLUMNS = KEY_COLUMNS + ["mean", "min", "max", "count"]
+
+
+def compact_history(
+    s3_bucket_name: str,
+    df: pd.DataFrame,
+    now: datetime,
+    hours: int,
+    history_prefix: str = HISTORY_PREFIX,
+) -> None:
+    """
+    Downsample the measurements of the complete hours of the last hours
+    into hourly and daily aggregates per location and parameter,
+    and merge them into the history.
+    The hours are compacted again on each run, so late measurements
+    are included until the hours leave the queried window.
+
+    The history is stored as Parquet files, partitioned by month:
+    - history/hourly/month=2024-05/2024-05-19.parquet, a file per day
+    - history/daily/month=2024-05/2024-05.parquet, a file per month
+
+    Parameters:
+    s3_bucket_name (str): The name of the S3 bucket
+    df (pd.DataFrame): The measurements of the last hours
+    now (datetime): The end of the last hours
+    hours (int): The number of hours queried
+    history_prefix (str, optional): The S3 prefix of the history
+    """
+    if pyarrow is None:
+        logging.info("pyarrow is not installed, history not compacted.")
+        return
+
+    # Complete hours only, the first and current hours are partial
+    end = pd.Timestamp(now).floor("h")
+    start = pd.Timestamp(now - timedelta(hours=hours)).ceil("h")
+    df_hourly = downsample_hourly(df, start, end)
+    if df_hourly.empty:
+        logging.info("No complete hours to compact.")
+        return
+
+    objects = object_store(s3_bucket_name)
+    for day, df_day in df_hourly.groupby(df_hourly["time"].dt.floor("D")):
+        # Replace the compacted hours of the day
+        hourly_key = history_key(history_prefix, HOURLY, day)
+        df_day_hourly = merge_history(
+            read_parquet(objects, hourly_key),
+            df_day,
+            start,
+            end,
+        )
+        write_parquet(objects, hourly_key, df_day_hourly)
+
+        # Replace the day in the month
+        daily_key = history_key(history_prefix, DAILY, day)
+        df_month_daily = merge_history(
+            read_parquet(objects, daily_key),
+            downsample_daily(df_day_hourly),
+            day,
+            day + pd.Timedelta(days=1),
+        )
+        write_parquet(objects, daily_key, df_month_daily)
+
+    logging.info(
+        f"History compacted from {start} to {end}: {len(df_hourly)} hours."
+    )
+
+
+def downsample_hourly(
+    df: pd.DataFrame, start: pd.Timestamp, end: pd.Timestamp
+) -> pd.DataFrame:
+    """
+    Downsample measurements into hourly aggregates
+    per location and parameter.
+
+    Parameters:
+    df (pd.DataFrame): The measurements
+    start (pd.Timestamp): The start of the first hour
+    end (pd.Timestamp): The end of the last hour
+
+    Returns:
+    pd.DataFrame: The time, location, parameter, mean, min, max and count
+    of each hour, location and parameter
+    """
+    times = pd.to_datetime(df["lastUpdated"], utc=True, format="ISO8601")
+    in_range = (times >= start) & (times < end)
+    df_range = pd.DataFrame(
+        {
+            "time": times[in_range].dt.floor("h"),
+            "location": df["location"][in_range],
+            "parameter": df["parameter"][in_range],
+            "value": pd.to_numeric(df["value"][in_range]).astype(float),
+        }
+    )
+    df_hourly = (
+        df_range.groupby(KEY_COLUMNS)["value"]
+        .agg(["mean", "min", "max", "count"])
+        .reset_index()
+    )
+    return df_hourly[HISTORY_COLUMNS]
+
+
+def downsample_daily(df_hourly: pd.DataFrame) -> pd.DataFrame:
+    """
+    Downsample hourly aggregates into daily aggregates
+    per location and parameter, the means weighted by the counts.
+
+    Parameters:
+    df_hourly (pd.DataFrame): The hourly aggregates
+
+    Returns:
+    pd.DataFrame: The daily aggregates
+    """
+    df_days = df_hourly.assign(
+        time=df_hourly["time"].dt.floor("D"),
+        sum=df_hourly["mean"] * df_hourly["count"],
+    )
+    df_daily = (
+        df_days.groupby(KEY_COLUMNS)
+        .agg(
+            {"sum": "sum", "min": "min", "max": "max", "count": "sum"},
+        )
+        .reset_index()
+    )
+    df_daily["mean"] = df_daily["sum"] / df_daily["count"]
+    return df_daily[HISTORY_COLUMNS]
+
+
+def merge_history(
+    df_history: Optional[pd.DataFrame],
+    df_new: pd.DataFrame,
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+) -> pd.DataFrame:
+    """
+    Replace the aggregates of a time range of the history.
+
+    Parameters:
+    df_history (pd.DataFrame, optional): The stored aggregates
+    df_new (pd.DataFrame): The new aggregates of the time range
+    start (pd.Timestamp): The start of the time range
+    end (pd.Timestamp): The end of the time range
+
+    Returns:
+    pd.DataFrame: The merged aggregates, sorted by time
+    """
+    if df_history is not None and not df_history.empty:
+        outside = (df_history["time"] < start) | (df_history["time"] >= end)
+        df_new = pd.concat([df_history[outside], df_new], ignore_index=True)
+    return df_new.sort_values(KEY_COLUMNS, ignore_index=True)
+
+
+def read_history(
+    s3_bucket_name: str,
+    start: datetime,
+    end: datetime,
+    resolution: str = HOURLY,
+    locations: Optional[List[str]] = None,
+    parameters: Optional[List[str]] = None,
+    history_prefix: str = HISTORY_PREFIX,
+) -> pd.DataFrame:
+    """
+    Read the aggregates of a time range from the history.
+    Only the files of the time range are read.
+    Naive datetimes are read as UTC, as the history times.
+
+    Parameters:
+    s3_bucket_name (str): The name of the S3 bucket
+    start (datetime): The start of the time range, included
+    end (datetime): The end of the time range, excluded
+    resolution (str, optional): "hourly" or "daily"
+    locations (List[str], optional): The locations, defaults to all
+    parameters (List[str], optional): The parameters, defaults to all
+    history_prefix (str, optional): The S3 prefix of the history
+
+    Returns:
+    pd.DataFrame: The time, location, parameter, mean, min, max and count
+    of the aggregates, sorted by time
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution: {resolution}")
+    start = utc_timestamp(start)
+    end = utc_timestamp(end)
+
+    # Files of the days or months of the time range
+    if resolution == HOURLY:
+        periods = pd.date_range(start.floor("D"), end, freq="D")
+    else:
+        periods = pd.date_range(
+            start.floor("D").replace(day=1), end, freq="MS"
+        )
+    periods = [period for period in periods if period < end]
+
+    objects = object_store(s3_bucket_name)
+    frames = []
+    for period in periods:
+        key = history_key(history_prefix, resolution, period)
+        df = read_parquet(objects, key)
+        if df is None:
+            continue
+        selected = (df["time"] >= start) & (df["time"] < end)
+        if locations is not None:
+            selected &= df["location"].isin(locations)
+        if parameters is not None:
+            selected &= df["parameter"].isin(parameters)
+        frames.append(df[selected])
+
+    if not frames:
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+    return pd.concat(frames, ignore_index=True).sort_values(
+        KEY_COLUMNS, ignore_index=True
+    )
+
+
+def utc_timestamp(time: datetime) -> pd.Timestamp:
+    """
+    Convert a time to a UTC timestamp, comparable with the history times.
+
+    Parameters:
+    time (datetime): The time, read as UTC if naive
+
+    Returns:
+    pd.Timestamp: The UTC timestamp
+    """
+    time = pd.Timestamp(time)
+    if time.tzinfo is None:
+        return time.tz_localize(timezone.utc)
+    return time.tz_convert(timezone.utc)
+
+
+def history_key(
+    history_prefix: str, resolution: str, time: pd.Timestamp
+) -> str:
+    """
+    Get the key of the history file of a time.
+
+    Parameters:
+    history_prefix (str): The S3 prefix of the history
+    resolution (str): "hourly" or "daily"
+    time (pd.Timestamp): The time
+
+    Returns:
+    str: The key of the file, a day of hours or a month of days
+    """
+    month = time.strftime("%Y-%m")
+    file_name = time.strftime("%Y-%m-%d") if resolution == HOURLY else month
+    return f"{history_prefix}/{resolution}/month={month}/{file_name}.parquet"
+
+
+def read_parquet(objects: ObjectStore, s3_key: str) -> Optional[pd.DataFrame]:
+    """
+    Read a Parquet history file from S3.
+
+    Parameters:
+    objects (ObjectStore): The S3 bucket
+    s3_key (str): The key of the file
+
+    Returns:
+    pd.DataFrame: The aggregates, None if the file does not exist
+    """
+    body = objects.get_object(s3_key)
+    if body is None:
+        return None
+    return pd.read_parquet(io.BytesIO(body))
+
+
+def write_parquet(objects: ObjectStore, s3_key: str, df: pd.DataFrame) -> None:
+    """
+    Write a Parquet history file to S3.
+
+    Parameters:
+    objects (ObjectStore): The S3 bucket
+    s3_key (str): The key of the file
+    df (pd.DataFrame): The aggregates
+    """
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False, engine="pyarrow")
+    objects.put_object(
+        s3_key,
+        buffer.getvalue(),
+        content_type="application/vnd.apache.parquet",
+    )
+    logging.info(f"History file uploaded to S3: {s3_key}")
+
+
+if __name__ == "__main__":
+    # Read the daily history of the last 30 days
+    s3_bucket_name = "bucket-refined-ad29"
+    now = datetime.now(timezone.utc)
+    df = read_history(s3_bucket_name, now - timedelta(days=30), now, DAILY)
+    print(df)
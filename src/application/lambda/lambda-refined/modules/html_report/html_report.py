@@ -0,0 +1,317 @@
+import html
+import io
+import logging
+import time
+from string import Formatter
+from typing import Callable, Dict, List, Optional, TextIO, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+# Report formats, the rows as HTML table rows
+# or as a JSON data island rendered and paginated client-side
+REPORT_FORMAT_TABLE = "table"
+REPORT_FORMAT_JSON = "json"
+REPORT_FORMATS = (REPORT_FORMAT_TABLE, REPORT_FORMAT_JSON)
+
+TABLE_CLASS = "table table-striped"
+FLOAT_FORMAT = "{:.6f}"
+ROWS_PER_WRITE = 1000
+
+# Renders the JSON data island preceding the script as a paginated table
+PAGINATION_SCRIPT = """<script>
+(function (island) {
+    var data = JSON.parse(island.textContent);
+    var pageSize = parseInt(island.dataset.pageSize, 10);
+    var pages = Math.max(1, Math.ceil(data.data.length / pageSize));
+    var page = 0;
+    var table = document.createElement("table");
+    var nav = document.createElement("div");
+    var previous = document.createElement("button");
+    var next = document.createElement("button");
+    var label = document.createElement("span");
+    table.className = island.dataset.tableClass;
+    previous.textContent = "Previous";
+    next.textContent = "Next";
+    previous.onclick = function () {
+        page = Math.max(0, page - 1);
+        render();
+    };
+    next.onclick = function () {
+        page = Math.min(pages - 1, page + 1);
+        render();
+    };
+    nav.append(previous, label, next);
+    island.before(table, nav);
+    function row(cells, tag) {
+        var tr = document.createElement("tr");
+        cells.forEach(function (cell) {
+            var td = document.createElement(tag);
+            td.textContent = cell === null ? "" : cell;
+            tr.appendChild(td);
+        });
+        return tr;
+    }
+    function render() {
+        var thead = document.createElement("thead");
+        var tbody = document.createElement("tbody");
+        thead.appendChild(row(data.columns, "th"));
+        data.data
+            .slice(page * pageSize, (page + 1) * pageSize)
+            .forEach(function (cells) {
+                tbody.appendChild(row(cells, "td"));
+            });
+        table.replaceChildren(thead, tbody);
+        label.textContent = " Page " + (page + 1) + " of " + pages + " ";
+    }
+    render();
+})(document.currentScript.previousElementSibling);
+</script>
+"""
+
+TableWriter = Callable[[TextIO], None]
+
+
+def write_html_report(
+    file: TextIO,
+    template: str,
+    fields: Dict[str, Union[str, TableWriter]],
+) -> None:
+    """
+    Write a report from a str.format template, streaming each field.
+    Text fields are written as is, table fields write their rows
+    straight to the file, so the page is never held in memory.
+
+    Parameters:
+    file (TextIO): The output file
+    template (str): The str.format template, e.g. index_template.html
+    fields (Dict[str, str | TableWriter]): The text or table writer
+    of each template field
+    """
+    for literal_text, field_name, _, _ in Formatter().parse(template):
+        file.write(literal_text)
+        if field_name is None:
+            continue
+        field = fields[field_name]
+        if callable(field):
+            field(file)
+        else:
+            file.write(field)
+
+
+def table_writer(
+    df: pd.DataFrame,
+    report_format: str = REPORT_FORMAT_TABLE,
+    sort_by: Optional[str] = None,
+    ascending: bool = False,
+    max_rows: Optional[int] = None,
+    page_size: int = 50,
+) -> TableWriter:
+    """
+    Create the writer of a DataFrame report table.
+
+    Parameters:
+    df (pd.DataFrame): The table
+    report_format (str): "table" for HTML rows,
+    "json" for a JSON data island paginated client-side
+    sort_by (str, optional): The column to sort the rows by
+    ascending (bool): Whether to sort the rows in ascending order
+    max_rows (int, optional): The maximum number of rows to write
+    page_size (int): The number of rows per page of the "json" format
+
+    Returns:
+    TableWriter: Writes the table to a file
+    """
+    if report_format not in REPORT_FORMATS:
+        raise ValueError(f"Unknown report format: {report_format}")
+
+    def write(file: TextIO) -> None:
+        num_rows = len(df)
+        rows = df
+        if sort_by is not None:
+            rows = rows.sort_values(sort_by, ascending=ascending)
+        if max_rows is not None and num_rows > max_rows:
+            rows = rows.head(max_rows)
+            file.write(
+                f"<p>Showing the first {max_rows} of {num_rows} rows.</p>\n"
+            )
+
+        if report_format == REPORT_FORMAT_JSON:
+            write_json_island(file, rows, page_size)
+        else:
+            write_table(file, rows)
+
+    return write
+
+
+def write_table(file: TextIO, df: pd.DataFrame) -> None:
+    """
+    Write a DataFrame as an HTML table, without its index.
+
+    Parameters:
+    file (TextIO): The output file
+    df (pd.DataFrame): The table
+    """
+    file.write(f'<table class="{TABLE_CLASS}">\n<thead>\n<tr>')
+    file.writelines(f"<th>{html.escape(str(c))}</th>" for c in df.columns)
+    file.write("</tr>\n</thead>\n<tbody>\n")
+
+    for start in range(0, len(df), ROWS_PER_WRITE):
+        end = start + ROWS_PER_WRITE
+        chunk = df.iloc[start:end]
+        columns = [format_column(chunk[c]) for c in chunk.columns]
+        file.writelines(
+            "<tr><td>" + "</td><td>".join(cells) + "</td></tr>\n"
+            for cells in zip(*columns)
+        )
+
+    file.write("</tbody>\n</table>\n")
+
+
+def format_column(column: pd.Series) -> List[str]:
+    """
+    Format the cells of a column as escaped HTML text.
+
+    Parameters:
+    column (pd.Series): The column
+
+    Returns:
+    List[str]: The formatted cells
+    """
+    values = column.to_numpy()
+    if values.dtype.kind == "f":
+        return [
+            "NaN" if np.isnan(value) else FLOAT_FORMAT.format(value)
+            for value in values.tolist()
+        ]
+    if values.dtype.kind in "iub":
+        return [str(value) for value in values.tolist()]
+    return [html.escape(str(value)) for value in values.tolist()]
+
+
+def write_json_island(file: TextIO, df: pd.DataFrame, page_size: int) -> None:
+    """
+    Write a DataFrame as a compact JSON data island,
+    followed by the script rendering it as a paginated table.
+
+    Parameters:
+    file (TextIO): The output file
+    df (pd.DataFrame): The table
+    page_size (int): The number of rows per page
+    """
+    data = df.to_json(
+        orient="split",
+        index=False,
+        double_precision=6,
+        default_handler=float,
+    )
+    # Prevent the data from closing the script element
+    data = data.replace("</", "<\\/")
+    file.write(
+        f'<script type="application/json" data-page-size="{page_size}" '
+        f'data-table-class="{TABLE_CLASS}">'
+    )
+    file.write(data)
+    file.write("</script>\n")
+    file.write(PAGINATION_SCRIPT)
+
+
+def _benchmark_tables(num_locations: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Create the refined report tables of the given number of locations,
+    with 8 pollutants per location.
+    """
+    parameters = ["pm25", "pm10", "no2", "o3", "so2", "co", "no", "pm1"]
+    df_avg = pd.DataFrame(
+        {
+            "location": np.repeat(
+                [f"Station {i}" for i in range(num_locations)],
+                len(parameters),
+            ),
+            "parameter": parameters * num_locations,
+            "avg_pollutants": np.random.random(num_locations * 8) * 100,
+            "num_measurements": np.random.randint(1, 12, num_locations * 8),
+            "longitude": np.random.random(num_locations * 8) + 4,
+            "latitude": np.random.random(num_locations * 8) + 50,
+        }
+    )
+    df_sum = (
+        df_avg.groupby("location")
+        .agg(
+            {
+                "avg_pollutants": "sum",
+                "num_measurements": "sum",
+                "longitude": "first",
+                "latitude": "first",
+            }
+        )
+        .reset_index()
+        .rename(columns={"avg_pollutants": "sum_avg_pollutants"})
+    )
+    return df_sum, df_avg
+
+
+if __name__ == "__main__":
+    # Benchmark the report writer against DataFrame.to_html,
+    # with the index_template.html fields of the refined report.
+    template = (
+        "<html><body>{images}<p>{from_time} - {to_time}</p>"
+        "{df_sum_parameters_html}{df_avg_value_parameters_html}"
+        "</body></html>"
+    )
+    for num_locations in [1000, 20000]:
+        df_sum, df_avg = _benchmark_tables(num_locations)
+
+        start = time.perf_counter()
+        page = template.format(
+            images="",
+            from_time="",
+            to_time="",
+            df_sum_parameters_html=df_sum.to_html(index=False),
+            df_avg_value_parameters_html=df_avg.to_html(index=False),
+        )
+        duration = time.perf_counter() - start
+        print(
+            f"{num_locations} locations, to_html: "
+            f"{duration:.3f} s, {len(page.encode()) / 1e6:.2f} MB"
+        )
+
+        configurations = [
+            ("table", REPORT_FORMAT_TABLE, None),
+            ("table, 500 rows", REPORT_FORMAT_TABLE, 500),
+            ("json", REPORT_FORMAT_JSON, None),
+        ]
+        for name, report_format, max_rows in configurations:
+            buffer = io.StringIO()
+            start = time.perf_counter()
+            write_html_report(
+                buffer,
+                template,
+                {
+                    "images": "",
+                    "from_time": "",
+                    "to_time": "",
+                    "df_sum_parameters_html": table_writer(
+                        df_sum,
+                        report_format,
+                        "sum_avg_pollutants",
+                        max_rows=max_rows,
+                    ),
+                    "df_avg_value_parameters_html": table_writer(
+                        df_avg,
+                        report_format,
+                        "avg_pollutants",
+                        max_rows=max_rows,
+                    ),
+                },
+            )
+            duration = time.perf_counter() - start
+            size = len(buffer.getvalue().encode())
+            print(
+                f"{num_locations} locations, {name}: "
+                f"{duration:.3f} s, {size / 1e6:.2f} MB"
+            )
@@ -8,7 +8,16 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import seaborn as sns
-from scipy import stats
+from modules.dist_stats.dist_stats import (
+    binned_kde,
+    histogram,
+    percentile_ranks,
+)
+from modules.render_cache.render_cache import (
+    get_figure,
+    get_pollutants_cmap,
+    release_figure,
+)
 
 # Set up logging
 logger = logging.getLogger()
@@ -34,9 +43,7 @@ def make_save_folium_map_html(
     None
     """
     m = folium.Map(location=[50.5, 4.5], zoom_start=8)
-    cmap = sns.cubehelix_palette(
-        start=2, rot=0, dark=0, light=0.95, reverse=False, as_cmap=True
-    )
+    cmap = get_pollutants_cmap()
     norm = plt.Normalize(
         df_sum_parameters["sum_avg_pollutants"].min(),
         df_sum_parameters["sum_avg_pollutants"].max(),
@@ -181,6 +188,7 @@ def make_save_cartopy_map_plot(
     plt.subplots_adjust(top=0.95, bottom=0.05)
     plt.tight_layout()
     plt.savefig(file_name)
+    plt.close(fig)
     logging.info("Cartopy Map plot created and saved to %s.", file_name)
 
 
@@ -234,22 +242,24 @@ def make_save_bar_plot(
     ]
 
     # Plot a stacked bar chart
-    df_pivot.plot(kind="bar", stacked=True)
-    plt.title(
+    fig, ax = get_figure("bar")
+    df_pivot.plot(kind="bar", stacked=True, ax=ax)
+    ax.set_title(
         (
             f"Top {top_bar} most polluted location in Belgium, "
             f"{num_measurements} ticks measured \n"
             f"between {from_time} and {to_time} UTC"
         )
     )
-    plt.xlabel("Location")
-    plt.xticks(rotation=80)
-    plt.ylabel(f"Sum of Average Pollutants [{MEASUREMENT_UNIT}]")
-    # plt.ylim([6, plt.ylim()[1]])
-    plt.legend(title="Pollutant", bbox_to_anchor=(1.05, 1), loc="upper left")
-    plt.tight_layout()
-    plt.grid(alpha=0.2)
-    plt.savefig(file_name, dpi=600)
+    ax.set_xlabel("Location")
+    ax.tick_params(axis="x", labelrotation=80)
+    ax.set_ylabel(f"Sum of Average Pollutants [{MEASUREMENT_UNIT}]")
+    # ax.set_ylim([6, ax.get_ylim()[1]])
+    ax.legend(title="Pollutant", bbox_to_anchor=(1.05, 1), loc="upper left")
+    fig.tight_layout()
+    ax.grid(alpha=0.2)
+    fig.savefig(file_name, dpi=600)
+    release_figure(fig)
     logging.info("Bar plot created and saved to %s.", file_name)
 
 
@@ -260,6 +270,7 @@ def make_save_dist_plot(
     df_sum_parameters: pd.DataFrame,
     top_dist: int = 10,
     file_name: str = "dist.png",
+    kde: bool = True,
 ) -> None:
     """
     Creates and saves a distribution plot of top pollutant locations.
@@ -274,6 +285,8 @@ def make_save_dist_plot(
       Defaults to 10.
     - file_name (str, optional): File name to save the plot.
       Defaults to "dist.png".
+    - kde (bool, optional): Whether to draw the density estimate.
+      Defaults to True.
 
     Returns:
     - None: The function saves the plot to a file.
@@ -285,31 +298,41 @@ def make_save_dist_plot(
     )
     top_cities = df_sum_parameters_sorted.head(top_dist)
 
-    # Calculate histogram
-    counts, bins = np.histogram(df_sum_parameters["sum_avg_pollutants"])
+    # Calculate histogram once, to draw and annotate it
+    values = df_sum_parameters["sum_avg_pollutants"].to_numpy(dtype=float)
+    counts, bins = histogram(values)
 
     # Plotting
-    plt.figure(figsize=(10, 6))
-    sns.histplot(
-        df_sum_parameters["sum_avg_pollutants"],
-        kde=True,
+    fig, ax = get_figure("dist", figsize=(10, 6))
+    ax.bar(
+        bins[:-1],
+        counts,
+        width=np.diff(bins),
+        align="edge",
         color="gray",
-        bins=bins,
+        alpha=0.75,
+        edgecolor="white",
     )
+    if kde and len(values) > 1:
+        # Density scaled to the counts of the histogram
+        grid, density = binned_kde(values)
+        ax.plot(grid, density * len(values) * np.diff(bins)[0], color="gray")
     sns.rugplot(
-        top_cities["sum_avg_pollutants"], height=1, color="blue", alpha=0.5
+        top_cities["sum_avg_pollutants"],
+        height=1,
+        color="blue",
+        alpha=0.5,
+        ax=ax,
     )
 
     # Annotate top 10 cities with shifted text and percentile
     start_offset = 0.5
     max_offset = max(counts)
+    percentiles = percentile_ranks(values, top_cities["sum_avg_pollutants"])
     for i in range(top_cities.shape[0]):
         offset = (i / (top_dist - 1)) * max_offset if top_dist > 1 else 0
-        percentile = stats.percentileofscore(
-            df_sum_parameters["sum_avg_pollutants"],
-            top_cities["sum_avg_pollutants"].iloc[i],
-        )
-        plt.text(
+        percentile = percentiles[i]
+        ax.text(
             top_cities["sum_avg_pollutants"].iloc[i],
             start_offset + offset,
             f"{top_cities['location'].iloc[i]} ({percentile:.1f}%)",
@@ -318,19 +341,20 @@ def make_save_dist_plot(
             fontsize=10,
         )
 
-    plt.title(
+    ax.set_title(
         (
             f"Distribution of Sum of Average Pollutants in Belgium, "
             f"{num_measurements} ticks measured\n"
             f"between {from_time} and {to_time} UTC"
         )
     )
-    plt.xlabel(f"Sum of Average Pollutants [{MEASUREMENT_UNIT}]")
-    plt.ylabel("Density")
+    ax.set_xlabel(f"Sum of Average Pollutants [{MEASUREMENT_UNIT}]")
+    ax.set_ylabel("Density")
 
     # Set y limit to max count
-    plt.ylim(0, max(counts) + 10)
-    plt.tight_layout()
-    plt.grid(alpha=0.2)
-    plt.savefig(file_name, dpi=600)
+    ax.set_ylim(0, max(counts) + 10)
+    fig.tight_layout()
+    ax.grid(alpha=0.2)
+    fig.savefig(file_name, dpi=600)
+    release_figure(fig)
     logging.info("Distribution plot created and saved to %s.", file_name)
@@ -0,0 +1,99 @@
+import logging
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Tuple
+
+import seaborn as sns
+from matplotlib.axes import Axes
+from matplotlib.colors import Colormap
+from matplotlib.figure import Figure
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+MAX_CACHED_FIGURES = 4
+MAX_CACHED_TEMPLATES = 4
+
+# Figures kept across warm invocations, by name.
+# Figures are created outside of pyplot, so pyplot never holds on to them.
+_figures: "OrderedDict[str, Figure]" = OrderedDict()
+
+
+@lru_cache(maxsize=1)
+def get_pollutants_cmap() -> Colormap:
+    """
+    Get the colormap of the sum of average pollutants, built once.
+
+    Returns:
+    Colormap: The cubehelix colormap
+    """
+    return sns.cubehelix_palette(
+        start=2, rot=0, dark=0, light=0.95, reverse=False, as_cmap=True
+    )
+
+
+@lru_cache(maxsize=MAX_CACHED_TEMPLATES)
+def load_template(file_name: str) -> str:
+    """
+    Load an HTML template, read once per file.
+
+    Parameters:
+    file_name (str): The template file
+
+    Returns:
+    str: The template
+    """
+    with open(file_name, "r") as f:
+        return f.read()
+
+
+def get_figure(
+    name: str, figsize: Tuple[float, float] = (6.4, 4.8)
+) -> Tuple[Figure, Axes]:
+    """
+    Get a cleared figure with a single axes, reused across invocations.
+    The least recently used figure is released when the cache is full.
+
+    Parameters:
+    name (str): The name of the figure, e.g. "bar"
+    figsize (Tuple[float, float]): The figure size in inches
+
+    Returns:
+    Tuple[Figure, Axes]: The figure and its axes
+    """
+    fig = _figures.pop(name, None)
+    if fig is None:
+        fig = Figure(figsize=figsize)
+    else:
+        fig.clear()
+        fig.set_size_inches(figsize)
+    _figures[name] = fig
+
+    while len(_figures) > MAX_CACHED_FIGURES:
+        _, evicted = _figures.popitem(last=False)
+        evicted.clear()
+
+    return fig, fig.add_subplot()
+
+
+def release_figure(fig: Figure) -> None:
+    """
+    Release the artists and data drawn on a figure once it is saved,
+    keeping the figure itself for the next invocation.
+
+    Parameters:
+    fig (Figure): The figure
+    """
+    fig.clear()
+
+
+def clear_render_cache() -> None:
+    """
+    Release all cached figures, colormaps and templates.
+    """
+    while _figures:
+        _, fig = _figures.popitem()
+        fig.clear()
+    get_pollutants_cmap.cache_clear()
+    load_template.cache_clear()
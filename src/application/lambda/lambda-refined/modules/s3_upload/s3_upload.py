@@ -1,8 +1,14 @@
 import logging
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
-import boto3
 import pandas as pd
+from modules.html_report.html_report import (
+    REPORT_FORMAT_TABLE,
+    table_writer,
+    write_html_report,
+)
+from modules.render_cache.render_cache import load_template
+from modules.storage.storage import object_store
 
 # Set up logging
 logger = logging.getLogger()
@@ -22,6 +28,9 @@ def upload_files_to_s3(
     local_map_html_file: str,
     s3_map_html_file: str,
     png_files: List[Tuple[str, str]],
+    report_format: str = REPORT_FORMAT_TABLE,
+    report_max_rows: Optional[int] = None,
+    report_page_size: int = 50,
 ) -> None:
     """
     Uploads dataframes and images to an S3 bucket.
@@ -43,17 +52,34 @@ def upload_files_to_s3(
     - s3_map_html_file (str): Name of the map HTML file to save to S3.
     - png_files (List[Tuple[str, str]]): List of tuples
       where each tuple contains the local and s3 file names for each PNG file.
+    - report_format (str, optional): Format of the data HTML tables,
+      "table" for HTML rows or "json" for a paginated JSON data island.
+    - report_max_rows (int, optional): Maximum number of rows per table,
+      the most polluted rows first.
+    - report_page_size (int, optional): Number of rows per page
+      of the "json" format.
 
     Returns:
     - None
     """
-    # Convert the DataFrames to HTML
-    df_sum_parameters_html = df_sum_parameters.to_html(index=False)
-    df_avg_value_parameters_html = df_avg_value_parameters.to_html(index=False)
+    # Create the data HTML tables, written row by row with the report
+    df_sum_parameters_html = table_writer(
+        df_sum_parameters,
+        report_format,
+        sort_by="sum_avg_pollutants",
+        max_rows=report_max_rows,
+        page_size=report_page_size,
+    )
+    df_avg_value_parameters_html = table_writer(
+        df_avg_value_parameters,
+        report_format,
+        sort_by="avg_pollutants",
+        max_rows=report_max_rows,
+        page_size=report_page_size,
+    )
 
-    # Create the data HTML string
-    with open(local_data_html_file_template, "r") as f:
-        html_template = f.read()
+    # Create the data HTML report
+    html_template = load_template(local_data_html_file_template)
 
     images_html = "".join(
         [
@@ -65,40 +91,32 @@ def upload_files_to_s3(
         ]
     )
 
-    html_string = html_template.format(
-        images=images_html,
-        from_time=from_time,
-        to_time=to_time,
-        df_sum_parameters_html=df_sum_parameters_html.replace(
-            "table ", "table table-striped"
-        ),
-        df_avg_value_parameters_html=df_avg_value_parameters_html.replace(
-            "table ", "table table-striped"
-        ),
-    )
-
-    # Write the HTML string to a file
-    with open(local_data_html_file, "w") as f:
-        f.write(html_string)
+    # Write the HTML report to a file
+    with open(local_data_html_file, "w", encoding="utf-8") as f:
+        write_html_report(
+            f,
+            html_template,
+            {
+                "images": images_html,
+                "from_time": from_time,
+                "to_time": to_time,
+                "df_sum_parameters_html": df_sum_parameters_html,
+                "df_avg_value_parameters_html": df_avg_value_parameters_html,
+            },
+        )
 
     # Upload the plots and HTML file to S3
-    s3_client = boto3.client("s3")
+    objects = object_store(s3_bucket_name, region_name=region_name)
     for local_file, s3_file in png_files:
-        s3_client.upload_file(
+        objects.upload_file(
             local_file,
-            s3_bucket_name,
             s3_file,
-            ExtraArgs={
-                "ContentType": "image/png",
-                "CacheControl": "max-age=60",
-            },
+            content_type="image/png",
+            cache_control="max-age=60",
         )
         logging.info(f"local file {local_file} uploaded to S3: {s3_file}")
-    s3_client.upload_file(
-        local_data_html_file,
-        s3_bucket_name,
-        s3_data_html_file,
-        ExtraArgs={"ContentType": "text/html"},
+    objects.upload_file(
+        local_data_html_file, s3_data_html_file, content_type="text/html"
     )
     logging.info(
         (
@@ -106,11 +124,8 @@ def upload_files_to_s3(
             f"uploaded to S3: {s3_data_html_file}"
         )
     )
-    s3_client.upload_file(
-        local_map_html_file,
-        s3_bucket_name,
-        s3_map_html_file,
-        ExtraArgs={"ContentType": "text/html"},
+    objects.upload_file(
+        local_map_html_file, s3_map_html_file, content_type="text/html"
     )
     logging.info(
         f"local file {local_map_html_file} uploaded to S3: {s3_map_html_file}"
@@ -0,0 +1,470 @@
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from modules.geohash.geohash import (
+    CELL_PRECISION,
+    cells_in_bbox,
+    decode_bbox,
+    encode_array,
+    radius_bbox,
+)
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+EARTH_RADIUS_KM = 6371.0
+# Radius of the neighbourhood of each cell of the regional rollup
+NEIGHBOURHOOD_RADIUS_KM = 25.0
+
+
+class SpatialIndex:
+    """
+    Grid index of stations by geohash cell.
+    Stations are sorted by cell once, a query then only checks
+    the stations of the cells covering the queried area.
+    """
+
+    __slots__ = (
+        "stations",
+        "df",
+        "precision",
+        "latitudes",
+        "longitudes",
+        "_cells",
+    )
+
+    def __init__(
+        self, df: pd.DataFrame, precision: int = CELL_PRECISION
+    ) -> None:
+        """
+        Index stations by cell, stations without coordinates are left out.
+        The cells stored in the station table are used when they have
+        the precision of the index, the others are encoded.
+
+        Parameters:
+        df (pd.DataFrame): The stations, with latitude and longitude,
+        and the cell of the station table if any
+        precision (int, optional): The number of characters of the cells
+        """
+        latitudes, longitudes = coordinates(df)
+        cells = np.full(len(df), None, dtype=object)
+        if "cell" in df.columns:
+            cells[:] = df["cell"].to_numpy(object)
+            stored = pd.notna(cells) & (
+                df["cell"].str.len().to_numpy() == precision
+            )
+            cells[~stored] = None
+        located = ~(np.isnan(latitudes) | np.isnan(longitudes))
+        missing = located & pd.isna(cells)
+        if missing.any():
+            cells[missing] = encode_array(
+                latitudes[missing], longitudes[missing], precision
+            )
+        cells = cells[located].astype(str)
+        order = np.argsort(cells, kind="stable")
+
+        self.stations = df
+        self.df = df[located].iloc[order].reset_index(drop=True)
+        self.precision = precision
+        self.latitudes = latitudes[located][order]
+        self.longitudes = longitudes[located][order]
+        cells = cells[order]
+        unique_cells, starts = np.unique(cells, return_index=True)
+        ends = np.append(starts[1:], len(cells))
+        self._cells: Dict[str, Tuple[int, int]] = {
+            cell: (start, end)
+            for cell, start, end in zip(unique_cells, starts, ends)
+        }
+
+    def cells(self) -> List[str]:
+        """
+        Get the cells of the indexed stations.
+
+        Returns:
+        List[str]: The cells
+        """
+        return list(self._cells)
+
+    def _candidates(self, cells: Iterable[str]) -> np.ndarray:
+        """
+        Get the positions of the stations of cells.
+        """
+        slices = [self._cells[cell] for cell in cells if cell in self._cells]
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(start, end) for start, end in slices])
+
+    def _covering_cells(
+        self, min_lat: float, min_lon: float, max_lat: float, max_lon: float
+    ) -> List[str]:
+        """
+        Get the indexed cells overlapping a bounding box.
+        """
+        try:
+            return cells_in_bbox(
+                min_lat, min_lon, max_lat, max_lon, self.precision
+            )
+        except ValueError:
+            # Large boxes, check the bounding box of the indexed cells
+            return [
+                cell
+                for cell in self._cells
+                if _overlaps(
+                    decode_bbox(cell), (min_lat, min_lon, max_lat, max_lon)
+                )
+            ]
+
+    def bbox_positions(
+        self, min_lat: float, min_lon: float, max_lat: float, max_lon: float
+    ) -> np.ndarray:
+        """
+        Get the positions in the index of the stations within
+        a bounding box.
+
+        Parameters:
+        min_lat (float): The minimum latitude
+        min_lon (float): The minimum longitude
+        max_lat (float): The maximum latitude
+        max_lon (float): The maximum longitude
+
+        Returns:
+        np.ndarray: The positions of the stations in the index df
+        """
+        candidates = self._candidates(
+            self._covering_cells(min_lat, min_lon, max_lat, max_lon)
+        )
+        latitudes = self.latitudes[candidates]
+        longitudes = self.longitudes[candidates]
+        within = (
+            (latitudes >= min_lat)
+            & (latitudes <= max_lat)
+            & (longitudes >= min_lon)
+            & (longitudes <= max_lon)
+        )
+        return candidates[within]
+
+    def radius_positions(
+        self, latitude: float, longitude: float, radius_km: float
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the positions in the index of the stations within a radius.
+
+        Parameters:
+        latitude (float): The latitude of the center
+        longitude (float): The longitude of the center
+        radius_km (float): The radius in kilometers
+
+        Returns:
+        Tuple[np.ndarray, np.ndarray]: The positions of the stations
+        in the index df, and their distances in kilometers
+        """
+        candidates = self.bbox_positions(
+            *radius_bbox(latitude, longitude, radius_km)
+        )
+        distances = haversine_km(
+            latitude,
+            longitude,
+            self.latitudes[candidates],
+            self.longitudes[candidates],
+        )
+        within = distances <= radius_km
+        return candidates[within], distances[within]
+
+    def within_bbox(
+        self, min_lat: float, min_lon: float, max_lat: float, max_lon: float
+    ) -> pd.DataFrame:
+        """
+        Get the stations within a bounding box.
+
+        Parameters:
+        min_lat (float): The minimum latitude
+        min_lon (float): The minimum longitude
+        max_lat (float): The maximum latitude
+        max_lon (float): The maximum longitude
+
+        Returns:
+        pd.DataFrame: The stations within the bounding box
+        """
+        return self.df.iloc[
+            self.bbox_positions(min_lat, min_lon, max_lat, max_lon)
+        ]
+
+    def within_radius(
+        self, latitude: float, longitude: float, radius_km: float
+    ) -> pd.DataFrame:
+        """
+        Get the stations within a radius, nearest first.
+
+        Parameters:
+        latitude (float): The latitude of the center
+        longitude (float): The longitude of the center
+        radius_km (float): The radius in kilometers
+
+        Returns:
+        pd.DataFrame: The stations within the radius,
+        with their distance_km to the center
+        """
+        positions, distances = self.radius_positions(
+            latitude, longitude, radius_km
+        )
+        return (
+            self.df.iloc[positions]
+            .assign(distance_km=distances)
+            .sort_values("distance_km")
+        )
+
+
+# Index of the latest stations, kept across warm invocations
+_station_index: Optional[SpatialIndex] = None
+
+
+def station_index(df_stations: pd.DataFrame) -> SpatialIndex:
+    """
+    Get the index of the stations, built again only when the stations
+    change, e.g. when the station cache reads new or changed stations.
+
+    Parameters:
+    df_stations (pd.DataFrame): The stations, one row per location
+
+    Returns:
+    SpatialIndex: The index of the stations
+    """
+    global _station_index
+    if _station_index is None or _station_index.stations is not df_stations:
+        _station_index = SpatialIndex(df_stations)
+        logging.info(
+            f"Indexed {len(_station_index.df)} stations "
+            f"in {len(_station_index.cells())} cells."
+        )
+    return _station_index
+
+
+def coordinates(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the latitudes and longitudes of stations as floats,
+    NaN for missing coordinates.
+
+    Parameters:
+    df (pd.DataFrame): The stations, with latitude and longitude
+
+    Returns:
+    Tuple[np.ndarray, np.ndarray]: The latitudes and longitudes
+    """
+    return (
+        pd.to_numeric(df["latitude"], errors="coerce").to_numpy(float),
+        pd.to_numeric(df["longitude"], errors="coerce").to_numpy(float),
+    )
+
+
+def _overlaps(
+    bbox: Tuple[float, float, float, float],
+    other: Tuple[float, float, float, float],
+) -> bool:
+    """
+    Check whether two bounding boxes overlap.
+    """
+    return (
+        bbox[0] <= other[2]
+        and other[0] <= bbox[2]
+        and bbox[1] <= other[3]
+        and other[1] <= bbox[3]
+    )
+
+
+def haversine_km(latitude: float, longitude: float, latitudes, longitudes):
+    """
+    Get the great-circle distances from a point to many points.
+
+    Parameters:
+    latitude (float): The latitude of the point
+    longitude (float): The longitude of the point
+    latitudes (np.ndarray): The latitudes of the points
+    longitudes (np.ndarray): The longitudes of the points
+
+    Returns:
+    np.ndarray: The distances in kilometers
+    """
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def aggregate_cells(
+    df_sum_parameters: pd.DataFrame,
+    precision: int = CELL_PRECISION,
+    index: Optional[SpatialIndex] = None,
+    radius_km: float = NEIGHBOURHOOD_RADIUS_KM,
+) -> pd.DataFrame:
+    """
+    Calculate the regional rollup of the sum of average pollutants
+    of the locations, for each grid cell.
+    With an index of the stations, also roll up the locations within
+    a radius of the center of each cell, across the cell borders.
+
+    Parameters:
+    df_sum_parameters (pd.DataFrame): The sum of average pollutants
+    for each location
+    precision (int, optional): The number of characters of the cells
+    index (SpatialIndex, optional): The index of the stations
+    radius_km (float, optional): The radius of the neighbourhoods
+
+    Returns:
+    pd.DataFrame: The cell, the center latitude and longitude of the cell,
+    the number of locations, the mean and max of the sum of average
+    pollutants and the number of measurements of each cell, and with an
+    index the number of locations and the mean of the sum of average
+    pollutants within the radius
+    """
+    df = df_sum_parameters.assign(
+        cell=encode_array(*coordinates(df_sum_parameters), precision),
+        sum_avg_pollutants=df_sum_parameters["sum_avg_pollutants"].astype(
+            float
+        ),
+    )
+    df_cells = (
+        df.dropna(subset=["cell"])
+        .groupby("cell")
+        .agg(
+            num_locations=("location", "count"),
+            mean_sum_avg_pollutants=("sum_avg_pollutants", "mean"),
+            max_sum_avg_pollutants=("sum_avg_pollutants", "max"),
+            num_measurements=("num_measurements", "sum"),
+        )
+        .reset_index()
+    )
+
+    # Centers of the cells, e.g. for map tiles
+    bboxes = np.array([decode_bbox(cell) for cell in df_cells["cell"]])
+    if len(bboxes):
+        df_cells.insert(1, "latitude", (bboxes[:, 0] + bboxes[:, 2]) / 2)
+        df_cells.insert(2, "longitude", (bboxes[:, 1] + bboxes[:, 3]) / 2)
+    else:
+        df_cells.insert(1, "latitude", [])
+        df_cells.insert(2, "longitude", [])
+
+    if index is not None:
+        df_cells = add_neighbourhoods(df_cells, df, index, radius_km)
+    return df_cells
+
+
+def add_neighbourhoods(
+    df_cells: pd.DataFrame,
+    df_sum_parameters: pd.DataFrame,
+    index: SpatialIndex,
+    radius_km: float,
+) -> pd.DataFrame:
+    """
+    Roll up the locations within a radius of the center of each cell,
+    found with the index instead of a distance to every location.
+
+    Parameters:
+    df_cells (pd.DataFrame): The rollup of each cell, with its center
+    df_sum_parameters (pd.DataFrame): The sum of average pollutants
+    for each location
+    index (SpatialIndex): The index of the stations
+    radius_km (float): The radius of the neighbourhoods
+
+    Returns:
+    pd.DataFrame: The rollup with the num_locations_nearby and
+    mean_sum_avg_pollutants_nearby of each cell
+    """
+    # Sums in the order of the index, NaN for stations without a sum
+    sums = (
+        df_sum_parameters.drop_duplicates("location")
+        .set_index("location")["sum_avg_pollutants"]
+        .reindex(index.df["location"])
+        .to_numpy(float)
+    )
+    num_nearby = np.zeros(len(df_cells), dtype=np.int64)
+    mean_nearby = np.full(len(df_cells), np.nan)
+    for row, (latitude, longitude) in enumerate(
+        zip(df_cells["latitude"], df_cells["longitude"])
+    ):
+        positions, _ = index.radius_positions(latitude, longitude, radius_km)
+        nearby = sums[positions]
+        nearby = nearby[~np.isnan(nearby)]
+        num_nearby[row] = len(nearby)
+        if len(nearby):
+            mean_nearby[row] = nearby.mean()
+    return df_cells.assign(
+        num_locations_nearby=num_nearby,
+        mean_sum_avg_pollutants_nearby=mean_nearby,
+    )
+
+
+if __name__ == "__main__":
+    # Benchmark the index against filtering every station,
+    # and the regional rollup of many locations
+    import time
+
+    num_stations = 100000
+    df = pd.DataFrame(
+        {
+            "location": [f"Station {i}" for i in range(num_stations)],
+            "latitude": np.random.uniform(49.5, 51.5, num_stations),
+            "longitude": np.random.uniform(2.5, 6.5, num_stations),
+            "sum_avg_pollutants": np.random.uniform(0, 100, num_stations),
+            "num_measurements": np.random.randint(1, 10, num_stations),
+        }
+    )
+    # The cells as stored in the station table
+    df["cell"] = encode_array(df["latitude"], df["longitude"], CELL_PRECISION)
+
+    start = time.perf_counter()
+    index = station_index(df)
+    print(
+        f"index of {num_stations} stations: "
+        f"{time.perf_counter() - start:.3f} s, {len(index.cells())} cells"
+    )
+    assert station_index(df) is index
+
+    start = time.perf_counter()
+    for _ in range(100):
+        stations = index.within_radius(50.85, 4.35, 10)
+    print(f"100 radius queries, index: {time.perf_counter() - start:.3f} s")
+
+    start = time.perf_counter()
+    for _ in range(100):
+        distances = haversine_km(50.85, 4.35, *coordinates(df))
+        expected = df[distances <= 10]
+    print(f"100 radius queries, scan: {time.perf_counter() - start:.3f} s")
+    assert set(stations["location"]) == set(expected["location"])
+
+    bbox = (50.5, 4.0, 51.0, 5.0)
+    latitudes, longitudes = coordinates(df)
+    expected = df[
+        (latitudes >= bbox[0])
+        & (latitudes <= bbox[2])
+        & (longitudes >= bbox[1])
+        & (longitudes <= bbox[3])
+    ]
+    assert set(index.within_bbox(*bbox)["location"]) == set(
+        expected["location"]
+    )
+
+    start = time.perf_counter()
+    df_cells = aggregate_cells(df, index=index)
+    print(
+        f"rollup of {num_stations} locations: "
+        f"{time.perf_counter() - start:.3f} s, {len(df_cells)} cells"
+    )
+    assert df_cells["num_locations"].sum() == num_stations
+
+    # Neighbourhood of the first cell, against every location
+    cell = df_cells.iloc[0]
+    distances = haversine_km(
+        cell["latitude"], cell["longitude"], *coordinates(df)
+    )
+    nearby = df[distances <= NEIGHBOURHOOD_RADIUS_KM]
+    assert cell["num_locations_nearby"] == len(nearby)
+    assert np.isclose(
+        cell["mean_sum_avg_pollutants_nearby"],
+        nearby["sum_avg_pollutants"].mean(),
+    )
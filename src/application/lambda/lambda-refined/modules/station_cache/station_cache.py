@@ -0,0 +1,170 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Optional
+
+import pandas as pd
+from modules.storage.storage import ItemTable, item_table
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+STATION_KEY_ATTRIBUTES = ("location",)
+STATION_COLUMNS = [
+    "location",
+    "city",
+    "country",
+    "latitude",
+    "longitude",
+    "geohash",
+    "cell",
+]
+UPDATED_ATTRIBUTE = "updatedAt"
+# Stations by upsert time, in one partition, see the station registry
+# of lambda-clean
+UPDATED_INDEX_NAME = "updated-index"
+UPDATED_PARTITION_ATTRIBUTE = "updatedPartition"
+UPDATED_PARTITION = "stations"
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+# Upserts committed late, or by writers with skewed clocks, are read again
+REFRESH_MARGIN = timedelta(minutes=5)
+
+
+class StationCache:
+    """
+    In-memory copy of the station table, kept for the lifetime of the
+    execution environment. The first refresh scans the whole table.
+    The next refreshes only read the stations upserted after the latest
+    upsert already seen, minus a margin, with a query of the
+    updated-index instead of a scan.
+    """
+
+    def __init__(self, table: ItemTable) -> None:
+        self.table = table
+        self.stations: Dict[str, dict] = {}
+        self.watermark = ""
+        self.frame: Optional[pd.DataFrame] = None
+        self.lock = threading.Lock()
+
+    def refresh(self) -> pd.DataFrame:
+        """
+        Read the new and changed stations, and get all stations.
+
+        Returns:
+        pd.DataFrame: The stations, one row per location
+        """
+        with self.lock:
+            after = ""
+            if self.watermark:
+                after = datetime.strptime(self.watermark, DATE_FORMAT)
+                after = (after - REFRESH_MARGIN).strftime(DATE_FORMAT)
+                items = self.table.query_after(
+                    UPDATED_INDEX_NAME,
+                    UPDATED_PARTITION_ATTRIBUTE,
+                    UPDATED_PARTITION,
+                    UPDATED_ATTRIBUTE,
+                    after,
+                )
+            else:
+                # Also the stations written before the updated-index
+                items = self.table.scan_after(UPDATED_ATTRIBUTE, after)
+            changed = False
+            for item in items:
+                changed |= self.stations.get(item["location"]) != item
+                self.stations[item["location"]] = item
+                self.watermark = max(self.watermark, item[UPDATED_ATTRIBUTE])
+            logging.info(
+                f"Read {len(items)} stations upserted after "
+                f"{after or 'the start'}, "
+                f"{len(self.stations)} stations cached."
+            )
+            if changed or self.frame is None:
+                self.frame = pd.DataFrame(
+                    [
+                        {name: item.get(name) for name in STATION_COLUMNS}
+                        for item in self.stations.values()
+                    ],
+                    columns=STATION_COLUMNS,
+                )
+                self.frame[["latitude", "longitude"]] = self.frame[
+                    ["latitude", "longitude"]
+                ].apply(pd.to_numeric)
+            return self.frame
+
+
+def join_stations(
+    df: pd.DataFrame,
+    df_stations: pd.DataFrame,
+    columns: tuple = ("longitude", "latitude"),
+) -> pd.DataFrame:
+    """
+    Add the station metadata to rows by location,
+    NaN for the locations missing in the station table.
+
+    Parameters:
+    df (pd.DataFrame): The rows, with a location column
+    df_stations (pd.DataFrame): The stations, one row per location
+    columns (tuple, optional): The station columns to add
+
+    Returns:
+    pd.DataFrame: The rows with the station columns
+    """
+    return df.merge(
+        df_stations[["location", *columns]], on="location", how="left"
+    )
+
+
+def stations_with_items(
+    df_stations: pd.DataFrame, df: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Add the stations of measurement items written with their station
+    metadata, before the station table, that are not in the station table.
+
+    Parameters:
+    df_stations (pd.DataFrame): The stations of the station table
+    df (pd.DataFrame): The measurement items
+
+    Returns:
+    pd.DataFrame: The stations, one row per location
+    """
+    if "latitude" not in df.columns:
+        return df_stations
+    df_item_stations = (
+        df.dropna(subset=["latitude", "longitude"])
+        .drop_duplicates("location", keep="last")
+        .reindex(columns=STATION_COLUMNS)
+    )
+    df_item_stations = df_item_stations[
+        ~df_item_stations["location"].isin(df_stations["location"])
+    ]
+    if len(df_item_stations) == 0:
+        return df_stations
+    df_item_stations[["latitude", "longitude"]] = df_item_stations[
+        ["latitude", "longitude"]
+    ].apply(pd.to_numeric)
+    return pd.concat([df_stations, df_item_stations], ignore_index=True)
+
+
+@lru_cache(maxsize=None)
+def station_cache(
+    table_name: str, region_name: Optional[str] = None
+) -> StationCache:
+    """
+    Get the cache of a station table, shared by the invocations
+    of an execution environment.
+
+    Parameters:
+    table_name (str): The name of the station table
+    region_name (str, optional): The AWS region of the table
+
+    Returns:
+    StationCache: The station cache
+    """
+    return StationCache(
+        item_table(
+            table_name, region_name, key_attributes=STATION_KEY_ATTRIBUTES
+        )
+    )
@@ -0,0 +1,348 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import pandas as pd
+from modules.data_artifacts.data_artifacts import to_numeric
+from modules.dynamodb_query.dynamodb_query import (
+    DATE_ATTRIBUTE,
+    DATE_FORMAT_QUERY,
+    INGESTED_ATTRIBUTE,
+    query_dynamodb_ingested_after,
+    query_dynamodb_last_hours,
+)
+from modules.storage.storage import KEY_ATTRIBUTES
+
+# pyarrow spills the cached items to /tmp as Parquet.
+# The items are only kept in memory if it is not installed.
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+SPILL_FILE = "/tmp/window_cache.parquet"
+SPILL_METADATA_KEY = b"window_cache"
+MAX_MEMORY_BYTES = 64 * 1024 * 1024  # Larger windows are spilled
+# Items are queried again from the watermark minus a margin, for late
+# index propagation and skewed clocks of the clean Lambda functions.
+# The clean Lambda functions stamp the ingestion time of the items right
+# before each write, not before their wait for write capacity, so the
+# margin does not depend on the clean timeout.
+INGESTION_MARGIN = timedelta(minutes=5)
+# The window is fully fetched at least once per interval
+FULL_FETCH_INTERVAL = timedelta(hours=1)
+
+
+class WindowCache:
+    """
+    Items of the last queried window, with the high-watermark of their
+    ingestion times. Kept in memory across warm invocations, or spilled
+    to /tmp as a Parquet file if they exceed the memory budget.
+    Each query only reads the items ingested after the watermark,
+    and evicts the items that left the window.
+    """
+
+    def __init__(
+        self,
+        spill_file: str = SPILL_FILE,
+        max_memory_bytes: int = MAX_MEMORY_BYTES,
+    ) -> None:
+        self.spill_file = spill_file
+        self.max_memory_bytes = max_memory_bytes
+        self.df: Optional[pd.DataFrame] = None
+        self.state: Optional[dict] = None
+
+    def query(
+        self,
+        dynamodb_table_name: str,
+        hours: int,
+        region_name: str,
+        now: datetime,
+    ) -> pd.DataFrame:
+        """
+        Get the items of the last hours, numbers as floats.
+
+        Parameters:
+        dynamodb_table_name (str): The name of the DynamoDB table
+        hours (int): The number of hours to look back
+        region_name (str): The AWS region name
+        now (datetime): The end of the window
+
+        Returns:
+        pd.DataFrame: The items of the window
+        """
+        window_start = (now - timedelta(hours=hours)).strftime(
+            DATE_FORMAT_QUERY
+        )
+        df, state = self._load()
+        reason = full_fetch_reason(df, state, dynamodb_table_name, now)
+        if reason is None and window_start < state["window_start"]:
+            reason = "window extended"
+
+        if reason is None:
+            try:
+                df, state = self._fetch_new(
+                    df, state, dynamodb_table_name, region_name, now
+                )
+            except Exception as e:
+                reason = f"incremental query failed: {e}"
+
+        if reason is not None:
+            logging.info(f"Fetching the full window, {reason}.")
+            _, _, items = query_dynamodb_last_hours(
+                dynamodb_table_name, hours, region_name, now=now
+            )
+            df = to_numeric(pd.DataFrame(items))
+            state = {
+                "table_name": dynamodb_table_name,
+                "full_fetch_time": now.isoformat(),
+            }
+
+        # Evict the items that left the window, from its start
+        if len(df):
+            df = df[df[DATE_ATTRIBUTE] > window_start].reset_index(drop=True)
+        state["window_start"] = window_start
+        state["watermark"] = (
+            max(df[INGESTED_ATTRIBUTE].max(), state.get("watermark") or "")
+            if INGESTED_ATTRIBUTE in df.columns and len(df)
+            else state.get("watermark")
+        )
+        self._save(df, state)
+        return df
+
+    def _fetch_new(
+        self,
+        df: pd.DataFrame,
+        state: dict,
+        dynamodb_table_name: str,
+        region_name: str,
+        now: datetime,
+    ) -> Tuple[pd.DataFrame, dict]:
+        """
+        Merge the items ingested after the watermark, minus the margin,
+        into the cached items. Rewritten items replace the cached ones.
+        """
+        watermark = datetime.strptime(state["watermark"], DATE_FORMAT_QUERY)
+        items = query_dynamodb_ingested_after(
+            dynamodb_table_name,
+            watermark - INGESTION_MARGIN,
+            region_name,
+            now=now,
+        )
+        if items:
+            df = pd.concat(
+                [df, to_numeric(pd.DataFrame(items))], ignore_index=True
+            )
+            df = df.drop_duplicates(list(KEY_ATTRIBUTES), keep="last")
+        logging.info(
+            f"Window cache: {len(items)} items ingested after "
+            f"{state['watermark']}, minus {INGESTION_MARGIN}."
+        )
+        return df, dict(state)
+
+    def _load(self) -> Tuple[Optional[pd.DataFrame], Optional[dict]]:
+        """
+        Get the cached items and state, from memory or the spill file.
+        """
+        if self.state is not None and self.df is not None:
+            return self.df, self.state
+        if self.state is None or pyarrow is None:
+            return None, None
+        try:
+            table = pq.read_table(self.spill_file)
+            spilled_state = json.loads(
+                table.schema.metadata[SPILL_METADATA_KEY]
+            )
+        except (OSError, KeyError, ValueError, pyarrow.ArrowException) as e:
+            logging.info(f"Window cache spill file not read: {e}")
+            return None, None
+        if spilled_state != self.state:
+            logging.info("Window cache spill file is out of date.")
+            return None, None
+        return table.to_pandas(), spilled_state
+
+    def _save(self, df: pd.DataFrame, state: dict) -> None:
+        """
+        Keep the items and state in memory, or spill the items
+        to the spill file if they exceed the memory budget.
+        """
+        self.state = state
+        self.df = df
+        if pyarrow is None or (
+            df.memory_usage(deep=True).sum() <= self.max_memory_bytes
+        ):
+            return
+        try:
+            table = pyarrow.Table.from_pandas(df, preserve_index=False)
+            table = table.replace_schema_metadata(
+                {
+                    **(table.schema.metadata or {}),
+                    SPILL_METADATA_KEY: json.dumps(state).encode(),
+                }
+            )
+            tmp_file = f"{self.spill_file}.tmp"
+            pq.write_table(table, tmp_file, compression="zstd")
+            os.replace(tmp_file, self.spill_file)
+            self.df = None
+        except (OSError, pyarrow.ArrowException) as e:
+            # Keep the items in memory
+            logging.info(f"Window cache not spilled: {e}")
+
+
+def full_fetch_reason(
+    df: Optional[pd.DataFrame],
+    state: Optional[dict],
+    dynamodb_table_name: str,
+    now: datetime,
+) -> Optional[str]:
+    """
+    Check whether the cached items can be updated incrementally.
+
+    Parameters:
+    df (pd.DataFrame, optional): The cached items
+    state (dict, optional): The state of the cached items
+    dynamodb_table_name (str): The name of the DynamoDB table
+    now (datetime): The end of the window
+
+    Returns:
+    str | None: Why the window must be fully fetched, None if not
+    """
+    if df is None or state is None:
+        return "cold start"
+    if state["table_name"] != dynamodb_table_name:
+        return "table changed"
+    if not state.get("watermark"):
+        return "no items ingested yet"
+    full_fetch_time = datetime.fromisoformat(state["full_fetch_time"])
+    if now - full_fetch_time >= FULL_FETCH_INTERVAL or now < full_fetch_time:
+        return f"last full fetch at {state['full_fetch_time']}"
+    # The items must match their state, e.g. not a partially read spill
+    if len(df) and (
+        df[INGESTED_ATTRIBUTE].max() > state["watermark"]
+        or df[DATE_ATTRIBUTE].min() <= state["window_start"]
+    ):
+        return "inconsistent cache"
+    return None
+
+
+@lru_cache(maxsize=1)
+def window_cache() -> WindowCache:
+    """
+    Get the window cache, shared by the invocations
+    of an execution environment.
+
+    Returns:
+    WindowCache: The window cache
+    """
+    return WindowCache()
+
+
+def _benchmark_items(
+    num_stations: int, ingested_at: datetime, num_parameters: int = 4
+) -> list:
+    """
+    Create the items of one clean run, one measurement per station
+    and parameter, 10 minutes before their ingestion.
+    """
+    from decimal import Decimal
+
+    last_updated = (ingested_at - timedelta(minutes=10)).strftime(
+        "%Y-%m-%dT%H:%M:%S+00:00"
+    )
+    ingested = ingested_at.strftime(DATE_FORMAT_QUERY)
+    return [
+        {
+            "location": f"Station {station}",
+            "parameter": f"p{parameter}",
+            # One parameter per station and time, as the table key
+            "lastUpdated": last_updated.replace(":00+", f":{parameter:02d}+"),
+            "value": Decimal(str(round(station * 0.7 + parameter, 2))),
+            "expireAt": Decimal(int(ingested_at.timestamp()) + 172800),
+            "ingestedAt": ingested,
+            "ingestedHour": ingested[:13],
+        }
+        for station in range(num_stations)
+        for parameter in range(num_parameters)
+    ]
+
+
+if __name__ == "__main__":
+    # Benchmark the cached window against full fetches, every 10 minutes,
+    # on an in-memory table holding the 48 hours of the TTL.
+    # A DynamoDB scan reads the whole table, a query the items it returns.
+    from modules.storage.storage import MemoryTable, item_table
+
+    read_items = []
+    scan_after, query_after = MemoryTable.scan_after, MemoryTable.query_after
+
+    def counted_scan_after(self, *args):
+        read_items.append(len(self.items))
+        return scan_after(self, *args)
+
+    def counted_query_after(self, *args):
+        # Not counting the scan of the in-memory query
+        num_reads = len(read_items)
+        items = query_after(self, *args)
+        del read_items[num_reads:]
+        read_items.append(len(items))
+        return items
+
+    MemoryTable.scan_after = counted_scan_after
+    MemoryTable.query_after = counted_query_after
+
+    os.environ["STORAGE_BACKEND"] = "memory"
+    table = item_table("table-clean")
+    start = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    for run in range(288, 0, -1):
+        table.put_items(
+            _benchmark_items(100, start - timedelta(minutes=10 * run))
+        )
+
+    caches = {
+        "memory": WindowCache(),
+        "spilled": WindowCache(
+            spill_file="/tmp/window_cache_benchmark.parquet",
+            max_memory_bytes=0,
+        ),
+    }
+    for run in range(7):
+        now = start + timedelta(minutes=10 * run)
+        if run:
+            table.put_items(_benchmark_items(100, now))
+
+        read_items.clear()
+        begin = time.perf_counter()
+        _, _, items = query_dynamodb_last_hours("table-clean", 6, now=now)
+        expected = to_numeric(pd.DataFrame(items))
+        durations = [f"full {time.perf_counter() - begin:.3f} s"]
+        reads = [f"full {sum(read_items)}"]
+
+        for name, cache in caches.items():
+            read_items.clear()
+            begin = time.perf_counter()
+            df = cache.query("table-clean", 6, "us-east-1", now)
+            durations.append(f"{name} {time.perf_counter() - begin:.3f} s")
+            reads.append(f"{name} {sum(read_items)}")
+
+            columns = sorted(expected.columns)
+            pd.testing.assert_frame_equal(
+                df[columns].sort_values(
+                    list(KEY_ATTRIBUTES), ignore_index=True
+                ),
+                expected[columns].sort_values(
+                    list(KEY_ATTRIBUTES), ignore_index=True
+                ),
+            )
+        print(
+            f"run {run}: {len(df)} items in the window, "
+            f"read items: {', '.join(reads)}; {', '.join(durations)}"
+        )
@@ -0,0 +1,281 @@
+import argparse
+import ctypes
+import gc
+import logging
+import os
+import resource
+import statistics
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import List
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+APPLICATION_DIR = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+LAMBDA_DIR = os.path.join(APPLICATION_DIR, "lambda", "lambda-refined")
+
+NUM_INVOCATIONS = 60
+# The native caches, e.g. of pyarrow and SQLite, fill in the first ones
+WARM_UP_INVOCATIONS = 30
+# RSS growth allowed after the warm-up, between the medians of the RSS
+# after the invocations of the end of the warm-up and of the last ones
+MAX_GROWTH_MIB = 8.0
+MEDIAN_INVOCATIONS = 5
+# Peak RSS growth allowed after the warm-up, the peak also moves with
+# the transient allocations of the largest invocation so far
+MAX_PEAK_GROWTH_MIB = 32.0
+NUM_STATIONS = 100
+PARAMETERS = ["pm25", "pm10", "no2", "o3"]
+# A clean run every 10 minutes, 6 hours of runs in the window
+RUN_INTERVAL = timedelta(minutes=10)
+PAST_RUNS = 36
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+ENVIRONMENT = {
+    "STORAGE_BACKEND": "local",
+    "DYNAMODB_TABLE_NAME": "table-clean",
+    "STATION_TABLE_NAME": "table-stations",
+    "REGION_NAME": "us-east-1",
+    "S3_BUCKET_NAME": "bucket-refined",
+    "QUERY_WINDOWS": "6,1,24",
+}
+
+
+def station_items(num_stations: int) -> List[dict]:
+    """
+    Create the items of the station table, around Brussels,
+    with their geohash and cell as written by lambda-clean.
+    lambda-refined must be on the path.
+
+    Parameters:
+    num_stations (int): The number of stations
+
+    Returns:
+    List[dict]: The station items
+    """
+    from modules.geohash.geohash import CELL_PRECISION, encode
+
+    items = []
+    for station in range(num_stations):
+        latitude = Decimal("50.85") + Decimal(station) / 1000
+        longitude = Decimal("4.35") + Decimal(station) / 1000
+        items.append(
+            {
+                "location": f"Station {station}",
+                "city": "Brussels",
+                "country": "BE",
+                "latitude": latitude,
+                "longitude": longitude,
+                "updatedAt": "2024-05-19T21:00:00+0000",
+                "updatedPartition": "stations",
+                "geohash": encode(latitude, longitude),
+                "cell": encode(latitude, longitude, CELL_PRECISION),
+            }
+        )
+    return items
+
+
+def clean_items(
+    num_stations: int, ingested_at: datetime, version: int = 0
+) -> List[dict]:
+    """
+    Create the items of one clean run, one measurement per station
+    and parameter, 10 minutes before their ingestion.
+
+    Parameters:
+    num_stations (int): The number of stations
+    ingested_at (datetime): The UTC ingestion time of the run
+    version (int, optional): Added to the values, for runs ingested again
+
+    Returns:
+    List[dict]: The measurement items
+    """
+    last_updated = ingested_at - timedelta(minutes=10)
+    ingested = ingested_at.strftime(DATE_FORMAT)
+    return [
+        {
+            "location": f"Station {station}",
+            "parameter": parameter,
+            # One parameter per station and time, as the table key
+            "lastUpdated": (last_updated + timedelta(seconds=index))
+            .replace(microsecond=0)
+            .isoformat(),
+            "value": Decimal(str(round(station * 0.7 + index + version, 2))),
+            "expireAt": Decimal(int(ingested_at.timestamp()) + 172800),
+            "ingestedAt": ingested,
+            "ingestedHour": ingested[:13],
+        }
+        for station in range(num_stations)
+        for index, parameter in enumerate(PARAMETERS)
+    ]
+
+
+def rss_mib() -> float:
+    """
+    Get the RSS of this process, after a garbage collection and,
+    with glibc, after returning the free heap memory to the system,
+    so the fragmentation of the heap is not counted as growth.
+    Falls back to the peak RSS without /proc, e.g. on macOS.
+
+    Returns:
+    float: The RSS in MiB
+    """
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass  # Not glibc
+    try:
+        with open("/proc/self/statm", "r") as file:
+            pages = int(file.read().split()[1])
+    except FileNotFoundError:
+        return peak_rss_mib()
+    return pages * resource.getpagesize() / 1024 / 1024
+
+
+def peak_rss_mib() -> float:
+    """
+    Get the peak RSS of this process.
+
+    Returns:
+    float: The peak RSS in MiB
+    """
+    # ru_maxrss is in KiB on Linux, in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def check_memory(
+    num_invocations: int = NUM_INVOCATIONS,
+    warm_up: int = WARM_UP_INVOCATIONS,
+    max_growth_mib: float = MAX_GROWTH_MIB,
+    max_peak_growth_mib: float = MAX_PEAK_GROWTH_MIB,
+) -> List[str]:
+    """
+    Invoke the refined handler repeatedly in this process, as a warm
+    execution environment, on the local storage backend in a temporary
+    directory. Before each invocation, a run of the window is ingested
+    again with new values, as late updates, so the window keeps its size
+    and the growth is not its data.
+    Reports the RSS, the peak RSS, the cached figures, the figures left
+    open in pyplot and the cached templates.
+
+    Parameters:
+    num_invocations (int, optional): The number of invocations
+    warm_up (int, optional): The invocations before the growth is measured
+    max_growth_mib (float, optional): The RSS growth allowed
+    after the warm-up
+    max_peak_growth_mib (float, optional): The peak RSS growth allowed
+    after the warm-up
+
+    Returns:
+    List[str]: The failed checks, empty if the memory stays bounded
+    """
+    os.environ.update(ENVIRONMENT)
+    os.environ["STORAGE_ROOT"] = tempfile.mkdtemp()
+    os.chdir(LAMBDA_DIR)
+    sys.path.insert(0, LAMBDA_DIR)
+    logging.disable(logging.INFO)
+
+    import lambda_function
+    import matplotlib.pyplot as plt
+    from modules.render_cache import render_cache
+    from modules.storage.storage import item_table
+
+    item_table("table-stations", key_attributes=("location",)).put_items(
+        station_items(NUM_STATIONS)
+    )
+    table = item_table("table-clean")
+    now = datetime.now(timezone.utc)
+    runs = [now - run * RUN_INTERVAL for run in range(PAST_RUNS, 0, -1)]
+    for ingested_at in runs:
+        table.put_items(clean_items(NUM_STATIONS, ingested_at))
+
+    rss = []
+    peaks = []
+    for invocation in range(num_invocations):
+        # Ingest a run again with new values and the same keys,
+        # so the window keeps its size
+        items = clean_items(
+            NUM_STATIONS, runs[invocation % PAST_RUNS], invocation + 1
+        )
+        ingested = datetime.now(timezone.utc).strftime(DATE_FORMAT)
+        for item in items:
+            item["ingestedAt"] = ingested
+            item["ingestedHour"] = ingested[:13]
+        table.put_items(items)
+        response = lambda_function.lambda_handler({}, {})
+        if response["statusCode"] != 200:
+            return [f"invocation {invocation + 1} failed: {response}"]
+        rss.append(rss_mib())
+        peaks.append(peak_rss_mib())
+        if invocation in (0, warm_up - 1) or (invocation + 1) % 10 == 0:
+            print(
+                f"invocation {invocation + 1}: "
+                f"RSS {rss[-1]:.1f} MiB, "
+                f"peak RSS {peaks[-1]:.1f} MiB, "
+                f"cached figures {len(render_cache._figures)}, "
+                f"open pyplot figures {len(plt.get_fignums())}, "
+                "cached templates "
+                f"{render_cache.load_template.cache_info().currsize}"
+            )
+
+    window = min(MEDIAN_INVOCATIONS, warm_up)
+    first = warm_up - window
+    growth = statistics.median(rss[-window:]) - statistics.median(
+        rss[first:warm_up]
+    )
+    peak_growth = peaks[-1] - peaks[warm_up - 1]
+    print(
+        f"after the warm-up: RSS growth {growth:.1f} MiB, "
+        f"peak RSS growth {peak_growth:.1f} MiB"
+    )
+    failures = []
+    if growth > max_growth_mib:
+        failures.append(
+            f"RSS grew by {growth:.1f} MiB, more than {max_growth_mib} MiB"
+        )
+    if peak_growth > max_peak_growth_mib:
+        failures.append(
+            f"peak RSS grew by {peak_growth:.1f} MiB, "
+            f"more than {max_peak_growth_mib} MiB"
+        )
+    if len(render_cache._figures) > render_cache.MAX_CACHED_FIGURES:
+        failures.append(
+            f"{len(render_cache._figures)} cached figures, more than "
+            f"{render_cache.MAX_CACHED_FIGURES}"
+        )
+    if plt.get_fignums():
+        failures.append(f"{len(plt.get_fignums())} figures left open")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=(
+            "Check that the memory of warm lambda-refined invocations "
+            "stays bounded."
+        )
+    )
+    parser.add_argument("--invocations", type=int, default=NUM_INVOCATIONS)
+    parser.add_argument("--warm-up", type=int, default=WARM_UP_INVOCATIONS)
+    parser.add_argument("--max-growth", type=float, default=MAX_GROWTH_MIB)
+    parser.add_argument(
+        "--max-peak-growth", type=float, default=MAX_PEAK_GROWTH_MIB
+    )
+    args = parser.parse_args()
+
+    failures = check_memory(
+        args.invocations,
+        args.warm_up,
+        args.max_growth,
+        args.max_peak_growth,
+    )
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
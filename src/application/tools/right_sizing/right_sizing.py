@@ -0,0 +1,663 @@
+import argparse
+import importlib
+import json
+import logging
+import math
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+APPLICATION_DIR = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+LAMBDA_DIR = os.path.join(APPLICATION_DIR, "lambda")
+TERRAFORM_FILES = {
+    "lambda-raw": "src/platform/live-sandbox/1-raw.tf",
+    "lambda-clean": "src/platform/live-sandbox/2-clean.tf",
+    "lambda-refined": "src/platform/live-sandbox/3-refined.tf",
+}
+
+# Lambda allocates CPU in proportion to memory, 1 vCPU at 1769 MB,
+# enforced as a CPU time quota per 100 ms period
+MEMORY_SIZES = [128, 256, 512, 768, 1024, 1536, 1769, 2048, 3008]
+MB_PER_VCPU = 1769
+MAX_VCPUS = 6
+QUOTA_PERIOD = 0.1  # seconds
+QUOTA_POLL_INTERVAL = 0.001  # seconds
+
+# x86 on-demand prices in us-east-1
+PRICE_PER_GB_SECOND = 0.0000166667
+PRICE_PER_REQUEST = 0.0000002
+
+MAX_TIMEOUT = 900  # seconds
+TIMEOUT_FACTOR = 3  # Timeout as a multiple of the slowest replay
+MEMORY_HEADROOM = 0.8  # Peak RSS must fit in 80% of the memory
+# Fraction of the write capacity the clean Lambda paces its writes to
+TARGET_UTILIZATION = 0.9
+STRATEGIES = ("cost", "speed", "balanced")
+
+# Times of the recorded data, shifted to the time of the replay.
+# None for ISO 8601 times, e.g. 2024-05-19T21:00:00+00:00
+TIME_FORMATS = {
+    "lastUpdated": None,
+    "ingestedAt": "%Y-%m-%dT%H:%M:%S%z",
+    "updatedAt": "%Y-%m-%dT%H:%M:%S%z",
+}
+EPOCH_ATTRIBUTES = ("expireAt",)
+
+
+def load_recording(recording_file: str) -> dict:
+    """
+    Load a recorded invocation. File paths are relative to the recording.
+
+    {
+        "handler": "lambda-clean",
+        "event": {...},
+        "environment": {"DYNAMODB_TABLE_NAME": "table-clean", ...},
+        "storage": "storage",
+        "objects": {"bucket-raw/2024-05-19.json": "raw.json"},
+        "stubs": {"lambda_function.query_api": "openaq-latest.json"},
+        "items": {"table-clean": "clean-items.json"},
+        "key_attributes": {"table-stations": ["location"]},
+        "recorded_at": "2024-05-19T21:05:00+00:00",
+        "write_capacity": {"table-clean": 5}
+    }
+
+    - storage: a STORAGE_ROOT of the local backend, copied for each replay
+    - objects: files put in the buckets of the local backend
+    - stubs: functions replaced by a function returning the JSON file,
+      e.g. calls to external APIs
+    - items: JSON arrays of items put in the tables of the local backend
+    - key_attributes: the key of the tables of items not keyed by
+      location and lastUpdated
+    - recorded_at: the time of the recording. The times of the stubs
+      and items are shifted by the time since, so the handler sees data
+      as fresh as when it was recorded, e.g. in its query window.
+    - write_capacity: the write capacity units of the invocation by
+      table. The local backend does not pace its writes, the time to
+      write the items at this capacity is added to the replay.
+
+    Parameters:
+    recording_file (str): The recording JSON file
+
+    Returns:
+    dict: The recording, with absolute file paths
+    """
+    with open(recording_file, "r") as file:
+        recording = json.load(file)
+    if recording["handler"] not in TERRAFORM_FILES:
+        raise ValueError(f"Unknown handler: {recording['handler']}")
+
+    directory = os.path.dirname(os.path.abspath(recording_file))
+    if recording.get("storage"):
+        recording["storage"] = os.path.join(directory, recording["storage"])
+    for field in ("objects", "stubs", "items"):
+        recording[field] = {
+            name: os.path.join(directory, file)
+            for name, file in recording.get(field, {}).items()
+        }
+    recording.setdefault("event", {})
+    recording.setdefault("environment", {})
+    recording.setdefault("key_attributes", {})
+    recording.setdefault("write_capacity", {})
+    return recording
+
+
+def shift_times(value, offset: timedelta):
+    """
+    Shift the recorded times of JSON values, e.g. the lastUpdated
+    of the measurements of an API response or of table items.
+
+    Parameters:
+    value: The JSON value, a dict, a list or a scalar
+    offset (timedelta): The time between the recording and the replay
+
+    Returns:
+    The value with the shifted times
+    """
+    if isinstance(value, list):
+        return [shift_times(item, offset) for item in value]
+    if not isinstance(value, dict):
+        return value
+
+    shifted = {}
+    for name, field in value.items():
+        if name in TIME_FORMATS and isinstance(field, str):
+            time_format = TIME_FORMATS[name]
+            if time_format is None:
+                shifted[name] = (
+                    datetime.fromisoformat(field) + offset
+                ).isoformat()
+            else:
+                shifted[name] = (
+                    datetime.strptime(field, time_format) + offset
+                ).strftime(time_format)
+        elif name in EPOCH_ATTRIBUTES and field is not None:
+            shifted[name] = field + int(offset.total_seconds())
+        else:
+            shifted[name] = shift_times(field, offset)
+    # The hour partition of the ingestedAt index
+    if "ingestedHour" in shifted and "ingestedAt" in shifted:
+        shifted["ingestedHour"] = shifted["ingestedAt"][:13]
+    return shifted
+
+
+def replay_offset(recording: dict) -> timedelta:
+    """
+    Get the time between the recording and the replay.
+
+    Parameters:
+    recording (dict): The recording
+
+    Returns:
+    timedelta: The offset, zero if the recording has no recorded_at
+    """
+    if not recording.get("recorded_at"):
+        return timedelta(0)
+    recorded_at = datetime.fromisoformat(recording["recorded_at"])
+    return datetime.now(timezone.utc) - recorded_at
+
+
+def vcpus(memory: int) -> float:
+    """
+    Get the vCPUs of a Lambda memory size.
+
+    Parameters:
+    memory (int): The memory in MB
+
+    Returns:
+    float: The vCPUs, fractional below 1769 MB
+    """
+    return min(memory / MB_PER_VCPU, MAX_VCPUS)
+
+
+def prepare_storage(recording: dict, storage_root: str) -> None:
+    """
+    Create the local storage of a replay from the recording.
+
+    Parameters:
+    recording (dict): The recording
+    storage_root (str): The STORAGE_ROOT of the replay
+    """
+    if recording.get("storage"):
+        shutil.copytree(recording["storage"], storage_root)
+    for key, file in recording["objects"].items():
+        path = os.path.join(storage_root, *key.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(file, path)
+
+
+def replay(recording_file: str, storage_root: str, result_file: str) -> None:
+    """
+    Replay a recorded invocation in this process, a cold start:
+    import the handler, then invoke it once with the recorded event.
+
+    Parameters:
+    recording_file (str): The recording JSON file
+    storage_root (str): The STORAGE_ROOT of the replay
+    result_file (str): The JSON file to write the timings to
+    """
+    recording = load_recording(recording_file)
+    lambda_dir = os.path.join(LAMBDA_DIR, recording["handler"])
+    os.environ.update(recording["environment"])
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ["STORAGE_ROOT"] = storage_root
+    os.chdir(lambda_dir)
+    sys.path.insert(0, lambda_dir)
+
+    start = time.perf_counter()
+    start_cpu = time.process_time()
+    handler_module = importlib.import_module("lambda_function")
+    offset = replay_offset(recording)
+    for target, file in recording["stubs"].items():
+        module_name, attribute = target.rsplit(".", 1)
+        with open(file, "r") as stub_file:
+            value = shift_times(json.load(stub_file), offset)
+        setattr(
+            importlib.import_module(module_name),
+            attribute,
+            lambda *args, value=value, **kwargs: value,
+        )
+    init_seconds = time.perf_counter() - start
+    init_cpu_seconds = time.process_time() - start_cpu
+
+    # Put the recorded items in the tables, before the handler
+    storage = importlib.import_module("modules.storage.storage")
+    for table_name, file in recording["items"].items():
+        with open(file, "r") as items_file:
+            items = json.load(
+                items_file, parse_float=Decimal, parse_int=Decimal
+            )
+        storage.item_table(
+            table_name,
+            key_attributes=recording["key_attributes"].get(
+                table_name, storage.KEY_ATTRIBUTES
+            ),
+        ).put_items(shift_times(items, offset))
+
+    # Count the items written to each table, to add their paced writes
+    written_items = {}
+    put_items = storage.SQLiteTable.put_items
+
+    def counted_put_items(table, items):
+        num_items = put_items(table, items)
+        written_items[table.table_name] = (
+            written_items.get(table.table_name, 0) + num_items
+        )
+        return num_items
+
+    storage.SQLiteTable.put_items = counted_put_items
+
+    start = time.perf_counter()
+    start_cpu = time.process_time()
+    response = handler_module.lambda_handler(recording["event"], {})
+    result = {
+        "init_seconds": init_seconds,
+        "init_cpu_seconds": init_cpu_seconds,
+        "handler_seconds": time.perf_counter() - start,
+        "handler_cpu_seconds": time.process_time() - start_cpu,
+        "written_items": written_items,
+        "response": response,
+    }
+    with open(result_file, "w") as file:
+        json.dump(result, file, default=str)
+
+
+def cpu_seconds(pid: int) -> float:
+    """
+    Get the CPU time of all threads of a process, in nanosecond precision.
+
+    Parameters:
+    pid (int): The process ID
+
+    Returns:
+    float: The CPU time in seconds
+    """
+    total = 0
+    task_dir = f"/proc/{pid}/task"
+    for task in os.listdir(task_dir):
+        try:
+            with open(f"{task_dir}/{task}/schedstat", "r") as file:
+                total += int(file.read().split()[0])
+        except (FileNotFoundError, ProcessLookupError):
+            continue  # Thread exited
+    return total / 1e9
+
+
+def run_replay(
+    recording_file: str, recording: dict, cpus: Optional[float]
+) -> dict:
+    """
+    Replay a recorded invocation in a child process, limited to the CPU
+    of a Lambda memory size: the child is pinned to as many cores as
+    vCPUs, and stopped for the rest of each 100 ms period once it has
+    used its CPU time quota, as the Lambda cgroups do.
+
+    Parameters:
+    recording_file (str): The recording JSON file
+    recording (dict): The recording
+    cpus (float, optional): The vCPUs, not limited if None
+
+    Returns:
+    dict: The timings, the peak RSS and the response of the replay
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage_root = os.path.join(tmp_dir, "storage")
+        result_file = os.path.join(tmp_dir, "result.json")
+        log_file = os.path.join(tmp_dir, "replay.log")
+        prepare_storage(recording, storage_root)
+        os.makedirs(storage_root, exist_ok=True)
+
+        start = time.perf_counter()
+        with open(log_file, "w") as log:
+            process = subprocess.Popen(
+                [
+                    sys.executable,
+                    os.path.abspath(__file__),
+                    "_replay",
+                    os.path.abspath(recording_file),
+                    storage_root,
+                    result_file,
+                ],
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+        cores = sorted(os.sched_getaffinity(0))
+        if cpus is not None:
+            num_cores = max(1, min(math.ceil(cpus), len(cores)))
+            os.sched_setaffinity(process.pid, cores[:num_cores])
+        status, rusage, throttled_seconds = _wait_throttled(process.pid, cpus)
+        wall_seconds = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            with open(log_file, "r") as log:
+                logging.error(log.read()[-4000:])
+            raise RuntimeError(
+                f"Replay of {recording_file} failed: {process.returncode}"
+            )
+        with open(result_file, "r") as file:
+            result = json.load(file)
+
+    result["wall_seconds"] = wall_seconds
+    result["throttled_seconds"] = throttled_seconds
+    result["peak_rss_mb"] = rusage.ru_maxrss / 1024  # KB on Linux
+    return result
+
+
+def _wait_throttled(pid: int, cpus: Optional[float]) -> tuple:
+    """
+    Wait for a child process, throttled to a CPU time quota per period.
+    CPU used over the quota is carried to the next period.
+
+    Parameters:
+    pid (int): The process ID
+    cpus (float, optional): The vCPUs, not limited if None
+
+    Returns:
+    tuple: The exit status, the resource usage and the throttled seconds
+    """
+    quota = None if cpus is None else cpus * QUOTA_PERIOD
+    throttled_seconds = 0.0
+    period_end = time.perf_counter() + QUOTA_PERIOD
+    used_at_period_start = 0.0
+    while True:
+        waited_pid, status, rusage = os.wait4(pid, os.WNOHANG)
+        if waited_pid == pid:
+            return status, rusage, throttled_seconds
+        if quota is None:
+            time.sleep(QUOTA_POLL_INTERVAL)
+            continue
+
+        try:
+            used = cpu_seconds(pid) - used_at_period_start
+        except FileNotFoundError:
+            continue  # Exiting, reaped on the next wait
+        now = time.perf_counter()
+        if used >= quota and now < period_end:
+            os.kill(pid, signal.SIGSTOP)
+            time.sleep(period_end - now)
+            os.kill(pid, signal.SIGCONT)
+            throttled_seconds += period_end - now
+            now = period_end
+        if now >= period_end:
+            used_at_period_start += min(used, quota)
+            period_end = now + QUOTA_PERIOD
+        time.sleep(QUOTA_POLL_INTERVAL)
+
+
+def estimate(wall: float, cpu: float, memory: int) -> float:
+    """
+    Estimate a duration at a memory size from a replay at full speed:
+    the CPU time is spread over the vCPUs, up to the parallelism
+    of the replay, the rest of the duration is waiting for I/O.
+
+    Parameters:
+    wall (float): The duration at full speed in seconds
+    cpu (float): The CPU time at full speed in seconds
+    memory (int): The memory in MB
+
+    Returns:
+    float: The estimated duration in seconds
+    """
+    parallelism = max(1.0, cpu / wall) if wall > 0 else 1.0
+    io_wait = max(wall - cpu / parallelism, 0.0)
+    return io_wait + cpu / min(vcpus(memory), parallelism)
+
+
+def paced_write_seconds(recording: dict, written_items: dict) -> float:
+    """
+    Get the time to write the items of a replay at the write capacity
+    of the recording, at worst, when every write is paced.
+
+    Parameters:
+    recording (dict): The recording
+    written_items (dict): The number of items written by table
+
+    Returns:
+    float: The paced write time in seconds
+    """
+    return sum(
+        written_items.get(table, 0) / (TARGET_UTILIZATION * capacity_units)
+        for table, capacity_units in recording["write_capacity"].items()
+    )
+
+
+def invocation_cost(memory: int, seconds: float) -> float:
+    """
+    Get the cost of an invocation, billed per millisecond.
+
+    Parameters:
+    memory (int): The memory in MB
+    seconds (float): The billed duration
+
+    Returns:
+    float: The cost in USD
+    """
+    billed_seconds = math.ceil(seconds * 1000) / 1000
+    return memory / 1024 * billed_seconds * PRICE_PER_GB_SECOND + (
+        PRICE_PER_REQUEST
+    )
+
+
+def profile(
+    recording_file: str,
+    memory_sizes: List[int],
+    repeats: int = 1,
+    mode: str = "throttle",
+) -> List[dict]:
+    """
+    Profile a recorded invocation at each memory size.
+
+    Parameters:
+    recording_file (str): The recording JSON file
+    memory_sizes (List[int]): The memory sizes in MB
+    repeats (int, optional): The replays per memory size, the median
+    duration is kept
+    mode (str, optional): "throttle" to replay at each memory size,
+    "model" to estimate each memory size from one replay at full speed
+
+    Returns:
+    List[dict]: The profile of each memory size
+    """
+    recording = load_recording(recording_file)
+    if mode == "model":
+        full_speed = [
+            run_replay(recording_file, recording, None) for _ in range(repeats)
+        ]
+
+    profiles = []
+    for memory in memory_sizes:
+        if mode == "model":
+            results = [
+                {
+                    **result,
+                    "init_seconds": estimate(
+                        result["init_seconds"],
+                        result["init_cpu_seconds"],
+                        memory,
+                    ),
+                    "handler_seconds": estimate(
+                        result["handler_seconds"],
+                        result["handler_cpu_seconds"],
+                        memory,
+                    ),
+                }
+                for result in full_speed
+            ]
+        else:
+            results = [
+                run_replay(recording_file, recording, vcpus(memory))
+                for _ in range(repeats)
+            ]
+        durations = [result["handler_seconds"] for result in results]
+
+        handler_seconds = statistics.median(durations)
+        peak_rss_mb = max(result["peak_rss_mb"] for result in results)
+        write_seconds = max(
+            paced_write_seconds(recording, result["written_items"])
+            for result in results
+        )
+        cost = invocation_cost(memory, handler_seconds + write_seconds)
+        profiles.append(
+            {
+                "memory": memory,
+                "vcpus": round(vcpus(memory), 3),
+                "init_seconds": max(r["init_seconds"] for r in results),
+                "handler_seconds": handler_seconds,
+                "max_handler_seconds": max(durations),
+                "paced_write_seconds": write_seconds,
+                "peak_rss_mb": peak_rss_mb,
+                "fits_memory": peak_rss_mb <= memory * MEMORY_HEADROOM,
+                "cost_per_invocation": cost,
+                "cost_per_million": cost * 1e6,
+            }
+        )
+        logging.info(
+            f"{recording['handler']} {memory} MB: "
+            f"{handler_seconds:.3f} s, {peak_rss_mb:.0f} MB peak RSS"
+        )
+    return profiles
+
+
+def recommend(
+    profiles: List[dict], strategy: str = "cost"
+) -> Optional[Dict[str, int]]:
+    """
+    Recommend the memory and timeout of a Lambda function.
+    Memory sizes the peak RSS does not fit with headroom are left out.
+
+    Parameters:
+    profiles (List[dict]): The profile of each memory size
+    strategy (str, optional): "cost" for the cheapest, "speed" for the
+    fastest, "balanced" for the best sum of relative cost and duration
+
+    Returns:
+    Dict[str, int]: The memory in MB and the timeout in seconds,
+    None if no memory size fits
+    """
+    candidates = [
+        profile
+        for profile in profiles
+        if profile["fits_memory"]
+        and profile["init_seconds"]
+        + profile["max_handler_seconds"]
+        + profile["paced_write_seconds"]
+        < MAX_TIMEOUT
+    ]
+    if not candidates:
+        return None
+
+    min_cost = min(profile["cost_per_invocation"] for profile in candidates)
+    min_seconds = min(profile["handler_seconds"] for profile in candidates)
+    scores = {
+        "cost": lambda profile: profile["cost_per_invocation"],
+        "speed": lambda profile: profile["handler_seconds"],
+        "balanced": lambda profile: (
+            profile["cost_per_invocation"] / min_cost
+            + profile["handler_seconds"] / max(min_seconds, 1e-3)
+        ),
+    }
+    best = min(candidates, key=scores[strategy])
+
+    # Cold start and slowest replay, with margin for larger payloads,
+    # and the paced writes, bound by the write capacity instead
+    slowest = best["init_seconds"] + best["max_handler_seconds"]
+    seconds = slowest * TIMEOUT_FACTOR + best["paced_write_seconds"]
+    timeout = min(max(5 * math.ceil(seconds / 5), 10), MAX_TIMEOUT)
+    return {"memory": best["memory"], "timeout": timeout}
+
+
+def print_report(
+    handler: str, profiles: List[dict], recommendation: Optional[dict]
+) -> None:
+    """
+    Print the profiles and the recommended Terraform values.
+
+    Parameters:
+    handler (str): The Lambda function, e.g. lambda-refined
+    profiles (List[dict]): The profile of each memory size
+    recommendation (dict, optional): The recommended memory and timeout
+    """
+    print(f"\n{handler}")
+    print(
+        f"{'memory':>8} {'vCPU':>6} {'init s':>8} {'handler s':>10} "
+        f"{'writes s':>9} {'peak MB':>8} {'fits':>5} {'USD / 1M':>9}"
+    )
+    for profile in profiles:
+        print(
+            f"{profile['memory']:>8} {profile['vcpus']:>6.2f} "
+            f"{profile['init_seconds']:>8.2f} "
+            f"{profile['handler_seconds']:>10.3f} "
+            f"{profile['paced_write_seconds']:>9.1f} "
+            f"{profile['peak_rss_mb']:>8.0f} "
+            f"{'yes' if profile['fits_memory'] else 'no':>5} "
+            f"{profile['cost_per_million']:>9.2f}"
+        )
+    if recommendation is None:
+        print("No memory size fits the peak RSS.")
+        return
+
+    print(f"\n# {TERRAFORM_FILES[handler]}")
+    print(f"  timeout = {recommendation['timeout']}")
+    print(f"  memory  = {recommendation['memory']}")
+    if handler == "lambda-clean":
+        print(
+            "  # clean queue: visibility_timeout_seconds = "
+            f"{6 * recommendation['timeout']}"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "_replay":
+        # Child process of a replay
+        replay(*sys.argv[2:5])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Replay recorded Lambda invocations at several memory sizes "
+            "and recommend the memory and timeout of each function."
+        )
+    )
+    parser.add_argument("recordings", nargs="+")
+    parser.add_argument(
+        "--memory",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=MEMORY_SIZES,
+    )
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument(
+        "--mode", choices=("throttle", "model"), default="throttle"
+    )
+    parser.add_argument("--strategy", choices=STRATEGIES, default="cost")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    report = {}
+    for recording_file in args.recordings:
+        handler = load_recording(recording_file)["handler"]
+        profiles = profile(
+            recording_file, args.memory, args.repeats, args.mode
+        )
+        recommendation = recommend(profiles, args.strategy)
+        print_report(handler, profiles, recommendation)
+        report[handler] = {
+            "profiles": profiles,
+            "recommendation": recommendation,
+        }
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
@@ -0,0 +1,125 @@
+import argparse
+import difflib
+import logging
+import os
+import sys
+from typing import Dict, List
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+APPLICATION_DIR = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+LAMBDA_DIR = os.path.join(APPLICATION_DIR, "lambda")
+
+
+def shared_modules(lambda_dir: str = LAMBDA_DIR) -> Dict[str, List[str]]:
+    """
+    Find the modules copied into more than one Lambda function.
+    Each function is built from its own folder only, so the shared modules,
+    e.g. storage and profiling, are copied into each folder.
+
+    Parameters:
+    lambda_dir (str, optional): The folder of the Lambda functions
+
+    Returns:
+    Dict[str, List[str]]: The functions of each shared module, by name
+    """
+    modules: Dict[str, List[str]] = {}
+    for function in sorted(os.listdir(lambda_dir)):
+        modules_dir = os.path.join(lambda_dir, function, "modules")
+        if not os.path.isdir(modules_dir):
+            continue
+        for module in sorted(os.listdir(modules_dir)):
+            if os.path.isdir(os.path.join(modules_dir, module)):
+                modules.setdefault(module, []).append(function)
+    return {
+        module: functions
+        for module, functions in modules.items()
+        if len(functions) > 1
+    }
+
+
+def module_files(module_dir: str) -> Dict[str, bytes]:
+    """
+    Read the files of a module, without the compiled files.
+
+    Parameters:
+    module_dir (str): The folder of the module
+
+    Returns:
+    Dict[str, bytes]: The content of each file, by path in the module
+    """
+    files = {}
+    for root, dirs, names in os.walk(module_dir):
+        dirs[:] = sorted(name for name in dirs if name != "__pycache__")
+        for name in sorted(names):
+            if name.endswith(".pyc"):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as file:
+                files[os.path.relpath(path, module_dir)] = file.read()
+    return files
+
+
+def check_shared_modules(lambda_dir: str = LAMBDA_DIR) -> List[str]:
+    """
+    Compare the copies of each shared module with the copy of the first
+    function, e.g. lambda-clean.
+
+    Parameters:
+    lambda_dir (str, optional): The folder of the Lambda functions
+
+    Returns:
+    List[str]: The differences, empty if all copies are identical
+    """
+    drifts = []
+    for module, functions in shared_modules(lambda_dir).items():
+        reference, *others = functions
+        reference_files = module_files(
+            os.path.join(lambda_dir, reference, "modules", module)
+        )
+        for function in others:
+            files = module_files(
+                os.path.join(lambda_dir, function, "modules", module)
+            )
+            for name in sorted(set(reference_files) | set(files)):
+                if reference_files.get(name) == files.get(name):
+                    continue
+                reference_path = f"{reference}/modules/{module}/{name}"
+                path = f"{function}/modules/{module}/{name}"
+                if name not in files or name not in reference_files:
+                    missing = path if name not in files else reference_path
+                    drifts.append(f"{missing} is missing")
+                    continue
+                diff = difflib.unified_diff(
+                    reference_files[name].decode().splitlines(),
+                    files[name].decode().splitlines(),
+                    reference_path,
+                    path,
+                    lineterm="",
+                )
+                drifts.append("\n".join(diff))
+    return drifts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=(
+            "Check that the modules copied into several Lambda functions "
+            "are identical."
+        )
+    )
+    parser.add_argument("--lambda-dir", default=LAMBDA_DIR)
+    args = parser.parse_args()
+
+    for module, functions in shared_modules(args.lambda_dir).items():
+        print(f"{module}: {', '.join(functions)}")
+    drifts = check_shared_modules(args.lambda_dir)
+    for drift in drifts:
+        print(drift)
+    if drifts:
+        print(f"FAILED: {len(drifts)} shared module files differ")
+    sys.exit(1 if drifts else 0)
@@ -28,7 +28,7 @@ module "raw_schedule_lambda" {
 module "raw_ecr" {
   source = "../terraform-components/aws-ecr"
 
-  repository_name = "lambda-raw"
+  repository_name         = "lambda-raw"
   repository_force_delete = true
 
   pull_access_principal_arns = []
@@ -52,6 +52,7 @@ module "raw_lambda" {
   function_name                  = "lambda-raw"
   function_description           = "This Lambda function will ingest from OpenAQ API data into S3 in the raw zone."
   reserved_concurrent_executions = -1
+  # make right-sizing: 128 MB and 20 s, without the OpenAQ request
   timeout                        = 30
   memory                         = 128
 
@@ -72,10 +73,17 @@ module "raw_lambda" {
   }
 
   environment_variables = {
-    "COUNTRY"              = "BE"
-    "S3_BUCKET_NAME"       = module.raw_bucket.bucket_name
-    "REGION_NAME"          = data.aws_region.active.name
-    API_TOKEN_API_KEY_NAME = "OPENAQ_API_KEY"
+    "COUNTRY"        = "BE"
+    "S3_BUCKET_NAME" = module.raw_bucket.bucket_name
+    "REGION_NAME"    = data.aws_region.active.name
+    "INGESTION_MODE" = "sync"
+    # Runs are sharded by station, sized for the clean Lambda batches
+    "SHARD_TARGET_ITEMS" = local.raw_shard_target_items
+    "MAX_SHARDS"         = 16
+    # Profile 1 in N invocations, 0 to only profile on demand
+    "PROFILING_SAMPLE_RATE" = 0
+    "PROFILING_BUCKET"      = module.raw_bucket.bucket_name
+    API_TOKEN_API_KEY_NAME  = "OPENAQ_API_KEY"
   }
 
   secrets = {
@@ -115,9 +123,10 @@ module "raw_bucket" {
   bucket_notification_info = {
     events               = ["s3:ObjectCreated:*"]
     filter_prefix        = ""
-    filter_suffix        = ""
-    lambda_function_arns = [module.clean_lambda.lambda_info.arn]
-    sqs_queue_arns       = []
+    # Only the raw shards, not the run manifests, trigger lambda-clean
+    filter_suffix        = ".json"
+    lambda_function_arns = local.enable_clean_queue ? [] : [module.clean_lambda.lambda_info.arn]
+    sqs_queue_arns       = local.enable_clean_queue ? [module.clean_queue[0].queue_arn] : []
     sns_topic_arns       = []
   }
 
@@ -25,7 +25,7 @@ module "clean_lambda" {
   function_name                  = "lambda-clean"
   function_description           = "This Lambda function will ingest data from the raw S3 bucket into the clean DynamoDB table."
   reserved_concurrent_executions = -1
-  timeout                        = 30
+  timeout                        = local.clean_lambda_timeout
   memory                         = 128
 
   publish = true
@@ -40,14 +40,37 @@ module "clean_lambda" {
     "lambda:InvokeFunction",
     "lambda:ListVersionsByFunction",
   ]
-  lambda_policy_arns = {
-    "raw_bucket_consumer"  = module.raw_bucket.consumer_policy_arn
-    "clean_table_consumer" = module.clean_table.consumer_policy_arn
-  }
+  lambda_policy_arns = merge(
+    {
+      "raw_bucket_consumer"    = module.raw_bucket.consumer_policy_arn
+      "clean_table_consumer"   = module.clean_table.consumer_policy_arn
+      "station_table_consumer" = module.station_table.consumer_policy_arn
+    },
+    local.enable_clean_queue ? {
+      "clean_queue_consumer" = module.clean_queue[0].consumer_policy_arn
+    } : {}
+  )
+
+  sqs_event_source_info = local.enable_clean_queue ? {
+    "clean_queue" = {
+      queue_arn                          = module.clean_queue[0].queue_arn
+      batch_size                         = local.clean_queue_batch_size
+      maximum_batching_window_in_seconds = 30
+      maximum_concurrency                = local.clean_lambda_concurrency
+    }
+  } : {}
 
   environment_variables = {
     "DYNAMODB_TABLE_NAME" = module.clean_table.table_name
+    "STATION_TABLE_NAME"  = module.station_table.table_name
     "REGION_NAME"         = data.aws_region.active.name
+    # The share of the write capacity of each concurrent invocation
+    "WRITE_CAPACITY_UNITS" = local.clean_table_write_capacity / local.clean_lambda_concurrency
+    # Records processed at once, each raw object is held in memory (128 MB)
+    "RECORD_CONCURRENCY" = 2
+    # Profile 1 in N invocations, 0 to only profile on demand
+    "PROFILING_SAMPLE_RATE" = 0
+    "PROFILING_BUCKET"      = module.raw_bucket.bucket_name
   }
 
   secrets = {}
@@ -60,6 +83,24 @@ module "clean_lambda" {
   tags = local.tags
 }
 
+module "clean_queue" {
+  count  = local.enable_clean_queue ? 1 : 0
+  source = "../terraform-components/aws-sqs-queue"
+
+  queue_name                 = "queue-clean"
+  visibility_timeout_seconds = 6 * local.clean_lambda_timeout
+  max_receive_count          = 5
+
+  allowed_actions = [
+    "sqs:ReceiveMessage",
+    "sqs:DeleteMessage",
+    "sqs:ChangeMessageVisibility",
+    "sqs:GetQueueAttributes"
+  ]
+
+  tags = local.tags
+}
+
 module "clean_table" {
   source = "../terraform-components/aws-dynamodb"
 
@@ -67,11 +108,12 @@ module "clean_table" {
   billing_mode_info = {
     mode           = "PROVISIONED"
     read_capacity  = 20
-    write_capacity = 10
+    write_capacity = local.clean_table_write_capacity
   }
 
   allowed_actions = [
     "dynamodb:PutItem",
+    "dynamodb:BatchWriteItem",
     "dynamodb:GetItem",
     "dynamodb:UpdateItem",
     "dynamodb:DeleteItem",
@@ -91,6 +133,74 @@ module "clean_table" {
   }
   ttl_attribute_name = "expireAt"
 
+  global_secondary_indexes = {
+    # Measurements by hour of ingestion, for the incremental queries
+    # of the refined Lambda instead of a table scan
+    "ingested-index" = {
+      hash_key_info = {
+        name = "ingestedHour"
+        type = "S"
+      }
+      range_key_info = {
+        name = "ingestedAt"
+        type = "S"
+      }
+      projection_type = "ALL"
+      read_capacity   = 5
+      write_capacity  = local.clean_table_write_capacity
+    }
+  }
+
+  apply_table_policy                    = false
+  full_override_table_policy_document   = "{}"
+  enable_kms_encryption                 = false
+  table_kms_allow_additional_principals = []
+
+  tags = local.tags
+}
+
+# Station metadata by location, upserted by the clean Lambda when it changes
+module "station_table" {
+  source = "../terraform-components/aws-dynamodb"
+
+  table_name = "table-stations"
+  billing_mode_info = {
+    mode = "PAY_PER_REQUEST"
+  }
+
+  allowed_actions = [
+    "dynamodb:PutItem",
+    "dynamodb:BatchWriteItem",
+    "dynamodb:GetItem",
+    "dynamodb:Scan",
+    "dynamodb:Query"
+  ]
+
+  deletion_protection_enabled = false
+
+  hash_key_info = {
+    name = "location"
+    type = "S"
+  }
+
+  global_secondary_indexes = {
+    # Stations by upsert time, in one partition, for the incremental
+    # refreshes of the refined Lambda instead of a table scan.
+    # Stations are only written when they change, far below the write
+    # limit of a partition.
+    "updated-index" = {
+      hash_key_info = {
+        name = "updatedPartition"
+        type = "S"
+      }
+      range_key_info = {
+        name = "updatedAt"
+        type = "S"
+      }
+      projection_type = "ALL"
+    }
+  }
+
   apply_table_policy                    = false
   full_override_table_policy_document   = "{}"
   enable_kms_encryption                 = false
@@ -52,7 +52,10 @@ module "refined_lambda" {
   function_name                  = "lambda-refined"
   function_description           = "This Lambda function will ingest data from the clean DynamoDB table to the refined S3 bucket."
   reserved_concurrent_executions = -1
-  timeout                        = 60
+  # make right-sizing: 512 MB and 100 s, or 75 s at 640 MB, for a cold
+  # replay without the cartopy and geopandas imports. Warm invocations
+  # peak at 506 MiB in make memory-check, more than 80% of 512 MB.
+  timeout                        = 90 # Plots of the 3 windows
   memory                         = 640
 
   publish = true
@@ -69,14 +72,21 @@ module "refined_lambda" {
   ]
   lambda_policy_arns = {
     "clean_table_consumer"    = module.clean_table.consumer_policy_arn
+    "station_table_consumer"  = module.station_table.consumer_policy_arn
     "refined_bucket_consumer" = module.refined_bucket.consumer_policy_arn
+    # Profiling reports, the refined bucket is public
+    "raw_bucket_consumer" = module.raw_bucket.consumer_policy_arn
   }
 
   environment_variables = {
     "DYNAMODB_TABLE_NAME" = module.clean_table.table_name
+    "STATION_TABLE_NAME"  = module.station_table.table_name
     "S3_BUCKET_NAME"      = module.refined_bucket.bucket_name
     "REGION_NAME"         = data.aws_region.active.name
-    "QUERY_HOURS"         = "6"
+    "QUERY_WINDOWS"       = "6,1,24" # Primary window first
+    # Profile 1 in N invocations, 0 to only profile on demand
+    "PROFILING_SAMPLE_RATE" = 0
+    "PROFILING_BUCKET"      = module.raw_bucket.bucket_name
   }
 
   secrets = {}
@@ -98,6 +108,18 @@ module "refined_bucket" {
   versioning_enabled            = true
   server_access_logging_enabled = false
 
+  # The data artifacts of each run, data/aggregates*/<timestamp>/, are never
+  # overwritten. The latest pointers are rewritten by every run, so they
+  # only expire with the artifacts they point to, if the runs stop.
+  lifecycle_expiration_rules = [
+    {
+      id                         = "expire-data-artifacts"
+      prefix                     = "data/aggregates"
+      expiration_days            = 7
+      noncurrent_expiration_days = 1
+    }
+  ]
+
   apply_bucket_policy                    = true
   enable_kms_encryption                  = false
   bucket_kms_allow_additional_principals = []
@@ -2,6 +2,29 @@ data "aws_region" "active" {}
 
 locals {
   openaq_api_key_file_path = "../../../data/01_raw/openaq-api-key.txt"
+
+  # Buffer the raw bucket notifications in an SQS queue consumed in batches
+  # by the clean Lambda function, instead of invoking it per object.
+  enable_clean_queue = true
+
+  # Provisioned write capacity of the clean table and of its indexes,
+  # also used by the clean Lambda function to pace its writes.
+  clean_table_write_capacity = 10
+
+  # Clean Lambda invocations consuming the queue at once, each paces its
+  # writes to its share of the write capacity (SQS requires at least 2).
+  clean_lambda_concurrency = 2
+  clean_lambda_timeout     = 300
+
+  # Measurements per raw shard, each one is about 1 WCU to write.
+  raw_shard_target_items = 500
+
+  # Raw objects per SQS batch, so that a batch of full shards is written
+  # within 80% of the clean Lambda timeout at 90% of its write capacity.
+  clean_queue_batch_size = max(1, floor(
+    0.8 * local.clean_lambda_timeout * 0.9 * local.clean_table_write_capacity
+    / local.clean_lambda_concurrency / local.raw_shard_target_items
+  ))
   
   tags = {
     Organisation = "DemoOrg"
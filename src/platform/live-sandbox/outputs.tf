@@ -31,11 +31,21 @@ output "clean_lambda_name" {
   description = "The name of the clean Lambda function."
 }
 
+output "clean_queue_name" {
+  value       = local.enable_clean_queue ? module.clean_queue[0].queue_name : null
+  description = "The name of the SQS queue buffering the raw bucket notifications."
+}
+
 output "clean_dynamodb_table_name" {
   value       = module.clean_table.table_name
   description = "The name of the clean DynamoDB table."
 }
 
+output "station_dynamodb_table_name" {
+  value       = module.station_table.table_name
+  description = "The name of the station metadata DynamoDB table."
+}
+
 ### Refined Zone
 output "refined_schedule_lambda_name" {
   value       = module.refined_schedule_lambda.schedule_info.name
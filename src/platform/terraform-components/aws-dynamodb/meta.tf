@@ -5,4 +5,18 @@ data "aws_region" "active" {}
 locals {
   table_key_name             = "${var.table_name}-key"
   table_consumer_policy_name = "${var.table_name}-consumer-policy"
+
+  # Attributes of the index keys, except the table keys
+  table_key_names = [var.hash_key_info["name"], var.range_key_info["name"]]
+  index_key_infos = flatten([
+    for index in values(var.global_secondary_indexes) : [
+      for key_info in [index.hash_key_info, index.range_key_info] :
+      key_info if key_info != null
+    ]
+  ])
+  index_key_attributes = {
+    for key_info in local.index_key_infos :
+    key_info["name"] => key_info["type"]...
+    if !contains(local.table_key_names, key_info["name"])
+  }
 }
@@ -8,6 +8,11 @@ output "table_arn" {
   description = "The Amazon Resource Name (ARN) of the table."
 }
 
+output "table_index_names" {
+  value       = keys(var.global_secondary_indexes)
+  description = "The names of the global secondary indexes of the table."
+}
+
 output "table_kms_key_id" {
   value       = var.enable_kms_encryption ? module.table_kms_key[0].key_id : null
   description = "The ID of the KMS key used for the DynamoDB table."
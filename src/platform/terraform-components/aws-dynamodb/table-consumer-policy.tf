@@ -12,7 +12,8 @@ data "aws_iam_policy_document" "consumer" {
       effect  = "Allow"
       actions = var.allowed_actions
       resources = [
-        aws_dynamodb_table.table.arn
+        aws_dynamodb_table.table.arn,
+        "${aws_dynamodb_table.table.arn}/index/*"
       ]
     }
   }
@@ -21,6 +21,27 @@ resource "aws_dynamodb_table" "table" {
     }
   }
 
+  dynamic "attribute" {
+    for_each = local.index_key_attributes
+    content {
+      name = attribute.key
+      type = attribute.value[0]
+    }
+  }
+
+  dynamic "global_secondary_index" {
+    for_each = var.global_secondary_indexes
+    content {
+      name               = global_secondary_index.key
+      hash_key           = global_secondary_index.value.hash_key_info["name"]
+      range_key          = global_secondary_index.value.range_key_info == null ? null : global_secondary_index.value.range_key_info["name"]
+      projection_type    = global_secondary_index.value.projection_type
+      non_key_attributes = global_secondary_index.value.projection_type == "INCLUDE" ? global_secondary_index.value.non_key_attributes : null
+      read_capacity      = var.billing_mode_info["mode"] == "PROVISIONED" ? global_secondary_index.value.read_capacity : null
+      write_capacity     = var.billing_mode_info["mode"] == "PROVISIONED" ? global_secondary_index.value.write_capacity : null
+    }
+  }
+
   dynamic "server_side_encryption" {
     for_each = var.enable_kms_encryption ? [1] : []
     content {
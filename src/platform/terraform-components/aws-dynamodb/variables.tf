@@ -55,6 +55,24 @@ variable "ttl_attribute_name" {
   default     = ""
 }
 
+variable "global_secondary_indexes" {
+  description = <<EOF
+[Optional] Map of global secondary indexes of the DynamoDB table.
+Map key is the index name and value is the index configuration.
+Range key is optional, projection type is ALL, KEYS_ONLY or INCLUDE.
+Read and write capacity are only used in PROVISIONED mode.
+EOF
+  type = map(object({
+    hash_key_info      = map(string)
+    range_key_info     = optional(map(string))
+    projection_type    = string
+    non_key_attributes = optional(list(string))
+    read_capacity      = optional(number)
+    write_capacity     = optional(number)
+  }))
+  default = {}
+}
+
 ### DynamoDB Table Resource Policy
 variable "apply_table_policy" {
   description = "Whether to apply pre-defined bucket policy."
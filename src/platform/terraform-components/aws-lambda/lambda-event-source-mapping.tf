@@ -0,0 +1,16 @@
+# Consume SQS queues in batches, only failed messages are retried
+resource "aws_lambda_event_source_mapping" "sqs" {
+  for_each                           = var.sqs_event_source_info
+  event_source_arn                   = each.value.queue_arn
+  function_name                      = aws_lambda_function.function.arn
+  batch_size                         = each.value.batch_size
+  maximum_batching_window_in_seconds = each.value.maximum_batching_window_in_seconds
+  function_response_types            = ["ReportBatchItemFailures"]
+
+  dynamic "scaling_config" {
+    for_each = each.value.maximum_concurrency == null ? [] : [true]
+    content {
+      maximum_concurrency = each.value.maximum_concurrency
+    }
+  }
+}
@@ -100,6 +100,21 @@ EOF
   }
 }
 
+variable "sqs_event_source_info" {
+  description = <<EOF
+[Optional] Map of SQS queues the Lambda Function consumes in batches.
+Map key is logical queue name and value is the event source configuration.
+The Lambda Function must report batch item failures.
+EOF
+  type = map(object({
+    queue_arn                          = string
+    batch_size                         = number
+    maximum_batching_window_in_seconds = number
+    maximum_concurrency                = optional(number)
+  }))
+  default = {}
+}
+
 ### Lambda Performance
 variable "reserved_concurrent_executions" {
   description = <<EOF
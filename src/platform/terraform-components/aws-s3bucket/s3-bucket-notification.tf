@@ -16,7 +16,7 @@ resource "aws_s3_bucket_notification" "bucket_notification" {
   dynamic "queue" {
     for_each = var.bucket_notification_info.sqs_queue_arns
     content {
-      queue_arn     = sqs_queue.value
+      queue_arn     = queue.value
       events        = var.bucket_notification_info.events
       filter_prefix = var.bucket_notification_info.filter_prefix
       filter_suffix = var.bucket_notification_info.filter_suffix
@@ -26,7 +26,7 @@ resource "aws_s3_bucket_notification" "bucket_notification" {
   dynamic "topic" {
     for_each = var.bucket_notification_info.sns_topic_arns
     content {
-      topic_arn     = sns_topic.value
+      topic_arn     = topic.value
       events        = var.bucket_notification_info.events
       filter_prefix = var.bucket_notification_info.filter_prefix
       filter_suffix = var.bucket_notification_info.filter_suffix
@@ -56,3 +56,31 @@ resource "aws_s3_bucket_versioning" "bucket" {
     status = var.versioning_enabled ? "Enabled" : "Disabled"
   }
 }
+
+# Expire the objects under a prefix, and their noncurrent versions
+resource "aws_s3_bucket_lifecycle_configuration" "bucket" {
+  count  = length(var.lifecycle_expiration_rules) > 0 ? 1 : 0
+  bucket = aws_s3_bucket.bucket.id
+
+  dynamic "rule" {
+    for_each = var.lifecycle_expiration_rules
+    content {
+      id     = rule.value.id
+      status = "Enabled"
+
+      filter {
+        prefix = rule.value.prefix
+      }
+
+      expiration {
+        days = rule.value.expiration_days
+      }
+
+      noncurrent_version_expiration {
+        noncurrent_days = rule.value.noncurrent_expiration_days
+      }
+    }
+  }
+
+  depends_on = [aws_s3_bucket_versioning.bucket]
+}
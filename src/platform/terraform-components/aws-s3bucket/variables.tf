@@ -50,6 +50,17 @@ variable "expiration_days" {
   default     = 0
 }
 
+variable "lifecycle_expiration_rules" {
+  description = "[Optional] Lifecycle rules expiring the objects under a prefix after a number of days, and their noncurrent versions after a number of days"
+  type = list(object({
+    id                         = string
+    prefix                     = string
+    expiration_days            = number
+    noncurrent_expiration_days = number
+  }))
+  default = []
+}
+
 ### S3 Bucket Policy
 variable "apply_bucket_policy" {
   description = "Whether to apply pre-defined bucket policy."
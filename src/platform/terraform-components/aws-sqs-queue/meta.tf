@@ -0,0 +1,8 @@
+data "aws_caller_identity" "main" {}
+
+data "aws_region" "active" {}
+
+locals {
+  queue_dlq_name             = "${var.queue_name}-dlq"
+  queue_consumer_policy_name = "${var.queue_name}-consumer-policy"
+}
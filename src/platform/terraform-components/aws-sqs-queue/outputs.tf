@@ -0,0 +1,25 @@
+output "queue_name" {
+  value       = aws_sqs_queue.queue.name
+  description = "The name of the SQS queue."
+}
+
+output "queue_arn" {
+  value       = aws_sqs_queue.queue.arn
+  description = "The Amazon Resource Name (ARN) of the SQS queue."
+}
+
+output "queue_url" {
+  value       = aws_sqs_queue.queue.id
+  description = "The URL of the SQS queue."
+}
+
+output "dlq_arn" {
+  value       = var.max_receive_count > 0 ? aws_sqs_queue.dlq[0].arn : null
+  description = "The Amazon Resource Name (ARN) of the dead-letter queue."
+}
+
+### Consumer policy
+output "consumer_policy_arn" {
+  value       = aws_iam_policy.consumer.arn
+  description = "The Amazon Resource Name (ARN) of the IAM policy for the consumer."
+}
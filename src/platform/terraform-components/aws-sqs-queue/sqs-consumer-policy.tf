@@ -0,0 +1,19 @@
+resource "aws_iam_policy" "consumer" {
+  name   = local.queue_consumer_policy_name
+  policy = data.aws_iam_policy_document.consumer.json
+}
+
+data "aws_iam_policy_document" "consumer" {
+
+  dynamic "statement" {
+    for_each = length(var.allowed_actions) > 0 ? [1] : []
+    content {
+      sid     = "AllowActionsOnSQSQueue"
+      effect  = "Allow"
+      actions = var.allowed_actions
+      resources = [
+        aws_sqs_queue.queue.arn
+      ]
+    }
+  }
+}
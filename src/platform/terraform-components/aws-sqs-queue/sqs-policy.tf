@@ -0,0 +1,28 @@
+# Allow S3 Buckets of the account to send event notifications to the queue.
+# Specifying a specific S3 source_arn can create cyclic dependencies.
+# E.g., S3 bucket creation depends on SQS queue creation
+# (specifying as an S3 notification event target) and vice versa.
+resource "aws_sqs_queue_policy" "policy" {
+  queue_url = aws_sqs_queue.queue.id
+  policy    = data.aws_iam_policy_document.policy.json
+}
+
+data "aws_iam_policy_document" "policy" {
+  statement {
+    sid     = "AllowSendMessageFromS3Buckets"
+    effect  = "Allow"
+    actions = ["sqs:SendMessage"]
+    principals {
+      type        = "Service"
+      identifiers = ["s3.amazonaws.com"]
+    }
+    resources = [
+      aws_sqs_queue.queue.arn
+    ]
+    condition {
+      test     = "StringEquals"
+      variable = "aws:SourceAccount"
+      values   = [data.aws_caller_identity.main.account_id]
+    }
+  }
+}
@@ -0,0 +1,28 @@
+resource "aws_sqs_queue" "queue" {
+  name                       = var.queue_name
+  visibility_timeout_seconds = var.visibility_timeout_seconds
+  message_retention_seconds  = var.message_retention_seconds
+  receive_wait_time_seconds  = var.receive_wait_time_seconds
+  sqs_managed_sse_enabled    = true
+
+  redrive_policy = var.max_receive_count > 0 ? jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.dlq[0].arn
+    maxReceiveCount     = var.max_receive_count
+  }) : null
+
+  tags = merge({
+    Name = var.queue_name
+  }, var.tags)
+}
+
+# Dead-letter queue for messages that failed max_receive_count times
+resource "aws_sqs_queue" "dlq" {
+  count                     = var.max_receive_count > 0 ? 1 : 0
+  name                      = local.queue_dlq_name
+  message_retention_seconds = 1209600 # 14 days
+  sqs_managed_sse_enabled   = true
+
+  tags = merge({
+    Name = local.queue_dlq_name
+  }, var.tags)
+}
@@ -0,0 +1,47 @@
+### SQS Queue
+variable "queue_name" {
+  description = "The name of the SQS queue"
+  type        = string
+}
+
+variable "visibility_timeout_seconds" {
+  description = "The visibility timeout of the queue in seconds. Should be at least 6 times the timeout of the consuming Lambda function."
+  type        = number
+  default     = 180
+}
+
+variable "message_retention_seconds" {
+  description = "The number of seconds SQS retains a message"
+  type        = number
+  default     = 345600 # 4 days
+}
+
+variable "receive_wait_time_seconds" {
+  description = "The time in seconds for which a ReceiveMessage call waits for a message to arrive (long polling)"
+  type        = number
+  default     = 20
+}
+
+variable "max_receive_count" {
+  description = "Number of receives after which a message is moved to the dead-letter queue. A value of 0 disables the dead-letter queue."
+  type        = number
+  default     = 5
+}
+
+variable "allowed_actions" {
+  description = "List of SQS actions which are allowed for same account principals for the consumer policy"
+  type        = list(string)
+  default = [
+    "sqs:ReceiveMessage",
+    "sqs:DeleteMessage",
+    "sqs:ChangeMessageVisibility",
+    "sqs:GetQueueAttributes"
+  ]
+}
+
+### Metadata
+variable "tags" {
+  description = "Custom tags which can be passed on to the AWS resources. They should be key value pairs having distinct keys."
+  type        = map(any)
+  default     = {}
+}
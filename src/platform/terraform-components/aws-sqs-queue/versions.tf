@@ -0,0 +1,9 @@
+terraform {
+  required_providers {
+    aws = {
+      source  = "hashicorp/aws"
+      version = "= 5.45.0"
+    }
+  }
+  required_version = ">= 0.13"
+}